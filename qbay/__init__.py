@@ -1,6 +1,39 @@
 from flask import Flask
+from sqlalchemy.pool import QueuePool
 import os
 
+# SQLite settings applied to every new database connection, chosen by name
+# with the db_profile environment variable. 'default' keeps SQLite's own
+# settings. 'performance' lets readers and a writer work at the same time
+# (WAL), syncs to disk only at checkpoints, reads the file through a memory
+# map and waits for locks instead of failing with "database is locked".
+DB_PROFILES = {
+    'default': {},
+    'performance': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,
+    },
+}
+
+# Engine options of each profile, on top of its SQLite settings. SQLite
+# files otherwise get a new connection for every transaction, which throws
+# away the page cache and memory map the settings above set up and runs the
+# settings again. 'performance' keeps connections open in a pool instead.
+# Sessions are per thread and give their connection back when done, so
+# a connection may be picked up by another thread.
+DB_PROFILE_ENGINE_OPTIONS = {
+    'default': {},
+    'performance': {
+        'poolclass': QueuePool,
+        'pool_size': 5,
+        'connect_args': {'check_same_thread': False},
+    },
+}
+
 # Initialize Flask app and set database to local SQLite
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../db.sqlite'
@@ -10,3 +43,34 @@ if db_string:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../db.sqlite'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['QBAY_DB_PROFILE'] = os.getenv('db_profile') or 'default'
+if app.config['QBAY_DB_PROFILE'] not in DB_PROFILES:
+    raise ValueError('Unknown db_profile: ' + app.config['QBAY_DB_PROFILE'])
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = \
+        DB_PROFILE_ENGINE_OPTIONS[app.config['QBAY_DB_PROFILE']]
+
+# With optimistic inserts, register and create_product skip their
+# existence/uniqueness queries and let the database's constraints reject
+# duplicates, making a successful create a single INSERT
+app.config['QBAY_OPTIMISTIC_INSERTS'] = os.getenv('optimistic_inserts') == '1'
+
+# Listing views are kept in memory for up to QBAY_CACHE_TTL seconds, holding
+# at most QBAY_CACHE_SIZE of them. A size of 0 turns the cache off.
+app.config['QBAY_CACHE_SIZE'] = int(os.getenv('cache_size') or 128)
+app.config['QBAY_CACHE_TTL'] = float(os.getenv('cache_ttl') or 300)
+
+# Binary snapshot of the available catalog written by qbay.catalog_file.
+# When set, the CLI shows product pages from it while it is up to date.
+app.config['QBAY_CATALOG_FILE'] = os.getenv('catalog_file')
+
+# With balance stripes, sellers are credited on one of QBAY_BALANCE_STRIPES
+# rows of their own picked at random instead of on their balance, so that
+# sales by one seller do not all write the same row. 0 turns this off.
+app.config['QBAY_BALANCE_STRIPES'] = int(os.getenv('balance_stripes') or 0)
+
+# With the order queue, the CLI takes orders with submit_order and waits up
+# to QBAY_ORDER_WAIT seconds for qbay.settlement to settle them, instead of
+# settling them itself
+app.config['QBAY_ORDER_QUEUE'] = os.getenv('order_queue') == '1'
+app.config['QBAY_ORDER_WAIT'] = float(os.getenv('order_wait') or 5)
@@ -0,0 +1,259 @@
+from qbay.models import *
+from qbay.models import _commit
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import time
+
+'''
+This file defines bulk versions of the write operations in qbay.models, for
+loading many rows at once
+'''
+
+
+class BulkReport(namedtuple('BulkReport', ['results', 'inserted',
+                                           'elapsed'])):
+    '''
+    Outcome of a bulk operation
+
+    Attributes:
+        results (list) True or False for each input row, in input order,
+         matching what the single row operation would have returned
+        inserted (integer) number of rows written
+        elapsed (float) seconds taken
+    '''
+    __slots__ = ()
+
+    @property
+    def rows_per_sec(self):
+        '''
+        Throughput over every input row, accepted or not
+        '''
+        if self.elapsed <= 0:
+            return 0.0
+        return len(self.results) / self.elapsed
+
+
+def chunks(rows, chunk_size):
+    '''
+    Split an iterable into lists of at most chunk_size items
+
+    Parameters:
+        rows (iterable):      items to split
+        chunk_size (integer): maximum length of each list
+    '''
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def read_users(users):
+    '''
+    Read users given either as (name, email, password) tuples, as dicts with
+    those keys, or as a CSV stream with a name,email,password header
+
+    Parameters:
+        users (iterable or file): the users to read
+
+    Returns:
+        iterator of (name, email, password) tuples
+    '''
+    if hasattr(users, 'read'):
+        users = csv.DictReader(users)
+    for user in users:
+        if isinstance(user, dict):
+            yield (user.get('name') or '', user.get('email') or '',
+                   user.get('password') or '')
+        else:
+            yield tuple(user)
+
+
+def check_user(name, email, password):
+    '''
+    Apply the same format checks as register() to one user
+
+    Returns:
+        True if the user may be registered, ignoring duplicates
+    '''
+    return bool(email and password and check_email(email) and
+                check_pass(password) and check_username(name))
+
+
+def register_many(users, chunk_size=1000):
+    '''
+    Register many users at once. Users are validated with the same rules as
+    register(), then written chunk_size at a time: one query finds the
+    emails of a chunk that are already taken, one bulk insert adds the rest
+    and one commit saves them.
+
+    Parameters:
+        users (iterable or file): (name, email, password) tuples, dicts with
+                                  those keys, or a CSV stream with a
+                                  name,email,password header
+        chunk_size (integer):     users written per commit
+
+    Returns:
+        BulkReport with one result per user
+    '''
+    start = time.perf_counter()
+    results = []
+    inserted = 0
+    # emails accepted earlier in this import
+    seen = set()
+
+    for chunk in chunks(read_users(users), chunk_size):
+        # each row keeps its own check, since rows may share an email
+        checked = [(row, check_user(*row)) for row in chunk]
+        taken = {row.email for row in
+                 db.session.query(User.email)
+                 .filter(User.email.in_({row[1] for row, valid in checked
+                                         if valid}))}
+
+        new_users = []
+        for (name, email, password), valid in checked:
+            ok = valid and email not in taken and email not in seen
+            if ok:
+                seen.add(email)
+                new_users.append({'username': name, 'email': email,
+                                  'password': password})
+            results.append(ok)
+
+        if new_users:
+            db.session.execute(User.__table__.insert(), new_users)
+            _commit()
+            inserted += len(new_users)
+
+    return BulkReport(results, inserted, time.perf_counter() - start)
+
+
+def parse_product(row):
+    '''
+    Parse one product row and apply the same format checks as
+    create_product(). Seller existence and title uniqueness are left to the
+    caller since they need the database.
+
+    Parameters:
+        row (dict): title, description, price, seller_email and optionally
+                    date, either as values or as strings read from CSV
+
+    Returns:
+        dict of column values ready to insert, or None if the row is invalid
+    '''
+    try:
+        title = row['title']
+        description = row['description']
+        price = float(row['price'])
+        seller_email = row['seller_email']
+        date = row.get('date') or datetime.date.today()
+        if isinstance(date, str):
+            date = datetime.date.fromisoformat(date)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    if not (check_title(title) and check_description(description, title) and
+            check_price(price) and check_date(date) and seller_email):
+        return None
+
+    return {'title': title, 'description': description, 'price': price,
+            'last_modified_date': date, 'seller_email': seller_email}
+
+
+def parse_products(rows):
+    '''
+    Parse a chunk of product rows, see parse_product(). Runs in the worker
+    processes of create_products_bulk().
+    '''
+    return [parse_product(row) for row in rows]
+
+
+def write_products(parsed_chunks):
+    '''
+    Write chunks of parsed products, see parse_products(). Products whose
+    seller does not exist, or whose title the seller already uses, are
+    skipped.
+
+    Parameters:
+        parsed_chunks (iterable): lists of parsed products, None for rows
+                                  that failed validation
+
+    Returns:
+        (results, inserted) where results holds True or False for each row
+    '''
+    results = []
+    inserted = 0
+    # (seller_email, title) pairs written earlier in this load
+    seen = set()
+
+    for chunk in parsed_chunks:
+        sellers = {p['seller_email'] for p in chunk if p is not None}
+        titles = {p['title'] for p in chunk if p is not None}
+        existing_sellers = {row.email for row in
+                            db.session.query(User.email)
+                            .filter(User.email.in_(sellers))}
+        # a superset of the clashing pairs, narrowed down below
+        taken = {(row.seller_email, row.title) for row in
+                 db.session.query(Product.seller_email, Product.title)
+                 .filter(Product.seller_email.in_(existing_sellers),
+                         Product.title.in_(titles))}
+
+        new_products = []
+        for product in chunk:
+            ok = product is not None
+            if ok:
+                key = (product['seller_email'], product['title'])
+                ok = (product['seller_email'] in existing_sellers and
+                      key not in taken and key not in seen)
+            if ok:
+                seen.add(key)
+                new_products.append(product)
+            results.append(ok)
+
+        if new_products:
+            db.session.execute(Product.__table__.insert(), new_products)
+            _commit()
+            # the inserts bypass create_product, so cached listings are
+            # dropped rather than patched
+            clear_cache()
+            inserted += len(new_products)
+
+    return results, inserted
+
+
+def create_products_bulk(products, chunk_size=1000, workers=None):
+    '''
+    Create many products at once. Rows are parsed and validated in a pool of
+    worker processes with the same rules as create_product(), while this
+    process writes the results chunk_size at a time: one query finds which
+    sellers exist, one finds which titles those sellers already use, one bulk
+    insert adds the new products and one commit saves them.
+
+    Parameters:
+        products (iterable or file): dicts with title, description, price,
+                                     seller_email and optionally date keys,
+                                     or a CSV stream with those columns
+        chunk_size (integer):        products validated and written together
+        workers (integer):           worker processes, None for one per CPU
+                                     or 0 to validate in this process
+
+    Returns:
+        BulkReport with one result per product
+    '''
+    start = time.perf_counter()
+    if hasattr(products, 'read'):
+        products = csv.DictReader(products)
+
+    if workers == 0:
+        parsed_chunks = map(parse_products, chunks(products, chunk_size))
+        results, inserted = write_products(parsed_chunks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parsed_chunks = executor.map(parse_products,
+                                         chunks(products, chunk_size))
+            results, inserted = write_products(parsed_chunks)
+
+    return BulkReport(results, inserted, time.perf_counter() - start)
@@ -0,0 +1,265 @@
+from qbay.models import *
+import bisect
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+
+'''
+This file defines a binary snapshot file of the available catalog, written
+by a background job and memory mapped read-only by CLI processes, so that
+they share one copy in the page cache and can show product pages without
+querying the database:
+
+    python -m qbay.catalog_file PATH [INTERVAL]
+
+rewrites PATH whenever the catalog changes, checking every INTERVAL seconds.
+
+The file is a header, then one fixed-width record per product in id_num
+order, then a heap holding each distinct title and seller email once as
+UTF-8. Records point into the heap by offset and length.
+'''
+
+# Header: magic, catalog version, record count, heap offset
+HEADER = struct.Struct('<8sqqq')
+MAGIC = b'QBAYCAT1'
+
+# Record: id_num, price, title offset and length, seller offset and length
+RECORD = struct.Struct('<qdIHIH')
+
+# Seconds between checks for changes by the background job
+DEFAULT_INTERVAL = 1.0
+
+
+def _read_catalog():
+    '''
+    Read the available catalog together with the version it is at. The
+    version is read again afterwards and everything retried if a write came
+    in between.
+
+    Returns:
+        (version, list of ProductSummaries)
+    '''
+    while True:
+        version = get_catalog_version()
+        summaries = get_avail_summaries()
+        if get_catalog_version() == version:
+            return version, summaries
+
+
+def write_catalog_file(path):
+    '''
+    Write a snapshot of the available catalog to path. The file is written
+    next to path and renamed over it, so readers never see a partial file
+    and those that have the old one mapped keep it until they reopen.
+
+    Parameters:
+        path (string): file to write
+
+    Returns:
+        the catalog version written
+    '''
+    version, summaries = _read_catalog()
+
+    heap = bytearray()
+    offsets = {}
+
+    def intern(text):
+        # (offset, length) of text in the heap, adding it if new
+        data = text.encode('utf-8')
+        if data not in offsets:
+            offsets[data] = (len(heap), len(data))
+            heap.extend(data)
+        return offsets[data]
+
+    records = bytearray(RECORD.size * len(summaries))
+    for i, summary in enumerate(summaries):
+        RECORD.pack_into(records, i * RECORD.size, summary.id_num,
+                         summary.price, *intern(summary.title),
+                         *intern(summary.seller_email))
+
+    heap_offset = HEADER.size + len(records)
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as temp:
+            temp.write(HEADER.pack(MAGIC, version, len(summaries),
+                                   heap_offset))
+            temp.write(records)
+            temp.write(heap)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return version
+
+
+class _Ids:
+    '''
+    The id_num column of a CatalogFile as a sequence, for bisect
+    '''
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __len__(self):
+        return self.catalog.count
+
+    def __getitem__(self, i):
+        return self.catalog.id_num(i)
+
+
+class CatalogFile:
+    '''
+    A catalog snapshot file mapped read-only into memory. Nothing is
+    copied out of the file until a page of it is asked for.
+
+    Attributes:
+        path (string) the file
+        version (integer) catalog version the file was written at, see
+         get_catalog_version
+        count (integer) number of products
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count, self.heap_offset = \
+            HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError('Not a catalog file: ' + path)
+
+    def close(self):
+        '''
+        Unmap the file
+        '''
+        self.map.close()
+
+    def is_current(self):
+        '''
+        Check the file against the database's catalog version
+
+        Returns:
+            True if the catalog has not changed since the file was written
+        '''
+        return self.version == get_catalog_version()
+
+    def id_num(self, i):
+        '''
+        id_num of the product in record i
+        '''
+        return struct.unpack_from('<q', self.map,
+                                  HEADER.size + i * RECORD.size)[0]
+
+    def _text(self, offset, length):
+        '''
+        A string from the heap
+        '''
+        start = self.heap_offset + offset
+        return self.map[start:start + length].decode('utf-8')
+
+    def summary(self, i):
+        '''
+        The product in record i
+
+        Returns:
+            ProductSummary
+        '''
+        (id_num, price, title_offset, title_length, seller_offset,
+         seller_length) = RECORD.unpack_from(self.map,
+                                             HEADER.size + i * RECORD.size)
+        return ProductSummary(id_num, self._text(title_offset, title_length),
+                              price, self._text(seller_offset, seller_length))
+
+    def page(self, size, after=None, before=None):
+        '''
+        Get one page of products in id_num order, like
+        get_avail_products_page. The start or end of the page is found by
+        binary search over the records.
+
+        Parameters:
+            size (integer):   products per page
+            after (integer):  id_num the page starts after
+            before (integer): id_num the page ends before
+
+        Returns:
+            list of at most size ProductSummaries
+        '''
+        if before is not None:
+            last = bisect.bisect_left(_Ids(self), before)
+            return [self.summary(i) for i in range(max(0, last - size), last)]
+        first = 0
+        if after is not None:
+            first = bisect.bisect_right(_Ids(self), after)
+        return [self.summary(i)
+                for i in range(first, min(first + size, self.count))]
+
+    def __len__(self):
+        return self.count
+
+
+# Files opened by open_catalog_file, by path
+_opened = {}
+
+
+def open_catalog_file(path):
+    '''
+    Open a catalog file, reusing the mapping already open in this process
+    until the file is replaced by a newer one
+
+    Parameters:
+        path (string): the file
+
+    Returns:
+        CatalogFile, or None if there is no such file
+    '''
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    catalog = _opened.get(path)
+    if catalog is None or catalog.identity != (stat.st_ino,
+                                               stat.st_mtime_ns):
+        catalog = _opened[path] = CatalogFile(path)
+    return catalog
+
+
+def run_writer(path, interval=DEFAULT_INTERVAL, rounds=None):
+    '''
+    Keep a catalog file up to date, rewriting it whenever the catalog
+    version moves on
+
+    Parameters:
+        path (string):      file to keep up to date
+        interval (float):   seconds between checks
+        rounds (integer):   checks to make before returning, None to run
+                            forever
+
+    Returns:
+        number of times the file was written
+    '''
+    written = None
+    writes = 0
+    while rounds is None or rounds > 0:
+        if get_catalog_version() != written:
+            written = write_catalog_file(path)
+            writes += 1
+        # end the read so the next check sees other processes' writes
+        db.session.rollback()
+        if rounds is not None:
+            rounds -= 1
+            if rounds == 0:
+                break
+        time.sleep(interval)
+    return writes
+
+
+if __name__ == '__main__':
+    run_writer(sys.argv[1],
+               float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_INTERVAL)
@@ -1,4 +1,22 @@
 from qbay.models import *
+from qbay.catalog_file import open_catalog_file
+from qbay.titles import SUGGESTIONS, complete_titles, suggest_titles
+import time
+
+try:
+    import readline
+except ImportError:
+    # no line editing on this platform, so titles are not tab completed
+    readline = None
+
+# Products shown per page when browsing
+PAGE_SIZE = 20
+
+# Products each user has put in their cart, as ProductSummaries by email
+carts = {}
+
+# Seconds between checks on a queued order's outcome
+ORDER_POLL_INTERVAL = 0.1
 
 
 def home_page(user):
@@ -20,6 +38,8 @@ def home_page(user):
         print('(4) Return to login page')
         print('(5) View products available for purchase')
         print('(6) View products you sold')
+        print('(7) Search products')
+        print('(8) Check out cart')
         selection = input()
         selection = selection.strip()
 
@@ -47,6 +67,14 @@ def home_page(user):
         elif selection == '6':
             sold_products_page(user)
 
+        # Search products
+        elif selection == '7':
+            search_page(user)
+
+        # Check out cart
+        elif selection == '8':
+            checkout_page(user)
+
         else:
             print('Invalid option')
 
@@ -81,6 +109,46 @@ def register_page():
         print('Registration failed')
 
 
+def title_completer(user):
+    """
+    Readline completer for the user's product titles. The whole line
+    typed so far is completed, not just its last word.
+    """
+    matches = []
+
+    def complete(text, state):
+        # readline asks for each match in turn, starting from state 0
+        if state == 0:
+            matches[:] = complete_titles(user.email, text)
+        if state < len(matches):
+            return matches[state]
+        return None
+    return complete
+
+
+def input_title(user, prompt):
+    """
+    Prompt for one of the user's product titles, completing it from
+    their titles when tab is pressed where line editing is available.
+    """
+    if readline is None:
+        return input(prompt)
+
+    completer = readline.get_completer()
+    delims = readline.get_completer_delims()
+    readline.set_completer(title_completer(user))
+    readline.set_completer_delims('')
+    if 'libedit' in (readline.__doc__ or ''):
+        readline.parse_and_bind('bind ^I rl_complete')
+    else:
+        readline.parse_and_bind('tab: complete')
+    try:
+        return input(prompt)
+    finally:
+        readline.set_completer(completer)
+        readline.set_completer_delims(delims)
+
+
 # based on user and current products, select product and update element(s)
 def update_product_page(user):
     '''
@@ -92,10 +160,29 @@ def update_product_page(user):
     '''
 
     # Find existing product
-    product_title = input('Please input product title:').strip()
+    product_title = input_title(user, 'Please input product title:').strip()
     product = Product.query.filter_by(seller_email=user.email,
                                       title=product_title).first()
 
+    # Offer the user's titles starting with what was typed, or else the
+    # closest ones, if it does not
+    if product is None:
+        suggestions = (complete_titles(user.email, product_title,
+                                       SUGGESTIONS) or
+                       suggest_titles(user.email, product_title))
+        if suggestions:
+            print('Product does not exist. Did you mean:')
+            for i in range(0, len(suggestions)):
+                print(str(i + 1) + '. ' + suggestions[i])
+            selection = input('Enter the number of the product to update, '
+                              'or hit enter to return to the homepage.')
+            selection = selection.strip()
+            if (selection.isdigit() and
+                    1 <= int(selection) <= len(suggestions)):
+                product_title = suggestions[int(selection) - 1]
+                product = Product.query.filter_by(
+                    seller_email=user.email, title=product_title).first()
+
     # Check if user's product exists
     if product is None:
         print('Error - Product does not exist. You will '
@@ -225,62 +312,222 @@ def update_profile_page(user):
 
 def available_products_page(user):
     """
-    Available products page, where a user can view products that
-    are still available for purchase, and then navigate to the
-    order page.
+    Available products page, where a user can browse products that
+    are still available for purchase one page at a time, and then
+    navigate to the order page. Each page is only fetched when the
+    user asks for it.
     """
-    # Get available products
-    available_products = get_avail_products()
+    def fetch_page(after=None, before=None):
+        # Going forwards, one product more than fits is asked for to tell
+        # whether there is a next page. Going back there always is one.
+        # Pages come from the catalog file when there is an up to date one.
+        size = PAGE_SIZE if before is not None else PAGE_SIZE + 1
+        catalog = None
+        if app.config['QBAY_CATALOG_FILE']:
+            catalog = open_catalog_file(app.config['QBAY_CATALOG_FILE'])
+        if catalog is not None and catalog.is_current():
+            products = catalog.page(size, after=after, before=before)
+        else:
+            products = get_avail_products_page(size, after=after,
+                                               before=before)
+        if before is not None:
+            return products, True
+        return products[:PAGE_SIZE], len(products) > PAGE_SIZE
 
-    # Print the list of products
-    print("Products available for purchase.\n")
-    for i in range(0, len(available_products)):
-        print(str(i + 1) + ". " + available_products[i].title +
-              " ($" + str(available_products[i].price) + ")")
+    # Get the first page
+    page_number = 1
+    page, has_next = fetch_page()
 
-    print("\nTo view a product, enter the number to its left.")
-    print("Or hit enter (without input) to return to the main menu.")
-    # User selection
-    selection = input()
-    selection = selection.strip()
+    while True:
+        paged = page_number > 1 or has_next
+        first = (page_number - 1) * PAGE_SIZE + 1
 
-    # Get product from list, and navigate to order page
-    if selection.isdigit() and 1 <= int(selection) <= len(available_products):
-        product = available_products[int(selection) - 1]
-        order_page(user, product)
-    else:
-        print("Returning to main menu.")
+        # Print the page of products, numbered across pages
+        if paged:
+            print("Products available for purchase (page " +
+                  str(page_number) + ").\n")
+        else:
+            print("Products available for purchase.\n")
+        for i in range(0, len(page)):
+            print(str(first + i) + ". " + page[i].title +
+                  " ($" + str(page[i].price) + ")")
+
+        print("\nTo view a product, enter the number to its left.")
+        if paged:
+            print("Enter 'n' for the next page, 'p' for the previous "
+                  "page or 'page N' to jump to page N.")
+        print("Or hit enter (without input) to return to the main menu.")
+        # User selection
+        selection = input()
+        selection = selection.strip()
+
+        # Move to the next page, continuing after this page's last product.
+        # The products there may have been sold since this page was shown.
+        if selection == 'n':
+            following, following_has_next = [], False
+            if has_next:
+                following, following_has_next = fetch_page(page[-1].id_num)
+            if following:
+                page_number += 1
+                page, has_next = following, following_has_next
+            else:
+                has_next = False
+                print("There is no next page.")
+
+        # Move to the previous page, ending before this page's first
+        # product
+        elif selection == 'p':
+            if page_number > 1:
+                page_number -= 1
+                page, has_next = fetch_page(before=page[0].id_num)
+            else:
+                print("There is no previous page.")
+
+        # Jump to a page. Pages further on are skipped to from the end of
+        # this page, earlier ones from the start.
+        elif (selection.startswith('page ') and
+              selection[5:].strip().isdigit()):
+            target = int(selection[5:])
+            if target > page_number:
+                skip = (target - page_number - 1) * PAGE_SIZE
+                if not has_next:
+                    cursor = None
+                elif skip == 0:
+                    cursor = page[-1].id_num
+                else:
+                    cursor = skip_avail_products(skip, after=page[-1].id_num)
+            elif target > 1:
+                cursor = skip_avail_products((target - 1) * PAGE_SIZE)
+            else:
+                cursor = None
+
+            if target == 1 or cursor is not None:
+                jumped, jumped_has_next = fetch_page(cursor)
+            else:
+                jumped, jumped_has_next = [], False
+            if jumped:
+                page_number = target
+                page, has_next = jumped, jumped_has_next
+            else:
+                print("There is no page " + str(target) + ".")
+
+        # Get product from the page, and navigate to order page
+        elif (selection.isdigit() and
+              first <= int(selection) < first + len(page)):
+            product = page[int(selection) - first]
+            order_page(user, product)
+            return
+        else:
+            print("Returning to main menu.")
+            return
+
+
+def search_page(user):
+    """
+    Search page, where a user can find available products by words in
+    their title or description, browse the results one page at a time,
+    best matches first, and then navigate to the order page.
+    """
+    text = input("Please enter search terms: ").strip()
+
+    def fetch_page(number):
+        # One result more than fits is asked for to tell whether there
+        # is a next page
+        results = search_products(text, PAGE_SIZE + 1, page=number - 1)
+        return results[:PAGE_SIZE], len(results) > PAGE_SIZE
+
+    page_number = 1
+    page, has_next = fetch_page(page_number)
+    if not page:
+        print("No products match your search.")
         return
 
+    while True:
+        first = (page_number - 1) * PAGE_SIZE + 1
+
+        # Print the page of results, numbered across pages
+        print("Search results (page " + str(page_number) + ").\n")
+        for i in range(0, len(page)):
+            print(str(first + i) + ". " + page[i].title +
+                  " ($" + str(page[i].price) + ")")
+
+        print("\nTo view a product, enter the number to its left.")
+        if page_number > 1 or has_next:
+            print("Enter 'n' for the next page or 'p' for the previous "
+                  "page.")
+        print("Or hit enter (without input) to return to the main menu.")
+        # User selection
+        selection = input()
+        selection = selection.strip()
+
+        # Move between pages of results
+        if selection == 'n' and has_next:
+            page_number += 1
+            page, has_next = fetch_page(page_number)
+        elif selection == 'p' and page_number > 1:
+            page_number -= 1
+            page, has_next = fetch_page(page_number)
+
+        # Get product from the page, and navigate to order page
+        elif (selection.isdigit() and
+              first <= int(selection) < first + len(page)):
+            product = page[int(selection) - first]
+            order_page(user, product)
+            return
+        else:
+            print("Returning to main menu.")
+            return
+
 
 def order_page(user, product):
     """
     Order page, where a User can see the detailed information about
-    a product, and place an order.
+    a product, and place an order. The product is a summary from the
+    listing, so its description is only fetched now.
     """
     # Print product details
     print("Title: " + product.title)
     print("Price: " + str(product.price))
     print("Seller: " + product.seller_email)
-    print("Description: " + product.description)
+    print("Description: " + get_product_description(product.id_num))
 
     print("\nTo order this product, enter 'order'.")
+    print("To add it to your cart, enter 'cart'.")
     print("Or hit enter (without input) to return to the main menu.")
     # Get User input
     choice = input()
     choice = choice.strip()
 
-    # Place order
+    # Add to cart, to be ordered together with other products later
+    if choice.lower() == "cart":
+        cart = carts.setdefault(user.email, [])
+        if product in cart:
+            print("Product is already in your cart.")
+        else:
+            cart.append(product)
+            print("Product added to your cart.")
+        return
+
+    # Place order, or with the order queue, hand it to the settlement job
     if choice.lower() == "order":
-        result = order(product.title,
-                       product.seller_email,
-                       user.email)
-        if result is True:
+        if app.config['QBAY_ORDER_QUEUE']:
+            result = wait_for_order(submit_order(product.title,
+                                                 product.seller_email,
+                                                 user.email))
+        else:
+            result = place_order(product.title,
+                                 product.seller_email,
+                                 user.email)
+        if result == ORDER_PLACED:
             print("Product successfully ordered!")
-            print("Your new balance is " + str(user.balance))
+            print("Your new balance is " + str(get_balance(user.email)))
+            return
+        elif result == ORDER_PENDING:
+            print("Your order has been received and will be placed "
+                  "shortly.")
             return
         else:
-            print("Order was unsuccessful.")
+            print("Order was unsuccessful: " + result + ".")
             return
 
     else:
@@ -288,18 +535,85 @@ def order_page(user, product):
         return
 
 
+def wait_for_order(intake_num):
+    """
+    Poll a queued order's outcome until it is settled or
+    QBAY_ORDER_WAIT seconds have passed, and return the outcome.
+    """
+    deadline = time.monotonic() + app.config['QBAY_ORDER_WAIT']
+    while True:
+        result = get_order_outcome(intake_num)
+        if result != ORDER_PENDING or time.monotonic() >= deadline:
+            return result
+        time.sleep(ORDER_POLL_INTERVAL)
+
+
+def checkout_page(user):
+    """
+    Checkout page, where a User can see the products in their cart and
+    order them all together. Either every product is ordered or none are.
+    """
+    cart = carts.get(user.email, [])
+    if not cart:
+        print("Your cart is empty.")
+        return
+
+    # Display cart
+    print("Your cart:\n")
+    for i in range(0, len(cart)):
+        print(str(i + 1) + ". " + cart[i].title +
+              " ($" + str(cart[i].price) + ")")
+    print("\nTotal: $" + str(sum(product.price for product in cart)))
+
+    print("\nTo order every product in your cart, enter 'order'.")
+    print("To empty your cart, enter 'clear'.")
+    print("Or hit enter (without input) to return to the main menu.")
+    # Get User input
+    choice = input()
+    choice = choice.strip()
+
+    # Place one order for the whole cart
+    if choice.lower() == "order":
+        outcome = place_cart_order(
+            [(product.title, product.seller_email) for product in cart],
+            user.email)
+        if outcome.result == ORDER_PLACED:
+            del carts[user.email]
+            print("Products successfully ordered!")
+            print("Your new balance is " + str(get_balance(user.email)))
+        elif outcome.item is not None:
+            print("Order was unsuccessful: " + outcome.result + " (" +
+                  outcome.item[0] + ").")
+        else:
+            print("Order was unsuccessful: " + outcome.result + ".")
+        return
+
+    # Empty cart
+    elif choice.lower() == "clear":
+        del carts[user.email]
+        print("Your cart is now empty.")
+        return
+
+    else:
+        print("returning to main menu.")
+        return
+
+
 def sold_products_page(user):
     """
     Page where a User can view the products that they sold.
     Note that Users can only ever see their own sold products.
     """
-    sold_products = get_sold_products(user.email)
+    report = get_sales_report(user.email)
+    sold_products = report.sales
     print("Your sold products:\n")
 
     # Display sold products
     for i in range(0, len(sold_products)):
         print(str(i + 1) + ". " + sold_products[i].title +
               " ($" + str(sold_products[i].price) + ")")
+    print("\nTotal: " + str(report.count) + " sold for $" +
+          str(report.revenue))
 
     print("\nTo view a product's details, enter the number to its left.")
     print("Or hit enter (without input) to return to the main menu.")
@@ -307,20 +621,14 @@ def sold_products_page(user):
     selection = input()
     selection = selection.strip()
     if selection.isdigit() and 1 <= int(selection) <= len(sold_products):
-        product = sold_products[int(selection) - 1]
-        print("Title: " + product.title)
-        print("Price: " + str(product.price))
-        print("Seller: " + product.seller_email)
-        print("Description: " + product.description)
+        sale = sold_products[int(selection) - 1]
+        print("Title: " + sale.title)
+        print("Price: " + str(sale.price))
+        print("Seller: " + user.email)
+        print("Buyer: " + sale.buyer_email)
+        print("Description: " + get_product_description(sale.id_num))
         escape = input("\nHit enter (without input) to return to the "
                        "main menu.")
         return
     else:
         return
-
-
-
-
-
-
-
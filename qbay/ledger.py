@@ -0,0 +1,181 @@
+from qbay.models import *
+from qbay.models import _begin_immediate
+from collections import namedtuple
+import sys
+
+'''
+This file reconciles the ledger of balance movements written by orders,
+checking only what was written since the last checkpoint:
+
+    python -m qbay.ledger
+
+reports anything that does not add up and, if nothing is wrong, writes a
+new checkpoint so the next run starts from here. Run it regularly, such
+as from cron, to keep each run short.
+
+A database file is given a first checkpoint after the sales made before
+it had a ledger when the ledger is added. For one whose ledger was added
+without it, start reconciling from its current state with:
+
+    python -m qbay.ledger --baseline
+'''
+
+
+class Reconciliation(namedtuple('Reconciliation',
+                                ['entries', 'sales', 'accounts',
+                                 'problems'])):
+    '''
+    What a reconciliation covered and found
+
+    Attributes:
+        entries (integer) ledger entries checked
+        sales (integer) transactions checked
+        accounts (integer) users whose balances were checked
+        problems (list) descriptions of what did not add up, empty if
+         nothing
+    '''
+    __slots__ = ()
+
+
+def _last_checkpoint():
+    '''
+    (entry_id_num, transaction_id_num) of the last checkpoint, zeros if
+    there is none
+    '''
+    last = (db.session.query(LedgerCheckpoint.entry_id_num,
+                             LedgerCheckpoint.transaction_id_num)
+            .order_by(LedgerCheckpoint.id_num.desc())
+            .first())
+    return tuple(last) if last is not None else (0, 0)
+
+
+def write_checkpoint(entry_id_num=None, transaction_id_num=None):
+    '''
+    Mark the ledger as reconciled up to a point, by default everything
+    written so far
+
+    Parameters:
+        entry_id_num (integer):       last ledger entry covered
+        transaction_id_num (integer): last transaction covered
+
+    Returns:
+        the LedgerCheckpoint
+    '''
+    if entry_id_num is None:
+        entry_id_num = db.session.query(
+            db.func.coalesce(db.func.max(LedgerEntry.id_num), 0)).scalar()
+    if transaction_id_num is None:
+        transaction_id_num = db.session.query(
+            db.func.coalesce(db.func.max(Transaction.id_num), 0)).scalar()
+    checkpoint = LedgerCheckpoint(entry_id_num=entry_id_num,
+                                  transaction_id_num=transaction_id_num,
+                                  date=datetime.datetime.now())
+    db.session.add(checkpoint)
+    db.session.commit()
+    return checkpoint
+
+
+def reconcile_ledger(checkpoint=True):
+    '''
+    Check the ledger entries and transactions written since the last
+    checkpoint. Entries must sum to 0, every sale must be a debit of its
+    buyer and a credit of its seller for its price, and every user's
+    entries must carry on from their previous entry and end at their
+    current balance. Only the new entries and sales are read, plus one
+    earlier entry per user, so the time taken grows with the activity
+    since the checkpoint rather than with the whole history.
+
+    The database is locked against writes while this runs, so that orders
+    cannot land between what is read.
+
+    Parameters:
+        checkpoint (bool): write a new checkpoint if nothing is wrong
+
+    Returns:
+        Reconciliation
+    '''
+    _begin_immediate()
+    after_entry, after_sale = _last_checkpoint()
+    entries = (db.session.query(LedgerEntry.id_num, LedgerEntry.email,
+                                LedgerEntry.amount, LedgerEntry.balance,
+                                LedgerEntry.product_id_num)
+               .filter(LedgerEntry.id_num > after_entry)
+               .order_by(LedgerEntry.id_num)
+               .all())
+    sales = (db.session.query(Transaction.id_num,
+                              Transaction.product_id_num,
+                              Transaction.price, Transaction.buyer_email,
+                              Product.seller_email)
+             .join(Product, Product.id_num == Transaction.product_id_num)
+             .filter(Transaction.id_num > after_sale)
+             .order_by(Transaction.id_num)
+             .all())
+    problems = []
+
+    # money only moves between users, never in or out
+    total = sum(entry.amount for entry in entries)
+    if total != 0:
+        problems.append('entries sum to %d cents instead of 0' % total)
+
+    # each sale is its buyer paying its seller its price
+    moved = {}
+    for entry in entries:
+        moved.setdefault(entry.product_id_num, []).append(
+            (entry.email, entry.amount))
+    for sale in sales:
+        cents = to_cents(sale.price)
+        expected = sorted([(sale.buyer_email, -cents),
+                           (sale.seller_email, cents)])
+        if sorted(moved.pop(sale.product_id_num, [])) != expected:
+            problems.append('sale of product %d does not match its '
+                            'entries' % sale.product_id_num)
+    for id_num in moved:
+        problems.append('entries for product %d have no sale' % id_num)
+
+    # each user's entries carry on from their previous one and end at
+    # their balance
+    accounts = {}
+    for entry in entries:
+        accounts.setdefault(entry.email, []).append(entry)
+    for email, own in accounts.items():
+        running = (db.session.query(LedgerEntry.balance)
+                   .filter(LedgerEntry.email == email,
+                           LedgerEntry.id_num < own[0].id_num)
+                   .order_by(LedgerEntry.id_num.desc())
+                   .limit(1)
+                   .scalar())
+        if running is None:
+            # the user's first entry, so nothing to carry on from
+            running = own[0].balance - own[0].amount
+        for entry in own:
+            running += entry.amount
+            if entry.balance != running:
+                problems.append('entry %d leaves %s with %d cents instead '
+                                'of %d' % (entry.id_num, email,
+                                           entry.balance, running))
+                running = entry.balance
+        balance = to_cents(get_balance(email))
+        if balance != running:
+            problems.append('%s has %d cents but the ledger says %d'
+                            % (email, balance, running))
+
+    if checkpoint and not problems and (entries or sales):
+        write_checkpoint(entries[-1].id_num if entries else after_entry,
+                         sales[-1].id_num if sales else after_sale)
+    else:
+        db.session.rollback()
+    return Reconciliation(len(entries), len(sales), len(accounts), problems)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--baseline']:
+        checkpoint = write_checkpoint()
+        print('Reconciling from entry %d and sale %d'
+              % (checkpoint.entry_id_num, checkpoint.transaction_id_num))
+        sys.exit(0)
+    result = reconcile_ledger()
+    print('Checked %d entries, %d sales and %d balances'
+          % (result.entries, result.sales, result.accounts))
+    for problem in result.problems:
+        print(problem)
+    sys.exit(1 if result.problems else 0)
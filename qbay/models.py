@@ -1,7 +1,17 @@
-from qbay import app
+from qbay import app, DB_PROFILES
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.sql.expression import Insert, Update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from collections import namedtuple, OrderedDict
+import bisect
+import contextlib
 import datetime
+import random
 import re
+import threading
+import time
+import warnings
 
 '''
 This file defines data models and related business logics
@@ -12,6 +22,44 @@ This file defines data models and related business logics
 db = SQLAlchemy(app)
 
 
+def _apply_db_profile(dbapi_connection, connection_record):
+    '''
+    Apply the SQLite settings of the configured profile to a new connection,
+    see DB_PROFILES
+    '''
+    cursor = dbapi_connection.cursor()
+    # SQLite leaves foreign keys unchecked unless asked. The checks in this
+    # file normally catch bad references first, but optimistic inserts rely
+    # on the constraint.
+    cursor.execute('PRAGMA foreign_keys = ON')
+    for name, value in DB_PROFILES[app.config['QBAY_DB_PROFILE']].items():
+        cursor.execute('PRAGMA %s = %s' % (name, value))
+    cursor.close()
+
+
+if db.engine.dialect.name == 'sqlite':
+    event.listen(db.engine, 'connect', _apply_db_profile)
+
+# Product statuses. A product is listed for purchase only while available.
+PRODUCT_AVAILABLE = 'available'
+PRODUCT_SOLD = 'sold'
+PRODUCT_DELISTED = 'delisted'
+
+# Outcomes of placing an order
+ORDER_PLACED = 'order placed'
+ORDER_NO_PRODUCT = 'product does not exist'
+ORDER_SOLD = 'product has already been sold'
+ORDER_OWN_PRODUCT = 'cannot order your own product'
+ORDER_NO_BUYER = 'buyer does not exist'
+ORDER_INSUFFICIENT_FUNDS = 'insufficient balance'
+ORDER_INVALID_DATE = 'order date is out of range'
+ORDER_EMPTY_CART = 'cart is empty'
+ORDER_PENDING = 'order pending'
+
+# Orders settled per group commit by settle_orders
+SETTLE_BATCH_SIZE = 100
+
+
 class User(db.Model):
     '''
     User class that extends the database model class by default. Will be
@@ -62,6 +110,7 @@ class Product(db.Model):
         price (float) in CAD
         last_modified_date (datetime)
         seller_email (string)
+        status (string) one of available, sold or delisted
     '''
 
     id_num = db.Column(db.Integer, primary_key=True)
@@ -75,9 +124,25 @@ class Product(db.Model):
     seller_email = db.Column(db.String(80), db.ForeignKey('user.email'),
                              nullable=False)
 
+    # availability, flipped to sold by order() in the same commit as the
+    # transaction so listings never need to look at the transaction table
+    status = db.Column(db.String(10), nullable=False,
+                       default=PRODUCT_AVAILABLE,
+                       server_default=PRODUCT_AVAILABLE)
+
     # one-to-many relationship with transaction
     transactions = db.relationship('Transaction', backref='product', lazy=True)
 
+    # products are looked up by seller and title on every write path, and a
+    # seller cannot have two products with the same title. The catalog only
+    # lists available products, so those get a partial index of their own.
+    __table_args__ = (
+        db.Index('ix_product_seller_title', 'seller_email', 'title',
+                 unique=True),
+        db.Index('ix_product_available', 'id_num',
+                 sqlite_where=db.text("status = 'available'")),
+    )
+
     # stretch goals:
     # size = db.Column(db.String(20), nullable=False)
     # category = db.Column(db.String(40), nulltable=False)
@@ -107,13 +172,19 @@ class Transaction(db.Model):
     buyer_email = db.Column(db.String(80), db.ForeignKey('user.email'),
                             nullable=False)
 
-    # foreign key to product table
+    # foreign key to product table. A product can only be sold once, and
+    # its status records that it was, see Product.status.
     product_id_num = db.Column(db.Integer, db.ForeignKey('product.id_num'),
-                               nullable=False)
+                               nullable=False, index=True, unique=True)
 
     date = db.Column(db.DateTime, default=datetime.datetime.now())
     price = db.Column(db.Float, nullable=False)
 
+    # purchase history of a buyer, ordered by date
+    __table_args__ = (
+        db.Index('ix_transaction_buyer_date', 'buyer_email', 'date'),
+    )
+
     def __repr__(self):
         return '<Transaction %r>' % self.id_num
 
@@ -134,7 +205,7 @@ class Review(db.Model):
 
     # foreign key to user table
     seller_email = db.Column(db.String(80), db.ForeignKey('user.email'),
-                             nullable=False)
+                             nullable=False, index=True)
 
     rating = db.Column(db.Integer, nullable=False)
     feedback = db.Column(db.Text)
@@ -144,8 +215,514 @@ class Review(db.Model):
         return "<Review %r>" % self.id_num
 
 
+class BalanceDelta(db.Model):
+    '''
+    Credits to a user not yet folded into their balance, used instead of
+    User.balance when QBAY_BALANCE_STRIPES is set. Each user's credits are
+    spread over that many stripes, so concurrent sales by one seller
+    update different rows. fold_balances moves them into User.balance.
+
+    Attributes:
+        email (string) user credited
+        stripe (integer) from 0 to QBAY_BALANCE_STRIPES - 1
+        amount (float) sum of the credits in CAD
+    '''
+
+    __tablename__ = 'balance_delta'
+
+    email = db.Column(db.String(120), db.ForeignKey('user.email'),
+                      primary_key=True)
+    stripe = db.Column(db.Integer, primary_key=True)
+    amount = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return '<BalanceDelta %r %r>' % (self.email, self.stripe)
+
+
+class LedgerEntry(db.Model):
+    '''
+    One movement of money to or from a user's balance. Entries are only
+    ever added, never changed, and amounts are whole cents so that they
+    add up exactly. Each sale is a debit of the buyer and a credit of the
+    seller for the same product, so the entries of every order sum to 0.
+
+    Attributes:
+        id_num (integer) entry number, in the order entries were written
+        email (string) user whose balance moved
+        amount (integer) cents added, negative for a debit
+        balance (integer) the user's balance afterwards in cents, credits
+         waiting on balance stripes included
+        product_id_num (integer) product the money was paid for
+    '''
+
+    __tablename__ = 'ledger_entry'
+
+    id_num = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), db.ForeignKey('user.email'),
+                      nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    balance = db.Column(db.Integer, nullable=False)
+    product_id_num = db.Column(db.Integer, db.ForeignKey('product.id_num'),
+                               nullable=False)
+
+    # a user's entries are walked in order when reconciling, and a sale's
+    # entries are found by product
+    __table_args__ = (
+        db.Index('ix_ledger_entry_email', 'email', 'id_num'),
+        db.Index('ix_ledger_entry_product', 'product_id_num'),
+    )
+
+    def __repr__(self):
+        return '<LedgerEntry %r>' % self.id_num
+
+
+class LedgerCheckpoint(db.Model):
+    '''
+    The point up to which the ledger has been reconciled, see
+    qbay.ledger. The next reconciliation starts after it.
+
+    Attributes:
+        id_num (integer) checkpoint number
+        entry_id_num (integer) last ledger entry covered
+        transaction_id_num (integer) last transaction covered
+        date (datetime) when the checkpoint was written
+    '''
+
+    __tablename__ = 'ledger_checkpoint'
+
+    id_num = db.Column(db.Integer, primary_key=True)
+    entry_id_num = db.Column(db.Integer, nullable=False)
+    transaction_id_num = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return '<LedgerCheckpoint %r>' % self.id_num
+
+
+class OrderIntake(db.Model):
+    '''
+    An order taken by submit_order, waiting for settle_orders to place it
+    or holding the outcome once it has. Nothing is checked when an order
+    is taken, so there are no foreign keys.
+
+    Attributes:
+        id_num (integer) intake number, in the order orders arrived
+        prod_title (string)
+        seller_email (string)
+        buyer_email (string)
+        date (date) time of order
+        result (string) outcome of place_order, None until settled
+    '''
+
+    __tablename__ = 'order_intake'
+
+    id_num = db.Column(db.Integer, primary_key=True)
+    prod_title = db.Column(db.String(80), nullable=False)
+    seller_email = db.Column(db.String(80), nullable=False)
+    buyer_email = db.Column(db.String(80), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    result = db.Column(db.String(40))
+
+    # settle_orders takes the oldest unsettled orders, so those get a
+    # partial index of their own
+    __table_args__ = (
+        db.Index('ix_order_intake_pending', 'id_num',
+                 sqlite_where=db.text('result IS NULL')),
+    )
+
+    def __repr__(self):
+        return '<OrderIntake %r>' % self.id_num
+
+
+class DataVersion(db.Model):
+    '''
+    Change counter of a table, bumped in the same transaction as every
+    write to the table, by a trigger on SQLite and by this module on other
+    databases. Processes sharing the database read it to tell whether
+    their cached views of the table are stale.
+
+    Attributes:
+        name (string) table name
+        version (integer) number of rows written to the table
+    '''
+
+    name = db.Column(db.String(20), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<DataVersion %r %r>" % (self.name, self.version)
+
+
+def _has_status_column():
+    '''
+    Check whether the product table has its status column, which database
+    files made before products had a status are missing
+    '''
+    columns = db.inspect(db.engine).get_columns('product')
+    return 'status' in [column['name'] for column in columns]
+
+
+def backfill_product_status():
+    '''
+    Bring a database file made before products had a status up to date. The
+    status column is added if missing, and products that already have a
+    transaction are marked as sold.
+
+    Returns:
+        number of products marked as sold
+    '''
+    if not _has_status_column():
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql(
+                "ALTER TABLE product ADD COLUMN status VARCHAR(10) "
+                "NOT NULL DEFAULT '" + PRODUCT_AVAILABLE + "'")
+
+    sold = db.exists().where(Transaction.product_id_num == Product.id_num)
+    count = (Product.query
+             .filter(Product.status == PRODUCT_AVAILABLE, sold)
+             .update({Product.status: PRODUCT_SOLD},
+                     synchronize_session=False))
+    db.session.commit()
+    return count
+
+
+def _duplicates(index):
+    '''
+    Find the values a unique index would refuse because several rows
+    already share them
+
+    Returns:
+        list of rows of the index's columns
+    '''
+    columns = list(index.columns)
+    repeated = (db.session.query(*columns).group_by(*columns)
+                .having(db.func.count() > 1).all())
+    # end the read, since the index is created on another connection
+    db.session.rollback()
+    return repeated
+
+
+def _rename_duplicate_titles(repeated):
+    '''
+    Give every product but the first of each seller's repeated titles a
+    title of its own, by adding the lowest free number to it. Database
+    files made before titles were unique per seller can hold repeats,
+    since update_product used to allow renaming a product to a title the
+    seller already used.
+
+    Parameters:
+        repeated (list): (seller_email, title) of each repeated title
+
+    Returns:
+        number of products renamed
+    '''
+    renamed = 0
+    for seller_email, title in repeated:
+        used = {row.title for row in db.session.query(Product.title)
+                .filter(Product.seller_email == seller_email)}
+        repeats = (db.session.query(Product.id_num)
+                   .filter(Product.seller_email == seller_email,
+                           Product.title == title)
+                   .order_by(Product.id_num).all())
+        number = 2
+        for repeat in repeats[1:]:
+            while True:
+                suffix = ' ' + str(number)
+                new_title = title[:80 - len(suffix)].rstrip() + suffix
+                number += 1
+                if new_title not in used:
+                    break
+            used.add(new_title)
+            Product.query.filter(Product.id_num == repeat.id_num).update(
+                {Product.title: new_title}, synchronize_session=False)
+            renamed += 1
+    db.session.commit()
+    return renamed
+
+
 # create all tables
+_has_ledger = db.inspect(db.engine).has_table('ledger_entry')
 db.create_all()
+if not _has_status_column():
+    backfill_product_status()
+
+# Sales made before the ledger have no entries, so a database file gaining
+# the ledger starts with a checkpoint after them, see qbay.ledger
+if not _has_ledger:
+    _last_sale = db.session.query(db.func.max(Transaction.id_num)).scalar()
+    if _last_sale is not None:
+        db.session.add(LedgerCheckpoint(entry_id_num=0,
+                                        transaction_id_num=_last_sale,
+                                        date=datetime.datetime.now()))
+    # end the read either way, so no transaction is left open
+    db.session.commit()
+
+
+# create_all only creates the indexes of tables it creates, so add any index
+# missing from a database file made before the index was declared. Rows
+# made before a unique index was declared may break it: repeated product
+# titles are renamed, while anything else is reported and the index left
+# out rather than guessing which row is wrong.
+for table in db.metadata.sorted_tables:
+    _existing = {index['name'] for index in
+                 db.inspect(db.engine).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name in _existing:
+            continue
+        _repeated = _duplicates(index) if index.unique else []
+        if _repeated and index.name == 'ix_product_seller_title':
+            _rename_duplicate_titles(_repeated)
+        elif _repeated:
+            warnings.warn('Not creating unique index %s: rows of %s already '
+                          'repeat %s' % (index.name, table.name,
+                                         ', '.join(str(tuple(row))
+                                                   for row in _repeated)))
+            continue
+        index.create(bind=db.engine)
+
+
+def _count_product_writes(connection, statement, multiparams, params,
+                          execution_options, result):
+    '''
+    Bump the product table's DataVersion by the rows a statement wrote to
+    the table, on the statement's connection so that it is part of the
+    same transaction. Used where the triggers below are not created.
+    '''
+    if (isinstance(statement, (Insert, Update)) and
+            getattr(statement.table, 'name', None) == 'product' and
+            result.rowcount != 0):
+        # a row count of -1 means the driver could not tell, so count one
+        connection.execute(
+            DataVersion.__table__.update()
+            .where(DataVersion.name == 'product')
+            .values(version=DataVersion.version + max(result.rowcount, 1)))
+
+
+# Count the rows written to the product table. Triggers catch every write,
+# including bulk loads and other processes, at no extra round trip. Other
+# databases count the writes made through this module instead.
+if db.engine.dialect.name == 'sqlite':
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT OR IGNORE INTO data_version (name, version) "
+            "VALUES ('product', 0)")
+        for operation in ('insert', 'update'):
+            connection.exec_driver_sql(
+                "CREATE TRIGGER IF NOT EXISTS product_version_" +
+                operation + " AFTER " + operation.upper() + " ON product "
+                "BEGIN UPDATE data_version SET version = version + 1 "
+                "WHERE name = 'product'; END")
+else:
+    if db.session.get(DataVersion, 'product') is None:
+        db.session.add(DataVersion(name='product', version=0))
+        db.session.commit()
+    event.listen(db.engine, 'after_execute', _count_product_writes)
+
+# Ledger entries are append-only, so the database refuses to change or
+# remove them
+if db.engine.dialect.name == 'sqlite':
+    with db.engine.begin() as connection:
+        for operation in ('update', 'delete'):
+            connection.exec_driver_sql(
+                "CREATE TRIGGER IF NOT EXISTS ledger_entry_no_" + operation +
+                " BEFORE " + operation.upper() + " ON ledger_entry "
+                "BEGIN SELECT RAISE(ABORT, 'ledger entries are append-only');"
+                " END")
+
+# Full-text index over product titles and descriptions for search_products.
+# It reads its text from the product table, and triggers keep it in step
+# with new products and with changes to either column. Without FTS5,
+# search_products falls back to LIKE matching.
+_FTS_INSERT = ("INSERT INTO product_fts (rowid, title, description) "
+               "VALUES (new.id_num, new.title, new.description);")
+_FTS_DELETE = ("INSERT INTO product_fts (product_fts, rowid, title, "
+               "description) VALUES ('delete', old.id_num, old.title, "
+               "old.description);")
+_FTS_TRIGGERS = {
+    'insert': "AFTER INSERT ON product BEGIN " + _FTS_INSERT + " END",
+    'update': ("AFTER UPDATE OF title, description ON product BEGIN " +
+               _FTS_DELETE + " " + _FTS_INSERT + " END"),
+    'delete': "AFTER DELETE ON product BEGIN " + _FTS_DELETE + " END",
+}
+
+_has_fts = False
+if db.engine.dialect.name == 'sqlite':
+    try:
+        with db.engine.begin() as connection:
+            created = connection.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master "
+                "WHERE name = 'product_fts'").first() is None
+            connection.exec_driver_sql(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING "
+                "fts5(title, description, content='product', "
+                "content_rowid='id_num')")
+            for operation, body in _FTS_TRIGGERS.items():
+                connection.exec_driver_sql(
+                    "CREATE TRIGGER IF NOT EXISTS product_fts_" +
+                    operation + " " + body)
+            # index the products that were there before the index
+            if created:
+                connection.exec_driver_sql(
+                    "INSERT INTO product_fts (product_fts) "
+                    "VALUES ('rebuild')")
+        _has_fts = True
+    except OperationalError:
+        # this SQLite was built without FTS5
+        pass
+
+
+# Depth of the batch() blocks open in each thread. Sessions are per thread, so
+# batching is too.
+_batch_state = threading.local()
+
+
+@contextlib.contextmanager
+def batch():
+    '''
+    Group the writes made inside the block into one commit. The write
+    functions below flush instead of committing while a batch is open, and
+    everything is committed together when the block exits, or rolled back if
+    it raises. Nested blocks join the outermost one.
+
+    Functions keep their usual return values inside a batch, but their
+    changes are only durable once the block has exited.
+
+    Usage:
+        with batch():
+            register(...)
+            create_product(...)
+    '''
+    depth = getattr(_batch_state, 'depth', 0)
+    _batch_state.depth = depth + 1
+    try:
+        yield
+    except BaseException:
+        if depth == 0:
+            db.session.rollback()
+            # cached views may have been patched with the abandoned writes
+            clear_cache()
+        raise
+    else:
+        if depth == 0:
+            db.session.commit()
+    finally:
+        _batch_state.depth = depth
+
+
+def _in_batch():
+    '''
+    Check whether a batch() block is open in this thread
+    '''
+    return getattr(_batch_state, 'depth', 0) > 0
+
+
+def _commit():
+    '''
+    Commit the session, or inside a batch() just flush it so the commit at
+    the end of the block saves the changes. Objects are expired either way so
+    they are reloaded with what the database now holds.
+    '''
+    if _in_batch():
+        db.session.flush()
+        db.session.expire_all()
+    else:
+        db.session.commit()
+
+
+# Existence checks used by the validators. They are built once because
+# building a statement costs more than running it.
+_USER_EXISTS = db.select(db.exists().where(
+    User.email == db.bindparam('email')))
+_PRODUCT_EXISTS = db.select(db.exists().where(
+    Product.seller_email == db.bindparam('seller_email'),
+    Product.title == db.bindparam('title')))
+
+
+def _exists(statement, **params):
+    '''
+    Run one of the SELECT EXISTS(...) statements above. Nothing but a single
+    flag is sent back, so no rows are turned into objects.
+
+    Parameters:
+        statement: _USER_EXISTS or _PRODUCT_EXISTS
+        params:    values for the statement's parameters
+
+    Returns:
+        True if a matching row exists, otherwise False
+    '''
+    return bool(db.session.execute(statement, params).scalar())
+
+
+def _optimistic_inserts():
+    '''
+    Check whether inserts are left to the database's constraints, see
+    QBAY_OPTIMISTIC_INSERTS
+    '''
+    return app.config['QBAY_OPTIMISTIC_INSERTS']
+
+
+def _begin_immediate():
+    '''
+    Start the session's transaction with a write lock. SQLite otherwise only
+    locks the database at the first write, after the reads a decision was
+    based on. Other databases lock the rows touched by conditional updates,
+    so nothing is needed there.
+    '''
+    connection = db.session.connection()
+    if (connection.dialect.name == 'sqlite' and
+            not connection.connection.in_transaction):
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def _savepoint():
+    '''
+    Inside a batch() open a savepoint, so that one failed operation can be
+    undone without losing the rest of the batch. The transaction is begun
+    first because SQLite would otherwise treat the savepoint as the start of
+    a transaction of its own.
+
+    Returns:
+        the savepoint, or None outside a batch
+    '''
+    if not _in_batch():
+        return None
+    _begin_immediate()
+    return db.session.begin_nested()
+
+
+def _rollback(savepoint):
+    '''
+    Undo a failed operation: back to its savepoint inside a batch(),
+    otherwise the whole session
+    '''
+    if savepoint is not None:
+        savepoint.rollback()
+    else:
+        db.session.rollback()
+
+
+def _insert(row):
+    '''
+    Save a new row. A row refused by a constraint, such as a duplicate
+    primary key or unique index, is undone instead of raising.
+
+    Parameters:
+        row: the new User or Product
+
+    Returns:
+        True if the row was saved, False if a constraint refused it
+    '''
+    savepoint = _savepoint()
+    db.session.add(row)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        _rollback(savepoint)
+        return False
+    if savepoint is not None:
+        savepoint.commit()
+    _commit()
+    return True
 
 
 def register(name, email, password):
@@ -176,19 +753,14 @@ def register(name, email, password):
     if not check_username(name):
         return False
 
-    # check if the email has been used:
-    existed = User.query.filter_by(email=email).all()
-    if len(existed) > 0:
+    # check if the email has been used, unless the primary key is left to
+    # refuse it
+    if not _optimistic_inserts() and _exists(_USER_EXISTS, email=email):
         return False
 
-    # create a new user
+    # create a new user and save it
     user = User(username=name, email=email, password=password)
-    # add it to the current database session
-    db.session.add(user)
-    # actually save the user object
-    db.session.commit()
-
-    return True
+    return _insert(user)
 
 
 def update_user(email, password, update_params):
@@ -233,7 +805,7 @@ def update_user(email, password, update_params):
     if 'username' in update_params:
         user.username = update_params['username']
     # actually save the user object
-    db.session.commit()
+    _commit()
 
     return True
 
@@ -249,10 +821,11 @@ def login(email, password):
     Returns:
         The user object if login succeeded otherwise None
     '''
-    valids = User.query.filter_by(email=email, password=password).all()
-    if len(valids) != 1:
+    # email is the primary key, so at most one user can match
+    user = db.session.get(User, email)
+    if user is None or user.password != password:
         return None
-    return valids[0]
+    return user
 
 
 def create_product(title,
@@ -292,25 +865,31 @@ def create_product(title,
     elif not check_date(date):
         return False
 
-    # check that seller_email is valid
-    elif not check_seller(seller_email):
+    # check that seller_email is valid. With optimistic inserts this and the
+    # uniqueness check below are left to the foreign key on seller_email and
+    # the unique index on (seller_email, title).
+    elif not _optimistic_inserts() and not check_seller(seller_email):
         return False
 
     # Check that the product's title has not already been used
-    elif not check_uniqueness(title, seller_email):
+    elif (not _optimistic_inserts() and
+          not check_uniqueness(title, seller_email)):
         return False
 
     else:
-        # create a new Product
+        # create a new Product and save it
         product = Product(title=title,
                           description=description,
                           price=price,
                           last_modified_date=date,
                           seller_email=seller_email)
-        # add product to the current database session
-        db.session.add(product)
-        # save product object
-        db.session.commit()
+        if not _insert(product):
+            return False
+        # the identity survives the commit, so this does not reload it
+        id_num = db.inspect(product).identity[0]
+        _cache.catalog_changed(
+            added=ProductSummary(id_num, title, price, seller_email),
+            date=date)
         return True
 
 
@@ -345,10 +924,14 @@ def update_product(title, price, seller_email, update_params):
         if param not in allowed_params:
             return False    
 
-    # Check that title format is correct
+    # Check that title format is correct and not used by another of the
+    # seller's products
     if 'title' in update_params:
         if not check_title(update_params['title']):
             return False
+        elif (update_params['title'] != title and
+              not check_uniqueness(update_params['title'], seller_email)):
+            return False
 
     # Check that the description is of the correct length
     if 'description' in update_params:
@@ -378,10 +961,19 @@ def update_product(title, price, seller_email, update_params):
         current_product.price = update_params['price']
 
     current_product.last_modified_date = last_modified_date
+    summary = ProductSummary(current_product.id_num, current_product.title,
+                             current_product.price, seller_email)
+    # nothing is written if every value is unchanged
+    modified = db.session.is_modified(current_product)
 
     # actually save the user object
-    db.session.commit()
+    _commit()
 
+    # a sold product can be renamed or repriced too, so the seller's sales
+    # are dropped as well
+    if modified:
+        _cache.catalog_changed(updated=summary, seller_email=seller_email,
+                               date=last_modified_date)
     return True
 
 
@@ -399,51 +991,559 @@ def order(prod_title, seller_email, buyer_email, date=datetime.date.today()):
     Returns:
        True if order placement succeeded otherwise False
     '''
+    return place_order(prod_title, seller_email, buyer_email,
+                       date) == ORDER_PLACED
 
-    # get product they want to order
-    product = Product.query.filter_by(title=prod_title, 
-                                      seller_email=seller_email).first()
 
-    # Check if product exists
-    if product is None:
-        return False
+def place_order(prod_title, seller_email, buyer_email,
+                date=datetime.date.today()):
+    '''
+    Order an available product and report the outcome. The balances and the
+    product are changed by conditional updates inside one write transaction,
+    so concurrent orders can neither sell a product twice nor overdraw a
+    buyer.
+
+    Parameters:
+        prod_title (string):           the products title
+        seller_email (string):         the sellers email
+        buyer_email (string):          the buyers email
+        date (datetime) default - now: time of order
 
-    # get buyers email, they will aready be logged in so no need to check that
-    # they exist
-    buyer = User.query.filter_by(email=buyer_email).first()
+    Returns:
+       ORDER_PLACED if the order succeeded, otherwise the reason it failed
+    '''
 
     # ensure user does not by own product
-    if buyer.email == product.seller_email:
-        return False
-
-    # ensure buyer has sufficient funds
-    if buyer.balance < product.price:
-        return False
+    if buyer_email == seller_email:
+        return ORDER_OWN_PRODUCT
 
     # Check that date of orider is within the allowed range. Used same range as
     # product creation
     if not check_date(date):
-        return False
+        return ORDER_INVALID_DATE
+
+    # Take the write lock up front so nothing changes between reading the
+    # product and settling it. Inside a batch() a savepoint lets a failed
+    # order be undone without losing the rest of the batch.
+    _begin_immediate()
+    savepoint = _savepoint()
+
+    # get product they want to order
+    product = (db.session.query(Product.id_num, Product.price, Product.status)
+               .filter_by(title=prod_title, seller_email=seller_email)
+               .first())
+
+    # Check if product exists and has not been sold
+    if product is None:
+        return _abort_order(ORDER_NO_PRODUCT, savepoint)
+    if product.status != PRODUCT_AVAILABLE:
+        return _abort_order(ORDER_SOLD, savepoint)
+
+    # Money moves in whole cents, the ledger's unit, so that a price with a
+    # fraction of a cent cannot leave balances apart from the ledger
+    cents = to_cents(product.price)
+    price = cents / 100
+
+    # ensure buyer has sufficient funds while debiting them
+    if not _debit(buyer_email, price):
+        if not _exists(_USER_EXISTS, email=buyer_email):
+            return _abort_order(ORDER_NO_BUYER, savepoint)
+        return _abort_order(ORDER_INSUFFICIENT_FUNDS, savepoint)
+
+    # Take the product off the catalog unless someone else got to it first
+    taken = (Product.query
+             .filter(Product.id_num == product.id_num,
+                     Product.status == PRODUCT_AVAILABLE)
+             .update({Product.status: PRODUCT_SOLD},
+                     synchronize_session=False))
+    if not taken:
+        return _abort_order(ORDER_SOLD, savepoint)
+
+    # Credit the seller
+    _credit({seller_email: price})
 
     # Create transaction
-    trans = Transaction(buyer_email=buyer.email, 
+    trans = Transaction(buyer_email=buyer_email,
                         product_id_num=product.id_num,
-                        date=date, price=product.price)
-
+                        date=date, price=price)
     db.session.add(trans)
 
-    # Update balances
-    new_buyer_balance = buyer.balance - product.price
-    buyer.balance = new_buyer_balance
+    # Record the money moved in the ledger
+    _record_movements([(buyer_email, -cents, product.id_num),
+                       (seller_email, cents, product.id_num)])
+
+    # commit all chances to db
+    if savepoint is not None:
+        savepoint.commit()
+    _commit()
+
+    _cache.catalog_changed(removed=product.id_num, seller_email=seller_email)
+    return ORDER_PLACED
+
+
+def _balance_stripes():
+    '''
+    Number of stripes credits are spread over, 0 when they go straight to
+    User.balance, see QBAY_BALANCE_STRIPES
+    '''
+    return app.config['QBAY_BALANCE_STRIPES']
+
 
-    seller = User.query.filter_by(email=product.seller_email).first()
-    new_seller_balance = seller.balance + product.price
-    seller.balance = new_seller_balance
+def _debit(email, amount):
+    '''
+    Take amount from a user's balance if it covers it. With balance
+    stripes, credits not yet folded in are folded in and the debit tried
+    again before giving up.
+
+    Returns:
+        True if the user was debited, False if they do not exist or their
+        balance is too low
+    '''
+    def take():
+        return bool(User.query
+                    .filter(User.email == email, User.balance >= amount)
+                    .update({User.balance: User.balance - amount},
+                            synchronize_session=False))
+
+    if take():
+        return True
+    # fold in any credits waiting on the stripes and try again
+    return bool(_balance_stripes()) and _fold(email) > 0 and take()
+
+
+def _credit(credits):
+    '''
+    Credit sellers with one executemany on their balances, or with balance
+    stripes, add each credit to one of the seller's stripes picked at
+    random. A seller's stripes are all made on their first credit.
+
+    Parameters:
+        credits (dict): amount by email
+    '''
+    stripes = _balance_stripes()
+    if not stripes:
+        db.session.execute(
+            User.__table__.update()
+            .where(User.email == db.bindparam('seller_email'))
+            .values(balance=User.balance + db.bindparam('credit')),
+            [{'seller_email': seller, 'credit': credit}
+             for seller, credit in credits.items()])
+        return
+
+    for email, amount in credits.items():
+        stripe = random.randrange(stripes)
+        if not _add_to_stripe(email, stripe, amount):
+            _make_stripes(email, stripes)
+            _add_to_stripe(email, stripe, amount)
+
+
+def _add_to_stripe(email, stripe, amount):
+    '''
+    Add a credit to one of a user's stripes
+
+    Returns:
+        True if the stripe exists and was credited, otherwise False
+    '''
+    return bool(BalanceDelta.query
+                .filter(BalanceDelta.email == email,
+                        BalanceDelta.stripe == stripe)
+                .update({BalanceDelta.amount: BalanceDelta.amount + amount},
+                        synchronize_session=False))
+
+
+def _make_stripes(email, stripes):
+    '''
+    Make whichever of a user's stripes are missing, so that credits only
+    ever update them. A concurrent order may make them first, in which
+    case the duplicates are undone instead of failing this order.
+
+    Parameters:
+        email (string):     user to make stripes for
+        stripes (integer):  number of stripes the user should have
+    '''
+    made = {row.stripe for row in db.session.query(BalanceDelta.stripe)
+            .filter(BalanceDelta.email == email)}
+    missing = [{'email': email, 'stripe': stripe, 'amount': 0.0}
+               for stripe in range(stripes) if stripe not in made]
+    if not missing:
+        return
+    savepoint = db.session.begin_nested()
+    try:
+        db.session.execute(BalanceDelta.__table__.insert(), missing)
+    except IntegrityError:
+        savepoint.rollback()
+    else:
+        savepoint.commit()
+
+
+def _fold(email=None):
+    '''
+    Move credits from the stripes into User.balance, without committing.
+    Each stripe has what was read from it taken off rather than being
+    zeroed, so credits added to it meanwhile are kept.
+
+    Parameters:
+        email (string): only fold this user's credits, None for everyone's
+
+    Returns:
+        number of users whose balance changed
+    '''
+    query = db.session.query(BalanceDelta.email, BalanceDelta.stripe,
+                             BalanceDelta.amount)
+    if email is not None:
+        query = query.filter(BalanceDelta.email == email)
+    rows = [row for row in query if row.amount != 0]
+    if not rows:
+        return 0
+
+    db.session.execute(
+        BalanceDelta.__table__.update()
+        .where(BalanceDelta.email == db.bindparam('delta_email'),
+               BalanceDelta.stripe == db.bindparam('delta_stripe'))
+        .values(amount=BalanceDelta.amount - db.bindparam('folded')),
+        [{'delta_email': row.email, 'delta_stripe': row.stripe,
+          'folded': row.amount} for row in rows])
+    totals = {}
+    for row in rows:
+        totals[row.email] = totals.get(row.email, 0) + row.amount
+    db.session.execute(
+        User.__table__.update()
+        .where(User.email == db.bindparam('seller_email'))
+        .values(balance=User.balance + db.bindparam('credit')),
+        [{'seller_email': seller, 'credit': credit}
+         for seller, credit in totals.items()])
+    return len(totals)
+
+
+def fold_balances(email=None):
+    '''
+    Move credits spread over balance stripes into User.balance, see
+    QBAY_BALANCE_STRIPES. Meant to be run now and then, such as by the
+    settlement job. Orders fold a buyer's credits themselves when their
+    balance falls short.
+
+    Parameters:
+        email (string): only fold this user's credits, None for everyone's
+
+    Returns:
+        number of users whose balance changed
+    '''
+    # look for credits with a plain read first, so that a settlement job
+    # with nothing to fold does not take the write lock
+    credited = db.exists().where(BalanceDelta.amount != 0)
+    if email is not None:
+        credited = credited.where(BalanceDelta.email == email)
+    folded = 0
+    if db.session.query(credited).scalar():
+        _begin_immediate()
+        folded = _fold(email)
+    _commit()
+    return folded
+
+
+def get_balance(email):
+    '''
+    Get a user's balance including credits not yet folded into it
+
+    Parameters:
+        email (string): the users email
+
+    Returns:
+        balance in CAD, or None if there is no such user
+    '''
+    balance = (db.session.query(User.balance)
+               .filter(User.email == email).scalar())
+    if balance is None:
+        return None
+    pending = (db.session.query(
+        db.func.coalesce(db.func.sum(BalanceDelta.amount), 0.0))
+        .filter(BalanceDelta.email == email).scalar())
+    return balance + pending
+
+
+def to_cents(amount):
+    '''
+    Convert an amount in CAD to whole cents
+
+    Parameters:
+        amount (float): amount in CAD
+
+    Returns:
+        integer number of cents, rounded to the nearest
+    '''
+    return int(round(amount * 100))
+
+
+def _record_movements(movements):
+    '''
+    Add ledger entries for money already moved in this transaction. Each
+    user's balance is read once, after all of their movements, and worked
+    back from to give every entry the balance it left.
+
+    Parameters:
+        movements (list): (email, cents, product id_num) in the order the
+                          money moved
+    '''
+    balances = {}
+    for email, cents, id_num in movements:
+        if email not in balances:
+            balances[email] = to_cents(get_balance(email))
+    entries = []
+    for email, cents, id_num in reversed(movements):
+        entries.append({'email': email, 'amount': cents,
+                        'balance': balances[email],
+                        'product_id_num': id_num})
+        balances[email] -= cents
+    entries.reverse()
+    db.session.execute(LedgerEntry.__table__.insert(), entries)
+
+
+def _abort_order(reason, savepoint=None):
+    '''
+    Roll back a settlement that could not complete
+
+    Parameters:
+        reason (string):  why the order failed
+        savepoint:        the order's savepoint inside a batch(), if any
+
+    Returns:
+        reason
+    '''
+    _rollback(savepoint)
+    return reason
+
+
+def submit_order(prod_title, seller_email, buyer_email,
+                 date=datetime.date.today()):
+    '''
+    Take an order to be settled later by settle_orders. Only the order is
+    written, with one INSERT, so it returns as soon as the order is
+    durable.
+
+    Parameters:
+        prod_title (string):           the products title
+        seller_email (string):         the sellers email
+        buyer_email (string):          the buyers email
+        date (datetime) default - now: time of order
+
+    Returns:
+        intake number to look the outcome up by, see get_order_outcome
+    '''
+    intake = db.session.execute(OrderIntake.__table__.insert().values(
+        prod_title=prod_title, seller_email=seller_email,
+        buyer_email=buyer_email, date=date))
+    _commit()
+    return intake.inserted_primary_key[0]
+
+
+def get_order_outcome(intake_num):
+    '''
+    Look up the outcome of an order taken by submit_order
+
+    Parameters:
+        intake_num (integer): intake number from submit_order
+
+    Returns:
+        ORDER_PENDING until the order is settled, then what place_order
+        returned for it, or None if there is no such order
+    '''
+    row = (db.session.query(OrderIntake.result)
+           .filter(OrderIntake.id_num == intake_num).first())
+    if row is None:
+        return None
+    return row.result or ORDER_PENDING
+
+
+def settle_orders(limit=SETTLE_BATCH_SIZE):
+    '''
+    Place the oldest orders taken by submit_order and record their
+    outcomes, all in one commit. Each order is placed inside its own
+    savepoint, so one that fails is recorded and undone without losing
+    the others.
+
+    Parameters:
+        limit (integer): most orders to settle
+
+    Returns:
+        number of orders settled, 0 once none are waiting
+    '''
+    with batch():
+        # a plain read first, so that the settlement job only takes the
+        # write lock when there are orders waiting
+        waiting = db.exists().where(OrderIntake.result.is_(None))
+        if not db.session.query(waiting).scalar():
+            return 0
+        _begin_immediate()
+        pending = (db.session.query(OrderIntake.id_num,
+                                    OrderIntake.prod_title,
+                                    OrderIntake.seller_email,
+                                    OrderIntake.buyer_email,
+                                    OrderIntake.date)
+                   .filter(OrderIntake.result.is_(None))
+                   .order_by(OrderIntake.id_num)
+                   .limit(limit)
+                   .all())
+        outcomes = [{'intake_num': entry.id_num,
+                     'outcome': place_order(entry.prod_title,
+                                            entry.seller_email,
+                                            entry.buyer_email, entry.date)}
+                    for entry in pending]
+        if outcomes:
+            db.session.execute(
+                OrderIntake.__table__.update()
+                .where(OrderIntake.id_num == db.bindparam('intake_num'))
+                .values(result=db.bindparam('outcome')),
+                outcomes)
+    return len(pending)
+
+
+class CartOutcome(namedtuple('CartOutcome', ['result', 'item'])):
+    '''
+    The outcome of checking out a cart
+
+    Attributes:
+        result (string) ORDER_PLACED, otherwise the reason the cart failed
+        item (tuple) (title, seller_email) of the product the cart failed
+         on, or None if it was not down to one product
+    '''
+    __slots__ = ()
+
+
+def order_many(items, buyer_email, date=datetime.date.today()):
+    '''
+    Order several available products at once. Either every product is
+    ordered or none are.
+
+    Parameters:
+        items (list):                  (title, seller_email) of each product
+        buyer_email (string):          the buyers email
+        date (datetime) default - now: time of order
+
+    Returns:
+       True if every product was ordered otherwise False
+    '''
+    return place_cart_order(items, buyer_email,
+                            date).result == ORDER_PLACED
+
+
+def place_cart_order(items, buyer_email, date=datetime.date.today()):
+    '''
+    Order several available products in one settlement and report the
+    outcome. The products are read with one query, the buyer is debited
+    the total with one conditional update, each seller is credited once
+    with the sum of their sales and everything is committed together.
+
+    Parameters:
+        items (list):                  (title, seller_email) of each product
+        buyer_email (string):          the buyers email
+        date (datetime) default - now: time of order
+
+    Returns:
+       CartOutcome
+    '''
+    items = [tuple(item) for item in items]
+    if not items:
+        return CartOutcome(ORDER_EMPTY_CART, None)
+
+    # ensure user does not by own product, nor the same product twice
+    seen = set()
+    for item in items:
+        if item[1] == buyer_email:
+            return CartOutcome(ORDER_OWN_PRODUCT, item)
+        if item in seen:
+            return CartOutcome(ORDER_SOLD, item)
+        seen.add(item)
+
+    if not check_date(date):
+        return CartOutcome(ORDER_INVALID_DATE, None)
+
+    # As in place_order, take the write lock before reading the products
+    _begin_immediate()
+    savepoint = _savepoint()
+
+    # get every product in the cart at once. Matching the sellers and the
+    # titles as two lists lets SQLite look each pair up in the seller and
+    # title index, and any other of the sellers' products with one of the
+    # titles are left out afterwards.
+    rows = (db.session.query(Product.id_num, Product.title,
+                             Product.seller_email, Product.price,
+                             Product.status)
+            .filter(Product.seller_email.in_({item[1] for item in items}),
+                    Product.title.in_({item[0] for item in items}))
+            .all())
+    products = {(row.title, row.seller_email): row for row in rows}
+    rows = [products[item] for item in items if item in products]
+    for item in items:
+        product = products.get(item)
+        if product is None:
+            return _abort_cart(ORDER_NO_PRODUCT, item, savepoint)
+        if product.status != PRODUCT_AVAILABLE:
+            return _abort_cart(ORDER_SOLD, item, savepoint)
+
+    # As in place_order, money moves in whole cents
+    cents = {product.id_num: to_cents(product.price) for product in rows}
+
+    # ensure buyer has sufficient funds for the whole cart while debiting
+    # them
+    total = sum(cents.values()) / 100
+    if not _debit(buyer_email, total):
+        if not _exists(_USER_EXISTS, email=buyer_email):
+            return _abort_cart(ORDER_NO_BUYER, None, savepoint)
+        return _abort_cart(ORDER_INSUFFICIENT_FUNDS, None, savepoint)
+
+    # Take the products off the catalog unless someone else got to one
+    # first
+    id_nums = [product.id_num for product in rows]
+    taken = (Product.query
+             .filter(Product.id_num.in_(id_nums),
+                     Product.status == PRODUCT_AVAILABLE)
+             .update({Product.status: PRODUCT_SOLD},
+                     synchronize_session=False))
+    if taken != len(id_nums):
+        return _abort_cart(ORDER_SOLD, None, savepoint)
+
+    # Credit each seller once with the sum of their sales
+    credits = {}
+    for product in rows:
+        credits[product.seller_email] = (credits.get(product.seller_email, 0)
+                                         + cents[product.id_num])
+    _credit({seller: credit / 100 for seller, credit in credits.items()})
+
+    # Create the transactions with one statement
+    db.session.execute(
+        Transaction.__table__.insert(),
+        [{'buyer_email': buyer_email, 'product_id_num': product.id_num,
+          'date': date, 'price': cents[product.id_num] / 100}
+         for product in rows])
+
+    # Record the money moved in the ledger, product by product
+    movements = []
+    for product in rows:
+        movements.append((buyer_email, -cents[product.id_num],
+                          product.id_num))
+        movements.append((product.seller_email, cents[product.id_num],
+                          product.id_num))
+    _record_movements(movements)
 
     # commit all chances to db
-    db.session.commit()
+    if savepoint is not None:
+        savepoint.commit()
+    _commit()
+
+    for product in rows:
+        _cache.catalog_changed(removed=product.id_num,
+                               seller_email=product.seller_email)
+    return CartOutcome(ORDER_PLACED, None)
 
-    return True
+
+def _abort_cart(reason, item, savepoint=None):
+    '''
+    Roll back a cart settlement that could not complete
+
+    Returns:
+        CartOutcome of reason and item
+    '''
+    return CartOutcome(_abort_order(reason, savepoint), item)
 
 
 def get_avail_products():
@@ -454,16 +1554,398 @@ def get_avail_products():
         list of Products
     '''
 
-    products = Product.query.all()
+    # Read straight from the partial index over available products
+    return (Product.query
+            .filter(Product.status == PRODUCT_AVAILABLE)
+            .order_by(Product.id_num)
+            .all())
+
 
-    # Exclude bought products
-    filtered_products = []
-    for p in products:
-        trans = Transaction.query.filter_by(product_id_num=p.id_num).first()
-        if trans is None:
-            filtered_products.append(p)
+class ProductSummary(namedtuple('ProductSummary',
+                                ['id_num', 'title', 'price',
+                                 'seller_email'])):
+    '''
+    The columns of a product that listings display. The description, up to
+    2000 characters, is left out and fetched with get_product_description
+    once a single product is opened. Plain values are stored, so a summary
+    is not tracked by the database session.
 
-    return filtered_products
+    Attributes:
+        id_num (integer) product identifier
+        title (string) product title
+        price (float) product price in CAD
+        seller_email (string)
+    '''
+    __slots__ = ()
+
+
+class CacheStats(namedtuple('CacheStats', ['hits', 'misses', 'views'])):
+    '''
+    Counters of the listing view cache, see get_cache_stats
+
+    Attributes:
+        hits (integer) lookups served from memory
+        misses (integer) lookups that queried the database
+        views (integer) views currently held
+    '''
+    __slots__ = ()
+
+
+# Cache keys of the available catalog, the pages of it and a seller's sales
+_CATALOG = 'catalog'
+_PAGE = 'page'
+_SALES = 'sales'
+
+# Change count of the product table that every cached view depends on, see
+# DataVersion
+_PRODUCT_VERSION = db.select(DataVersion.version).where(
+    DataVersion.name == 'product')
+
+
+class _ViewCache:
+    '''
+    Listing views kept in memory, least recently used first. Views are
+    plain values such as ProductSummaries rather than database objects, so
+    they stay usable after the session that loaded them has moved on.
+
+    The whole catalog is patched by the write functions as products are
+    created, updated and sold. Pages and sales reports are cheap to reload,
+    so they are dropped instead.
+
+    Other processes writing to the same database are noticed through the
+    product table's DataVersion. It is read before every lookup, and if it
+    has moved on by more than this process's own writes every view is
+    dropped.
+    '''
+
+    def __init__(self):
+        self.views = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # bumped by every change, so that a view loaded while a write was
+        # being made is not stored
+        self.generation = 0
+        # product table version the views are up to date with, None until
+        # it is first read
+        self.version = None
+        # other views of the catalog kept in step with this one, such as
+        # qbay.snapshot's. Each has changed(added, updated, removed, date)
+        # and reset() methods.
+        self.listeners = []
+
+    def validate(self):
+        '''
+        Check the product table's version, dropping every view and
+        resetting the listeners if another process has written to it
+        '''
+        version = get_catalog_version()
+        with self.lock:
+            stale = version != self.version
+            if stale:
+                self._drop_all()
+                self.version = version
+        if stale:
+            for listener in list(self.listeners):
+                listener.reset()
+
+    def get(self, key, load):
+        '''
+        Get a view from memory, or load it and remember it
+
+        Parameters:
+            key (tuple): the view's cache key
+            load (function): loads the view from the database
+
+        Returns:
+            the view
+        '''
+        size = app.config['QBAY_CACHE_SIZE']
+        if size <= 0:
+            return load()
+
+        self.validate()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.views.get(key)
+            if (entry is not None and
+                    now - entry[0] < app.config['QBAY_CACHE_TTL']):
+                self.views.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self.generation
+
+        view = load()
+        with self.lock:
+            if generation == self.generation:
+                self.views[key] = (now, view)
+                self.views.move_to_end(key)
+                while len(self.views) > size:
+                    self.views.popitem(last=False)
+        return view
+
+    def catalog_changed(self, added=None, updated=None, removed=None,
+                        seller_email=None, date=None):
+        '''
+        Bring the views up to date with a write of one product row. Every
+        page is dropped, the cached catalog, if any, is patched and the
+        listeners are told.
+
+        Parameters:
+            added (ProductSummary): a product created
+            updated (ProductSummary): a product's new title and price
+            removed (integer): id_num of a product sold
+            seller_email (string): seller whose sales report is dropped
+            date (datetime): last modified date of an added or updated
+                             product
+        '''
+        with self.lock:
+            self.generation += 1
+            # the write bumped the product table's version by one
+            if self.version is not None:
+                self.version += 1
+            for key in [key for key in self.views
+                        if key[0] == _PAGE or key == (_SALES, seller_email)]:
+                del self.views[key]
+
+            entry = self.views.get((_CATALOG,))
+            if entry is not None:
+                self._patch(entry[1], added, updated, removed)
+
+        for listener in list(self.listeners):
+            listener.changed(added, updated, removed, date)
+
+    def _patch(self, catalog, added, updated, removed):
+        '''
+        Patch the cached catalog, with the lock held
+        '''
+        if added is not None:
+            bisect.insort(catalog, added)
+        # the catalog is in id_num order, so look the product up by it
+        changed = updated.id_num if updated is not None else removed
+        if changed is not None:
+            i = bisect.bisect_left(catalog, (changed,))
+            if i < len(catalog) and catalog[i].id_num == changed:
+                if updated is not None:
+                    catalog[i] = updated
+                else:
+                    del catalog[i]
+
+    def clear(self):
+        '''
+        Drop every view
+        '''
+        with self.lock:
+            self._drop_all()
+            self.version = None
+        for listener in list(self.listeners):
+            listener.reset()
+
+    def _drop_all(self):
+        '''
+        Drop every view, with the lock held
+        '''
+        self.generation += 1
+        self.views.clear()
+
+
+_cache = _ViewCache()
+
+
+def get_cache_stats():
+    '''
+    Get the hit and miss counts of the listing view cache. The cache is
+    sized by QBAY_CACHE_SIZE and QBAY_CACHE_TTL.
+
+    Returns:
+        CacheStats
+    '''
+    with _cache.lock:
+        return CacheStats(_cache.hits, _cache.misses, len(_cache.views))
+
+
+def clear_cache():
+    '''
+    Drop every cached listing view, for when the database has been changed
+    other than through this module
+    '''
+    _cache.clear()
+
+
+def get_catalog_version():
+    '''
+    Get the product table's change count, see DataVersion. Anything built
+    from the catalog at one version is still current while it is unchanged.
+
+    Returns:
+        the version, 0 if the product table has never been written to
+    '''
+    return db.session.execute(_PRODUCT_VERSION).scalar() or 0
+
+
+def _summaries(query):
+    '''
+    Run a query for the ProductSummary columns
+
+    Returns:
+        list of ProductSummaries
+    '''
+    return [ProductSummary._make(row) for row in query]
+
+
+def _summary_query():
+    '''
+    Query for the summaries of the non-bought products
+    '''
+    return (db.session.query(Product.id_num, Product.title, Product.price,
+                             Product.seller_email)
+            .filter(Product.status == PRODUCT_AVAILABLE))
+
+
+def get_avail_summaries():
+    '''
+    Get the summaries of the non-bought products, see get_avail_products
+
+    Returns:
+        list of ProductSummaries
+    '''
+    catalog = _cache.get((_CATALOG,), lambda: _summaries(
+        _summary_query().order_by(Product.id_num)))
+    return list(catalog)
+
+
+def get_avail_products_page(size, after=None, before=None):
+    '''
+    Get one page of non-bought products in id_num order. Pages are found
+    by the id_num they continue from rather than by position, so every
+    page is read straight from the index at the same cost as the first.
+
+    Parameters:
+        size (integer):  products per page
+        after (integer): id_num the page starts after, for the next page
+        before (integer): id_num the page ends before, for the previous
+                          page
+
+    Returns:
+        list of at most size ProductSummaries
+    '''
+    def load_page():
+        query = _summary_query()
+        if before is not None:
+            # read backwards from the cursor, then put the page in order
+            page = _summaries(query.filter(Product.id_num < before)
+                              .order_by(Product.id_num.desc())
+                              .limit(size))
+            page.reverse()
+            return page
+        if after is not None:
+            query = query.filter(Product.id_num > after)
+        return _summaries(query.order_by(Product.id_num).limit(size))
+
+    return list(_cache.get((_PAGE, size, after, before), load_page))
+
+
+def get_product_description(id_num):
+    '''
+    Get the description left out of a ProductSummary
+
+    Parameters:
+        id_num (integer): product identifier
+
+    Returns:
+        the description, or None if there is no such product
+    '''
+    return (db.session.query(Product.description)
+            .filter(Product.id_num == id_num)
+            .scalar())
+
+
+# Search over the full-text index, best matches first. Title matches count
+# ten times as much as description matches.
+_SEARCH = db.text(
+    "SELECT product.id_num, product.title, product.price, "
+    "product.seller_email "
+    "FROM product_fts JOIN product ON product.id_num = product_fts.rowid "
+    "WHERE product_fts MATCH :match AND product.status = :status "
+    "ORDER BY bm25(product_fts, 10.0, 1.0), product.id_num "
+    "LIMIT :limit OFFSET :offset")
+
+
+def _search_words(text):
+    '''
+    Split search text into the lowercase words it contains
+    '''
+    return re.findall(r'\w+', text.lower())
+
+
+def search_products(text, size, page=0):
+    '''
+    Search the titles and descriptions of non-bought products. Every word
+    must appear, and the last one may be the start of a word, so results
+    narrow down as a title is typed.
+
+    Parameters:
+        text (string):   words to search for
+        size (integer):  results per page
+        page (integer):  page of results, counting from 0
+
+    Returns:
+        list of at most size ProductSummaries, best matches first
+    '''
+    words = _search_words(text)
+    if not words:
+        return []
+    if not _has_fts:
+        return _search_like(words, size, page)
+
+    # each word is quoted so that nothing typed is read as FTS5 syntax
+    match = ' '.join('"' + word + '"' for word in words) + '*'
+    return _summaries(db.session.execute(_SEARCH, {
+        'match': match, 'status': PRODUCT_AVAILABLE,
+        'limit': size, 'offset': page * size}))
+
+
+def _search_like(words, size, page=0):
+    '''
+    search_products by scanning every product with LIKE, in id_num order
+
+    Parameters:
+        words (list): lowercase words that must all appear
+
+    Returns:
+        list of at most size ProductSummaries
+    '''
+    query = _summary_query()
+    for word in words:
+        pattern = '%' + word + '%'
+        query = query.filter(db.or_(Product.title.like(pattern),
+                                    Product.description.like(pattern)))
+    return _summaries(query.order_by(Product.id_num)
+                      .limit(size).offset(page * size))
+
+
+def skip_avail_products(count, after=None):
+    '''
+    Find the cursor count non-bought products further on, for jumping
+    several pages at once. Only the index is read, no products are loaded.
+
+    Parameters:
+        count (integer): number of products to skip, at least 1
+        after (integer): id_num to skip from, None for the start
+
+    Returns:
+        id_num of the last product skipped, or None if there are fewer
+        than count products left
+    '''
+    query = db.session.query(Product.id_num).filter(
+        Product.status == PRODUCT_AVAILABLE)
+    if after is not None:
+        query = query.filter(Product.id_num > after)
+    return (query.order_by(Product.id_num)
+            .offset(count - 1)
+            .limit(1)
+            .scalar())
 
 
 def get_sold_products(seller_email):
@@ -477,17 +1959,132 @@ def get_sold_products(seller_email):
         list of Products
     '''
 
-    products = Product.query.filter_by(seller_email=seller_email).all()
+    # Include only bought products by joining against their transactions
+    return (Product.query
+            .join(Transaction, Transaction.product_id_num == Product.id_num)
+            .filter(Product.seller_email == seller_email)
+            .order_by(Product.id_num)
+            .all())
+
+
+# Products loaded per query by the iter_* listings
+ITER_CHUNK_SIZE = 1000
+
+
+def _iter_chunks(query, chunk_size):
+    '''
+    Run a Product query one chunk at a time in id_num order. Each chunk
+    starts after the last id_num of the one before, so every chunk is a
+    short index range read and at most chunk_size products are held at
+    once.
+
+    Parameters:
+        query (Query):        Product query without ordering or limit
+        chunk_size (integer): products fetched per query
+
+    Returns:
+        generator of Products
+    '''
+    chunk_query = query
+    while True:
+        chunk = chunk_query.order_by(Product.id_num).limit(chunk_size).all()
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        chunk_query = query.filter(Product.id_num > chunk[-1].id_num)
+
+
+def iter_avail_products(chunk_size=ITER_CHUNK_SIZE):
+    '''
+    Stream the non-bought products, see get_avail_products
+
+    Parameters:
+        chunk_size (integer): products fetched per query
+
+    Returns:
+        generator of Products
+    '''
+    return _iter_chunks(
+        Product.query.filter(Product.status == PRODUCT_AVAILABLE),
+        chunk_size)
+
+
+def iter_sold_products(seller_email, chunk_size=ITER_CHUNK_SIZE):
+    '''
+    Stream the products sold by provided email, see get_sold_products
+
+    Parameters:
+        seller_email (string): the sellers email
+        chunk_size (integer):  products fetched per query
+
+    Returns:
+        generator of Products
+    '''
+    return _iter_chunks(
+        Product.query
+        .join(Transaction, Transaction.product_id_num == Product.id_num)
+        .filter(Product.seller_email == seller_email),
+        chunk_size)
+
 
-    # Include only bought products
-    filtered_products = []
-    for p in products:
-        trans = Transaction.query.filter_by(product_id_num=p.id_num).first()
+class SaleRecord(namedtuple('SaleRecord',
+                            ['id_num', 'title', 'price', 'date',
+                             'buyer_email'])):
+    '''
+    A sold product together with the details of its sale. Plain values are
+    stored rather than database objects so that nothing is lazily loaded
+    when the record is displayed.
 
-        if trans is not None:
-            filtered_products.append(p)
+    Attributes:
+        id_num (integer) product identifier
+        title (string) product title
+        price (float) price the product sold for in CAD
+        date (datetime) date of purchase
+        buyer_email (string)
+    '''
+    __slots__ = ()
 
-    return filtered_products
+
+class SalesReport(namedtuple('SalesReport', ['sales', 'count', 'revenue'])):
+    '''
+    Every sale made by a seller along with the seller's totals
+
+    Attributes:
+        sales (list) SaleRecords ordered by product identifier
+        count (integer) number of products sold
+        revenue (float) sum of the sale prices in CAD
+    '''
+    __slots__ = ()
+
+
+def get_sales_report(seller_email):
+    '''
+    Get the products sold by provided email with their sale price, sale date
+    and buyer, plus the seller's totals. Everything comes from one query.
+
+    Parameters:
+        seller_email (string): the sellers email
+
+    Returns:
+        SalesReport
+    '''
+
+    def load_report():
+        rows = (db.session.query(Product.id_num, Product.title,
+                                 Transaction.price, Transaction.date,
+                                 Transaction.buyer_email)
+                .join(Transaction,
+                      Transaction.product_id_num == Product.id_num)
+                .filter(Product.seller_email == seller_email)
+                .order_by(Product.id_num)
+                .all())
+
+        sales = [SaleRecord(*row) for row in rows]
+        revenue = sum(sale.price for sale in sales)
+        return SalesReport(sales, len(sales), revenue)
+
+    report = _cache.get((_SALES, seller_email), load_report)
+    return report._replace(sales=list(report.sales))
 
 
 def check_email(email):
@@ -671,13 +2268,9 @@ def check_seller(seller_email):
     :return: True if the email corresponds to an existing user,
             False otherwise
     """
-    existing_seller = User.query.filter_by(email=seller_email).all()
     # Note that this rules out the possibility of an empty seller_email,
     # as it is impossible to create a user with an empty/invalid email.
-    if not existing_seller:
-        return False
-    else:
-        return True
+    return _exists(_USER_EXISTS, email=seller_email)
 
 
 def check_uniqueness(title, seller_email):
@@ -692,10 +2285,6 @@ def check_uniqueness(title, seller_email):
     :return: True if the title is not already possessed by a product
              of the seller, or False otherwise
     """
-    already_exists = Product.query.filter_by(title=title,
-                                             seller_email=seller_email).all()
-    if already_exists:
-        return False
-    else:
-        return True
+    return not _exists(_PRODUCT_EXISTS, title=title,
+                       seller_email=seller_email)
 
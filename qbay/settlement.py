@@ -0,0 +1,55 @@
+from qbay.models import *
+import sys
+import time
+
+'''
+This file defines the background job that settles orders taken by
+submit_order, for when the CLI is run with order_queue=1:
+
+    python -m qbay.settlement [INTERVAL]
+
+settles waiting orders in batches of SETTLE_BATCH_SIZE, one commit per
+batch, and checks for new ones every INTERVAL seconds once none are left.
+While it waits, credits spread over balance stripes are folded into the
+sellers' balances, see QBAY_BALANCE_STRIPES.
+'''
+
+# Seconds between checks for new orders once the queue is empty
+DEFAULT_INTERVAL = 0.1
+
+
+def run_settlement(interval=DEFAULT_INTERVAL, rounds=None,
+                   batch_size=SETTLE_BATCH_SIZE):
+    '''
+    Keep settling orders as they come in
+
+    Parameters:
+        interval (float):     seconds between checks when the queue is
+                              empty
+        rounds (integer):     checks of an empty queue to make before
+                              returning, None to run forever
+        batch_size (integer): most orders settled per commit
+
+    Returns:
+        number of orders settled
+    '''
+    settled = 0
+    while rounds is None or rounds > 0:
+        count = settle_orders(batch_size)
+        settled += count
+        # only wait once the queue has been drained
+        if count == batch_size:
+            continue
+        if app.config['QBAY_BALANCE_STRIPES']:
+            fold_balances()
+        if rounds is not None:
+            rounds -= 1
+            if rounds == 0:
+                break
+        time.sleep(interval)
+    return settled
+
+
+if __name__ == '__main__':
+    run_settlement(float(sys.argv[1]) if len(sys.argv) > 1
+                   else DEFAULT_INTERVAL)
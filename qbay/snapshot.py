@@ -0,0 +1,294 @@
+from qbay.models import *
+from qbay.models import _cache
+import datetime
+import threading
+import numpy as np
+
+'''
+This file defines a columnar snapshot of the available catalog, for
+filtering and sorting it with NumPy instead of Python loops over Products.
+NumPy is only needed by this file.
+'''
+
+# Columns the snapshot can sort by, see CatalogSnapshot.select
+SORT_PRICE = 'price'
+SORT_DATE = 'date'
+
+# Fewest rows the arrays are made with. Full arrays double in size.
+MIN_CAPACITY = 1024
+
+
+def _ordinal(date):
+    '''
+    Day number of a date or datetime, see datetime.date.toordinal
+    '''
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return date.toordinal()
+
+
+class CatalogSnapshot:
+    '''
+    The available products held as NumPy arrays, one per column, in id_num
+    order. Titles and seller emails are stored once each in a table and
+    referred to by index.
+
+    The snapshot is built with one query and then kept in step with
+    create_product, update_product and order, which patch it row by row.
+    If another process writes to the catalog, the next call rebuilds it.
+    Sold products are only marked as gone, and the arrays are compacted
+    once half of their rows are.
+
+    Attributes:
+        titles (list) interned titles, indexed by title_index
+        sellers (list) interned seller emails, indexed by seller_index
+        id_num (ndarray) product identifiers, ascending
+        price (ndarray) prices in CAD
+        date (ndarray) last modified dates as day ordinals
+        title_index (ndarray)
+        seller_index (ndarray)
+        alive (ndarray) False for rows of sold products
+        size (integer) rows in use at the front of the arrays
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stale = True
+        self.refresh()
+        _cache.listeners.append(self)
+
+    def close(self):
+        '''
+        Stop keeping the snapshot in step with the catalog
+        '''
+        _cache.listeners.remove(self)
+
+    def refresh(self):
+        '''
+        Rebuild the snapshot if another process has changed the catalog
+        since it was last brought up to date
+        '''
+        # may call reset(), so it is run before taking the lock
+        _cache.validate()
+        with self.lock:
+            if self.stale:
+                self._build()
+
+    def _build(self):
+        '''
+        Load every available product with one query, with the lock held
+        '''
+        rows = (db.session.query(Product.id_num, Product.title,
+                                 Product.price, Product.last_modified_date,
+                                 Product.seller_email)
+                .filter(Product.status == PRODUCT_AVAILABLE)
+                .order_by(Product.id_num)
+                .all())
+        self.titles = []
+        self.title_numbers = {}
+        self.sellers = []
+        self.seller_numbers = {}
+        self._allocate(max(len(rows), MIN_CAPACITY))
+        self.size = len(rows)
+        self.dead = 0
+        for i, (id_num, title, price, date, seller_email) in enumerate(rows):
+            self._set(i, id_num, title, price, date, seller_email)
+        self.stale = False
+
+    def _allocate(self, capacity):
+        '''
+        Make empty arrays with room for capacity rows
+        '''
+        self.id_num = np.zeros(capacity, dtype=np.int64)
+        self.price = np.zeros(capacity, dtype=np.float64)
+        self.date = np.zeros(capacity, dtype=np.int32)
+        self.title_index = np.zeros(capacity, dtype=np.int32)
+        self.seller_index = np.zeros(capacity, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    def _intern(self, value, values, numbers):
+        '''
+        Index of value in an interned table, adding it if new
+        '''
+        number = numbers.get(value)
+        if number is None:
+            number = numbers[value] = len(values)
+            values.append(value)
+        return number
+
+    def _set(self, i, id_num, title, price, date, seller_email):
+        '''
+        Fill in row i
+        '''
+        self.id_num[i] = id_num
+        self.price[i] = price
+        self.date[i] = _ordinal(date)
+        self.title_index[i] = self._intern(title, self.titles,
+                                           self.title_numbers)
+        self.seller_index[i] = self._intern(seller_email, self.sellers,
+                                            self.seller_numbers)
+        self.alive[i] = True
+
+    def _find(self, id_num):
+        '''
+        Row of a product still in the snapshot, or None
+        '''
+        i = int(np.searchsorted(self.id_num[:self.size], id_num))
+        if i < self.size and self.id_num[i] == id_num and self.alive[i]:
+            return i
+        return None
+
+    def changed(self, added, updated, removed, date):
+        '''
+        Patch the snapshot after one product row was written, see
+        qbay.models._ViewCache.catalog_changed
+        '''
+        with self.lock:
+            if self.stale:
+                return
+            if added is not None:
+                self._append(added, date)
+            elif updated is not None:
+                i = self._find(updated.id_num)
+                if i is not None:
+                    self._set(i, updated.id_num, updated.title,
+                              updated.price, date, updated.seller_email)
+            elif removed is not None:
+                i = self._find(removed)
+                if i is not None:
+                    self.alive[i] = False
+                    self.dead += 1
+                    if self.dead * 2 > self.size:
+                        self._compact()
+
+    def reset(self):
+        '''
+        Mark the snapshot for rebuilding, see
+        qbay.models._ViewCache.validate
+        '''
+        with self.lock:
+            self.stale = True
+
+    def _append(self, summary, date):
+        '''
+        Add a new product at the end, growing the arrays if they are full
+        '''
+        if self.size and summary.id_num <= self.id_num[self.size - 1]:
+            # ids only grow, so this is not expected, but it would break
+            # the id_num order the rows are found by
+            self.stale = True
+            return
+        if self.size == len(self.id_num):
+            self._resize(2 * len(self.id_num))
+        self._set(self.size, summary.id_num, summary.title, summary.price,
+                  date, summary.seller_email)
+        self.size += 1
+
+    def _resize(self, capacity, keep=None):
+        '''
+        Move the rows, or only those picked by keep, to arrays of a new
+        capacity
+        '''
+        columns = ('id_num', 'price', 'date', 'title_index', 'seller_index',
+                   'alive')
+        old = {name: getattr(self, name)[:self.size] for name in columns}
+        if keep is not None:
+            old = {name: column[keep] for name, column in old.items()}
+        self._allocate(capacity)
+        self.size = len(old['id_num'])
+        for name in columns:
+            getattr(self, name)[:self.size] = old[name]
+
+    def _compact(self):
+        '''
+        Drop the rows of sold products
+        '''
+        self._resize(max(len(self.id_num), MIN_CAPACITY),
+                     keep=self.alive[:self.size])
+        self.dead = 0
+
+    def select(self, min_price=None, max_price=None, since=None,
+               order_by=None, descending=False, limit=None):
+        '''
+        Filter and sort the available products with array operations
+
+        Parameters:
+            min_price (float):  lowest price to include
+            max_price (float):  highest price to include
+            since (date):       earliest last modified date to include
+            order_by (string):  SORT_PRICE, SORT_DATE, or None for id_num
+                                order
+            descending (bool):  sort from highest to lowest, ties still in
+                                id_num order
+            limit (integer):    keep only the first limit products
+
+        Returns:
+            list of ProductSummaries
+        '''
+        self.refresh()
+        with self.lock:
+            size = self.size
+            mask = self.alive[:size].copy()
+            if min_price is not None:
+                mask &= self.price[:size] >= min_price
+            if max_price is not None:
+                mask &= self.price[:size] <= max_price
+            if since is not None:
+                mask &= self.date[:size] >= _ordinal(since)
+            rows = np.flatnonzero(mask)
+
+            if order_by is not None:
+                column = {SORT_PRICE: self.price,
+                          SORT_DATE: self.date}[order_by]
+                keys = column[rows].astype(np.float64)
+                if descending:
+                    keys = -keys
+                if limit is not None and limit < len(rows):
+                    # keep only the rows that can make the top limit,
+                    # ties with the last of them included, before sorting
+                    cutoff = np.partition(keys, limit - 1)[limit - 1]
+                    within = keys <= cutoff
+                    rows, keys = rows[within], keys[within]
+                # rows are in id_num order, so a stable sort keeps ties so
+                rows = rows[np.argsort(keys, kind='stable')]
+            elif descending:
+                rows = rows[::-1]
+
+            if limit is not None:
+                rows = rows[:limit]
+            return self._summaries(rows)
+
+    def cheapest(self, count):
+        '''
+        Get the count cheapest available products
+
+        Returns:
+            list of ProductSummaries, cheapest first
+        '''
+        return self.select(order_by=SORT_PRICE, limit=count)
+
+    def newest(self, count):
+        '''
+        Get the count most recently modified available products
+
+        Returns:
+            list of ProductSummaries, newest first
+        '''
+        return self.select(order_by=SORT_DATE, descending=True, limit=count)
+
+    def _summaries(self, rows):
+        '''
+        Turn rows of the arrays into ProductSummaries, with the lock held
+        '''
+        titles = self.titles
+        sellers = self.sellers
+        return [ProductSummary(id_num, titles[title], price, sellers[seller])
+                for id_num, title, price, seller in
+                zip(self.id_num[rows].tolist(),
+                    self.title_index[rows].tolist(),
+                    self.price[rows].tolist(),
+                    self.seller_index[rows].tolist())]
+
+    def __len__(self):
+        with self.lock:
+            return self.size - self.dead
@@ -0,0 +1,260 @@
+from qbay.models import *
+from qbay.models import _cache
+from collections import Counter, OrderedDict
+import bisect
+import heapq
+import threading
+import time
+
+'''
+This file defines in-memory indexes of each seller's product titles, for
+completing titles as they are typed and suggesting the titles a seller
+most likely meant when the one they typed does not exist.
+
+Titles are kept sorted, lowercased, so that those starting with a prefix
+are found by binary search. They are also broken into trigrams, the runs
+of three characters in them, and each index maps every trigram to the
+products whose titles contain it. Only products sharing a trigram with
+the typed title are looked at, and they are ranked by how many they
+share.
+'''
+
+# Suggestions given by suggest_titles unless asked for another number
+SUGGESTIONS = 5
+
+# Completions given by complete_titles unless asked for another number
+COMPLETIONS = 50
+
+# Least similarity, from 0 to 1, a title needs to be suggested
+MIN_SIMILARITY = 0.3
+
+# Most sellers whose indexes are kept, least recently used dropped first
+MAX_SELLERS = 128
+
+# Seconds between checks for other processes' writes. Titles are only
+# completed and suggested from the indexes, never trusted, so they can
+# lag that long behind.
+RECHECK_INTERVAL = 1.0
+
+
+def _normalize(title):
+    '''
+    Lowercase a title and collapse its whitespace, so that case and stray
+    spaces do not count as differences
+    '''
+    return ' '.join(title.lower().split())
+
+
+def trigrams(title):
+    '''
+    Get the trigrams of a title. The title is padded with spaces so that
+    its first and last characters are in as many trigrams as the others.
+
+    Parameters:
+        title (string): product title
+
+    Returns:
+        set of three character strings
+    '''
+    padded = '  ' + _normalize(title) + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    '''
+    Prefix and trigram index of one seller's product titles, sold products
+    included since they can still be updated
+
+    Attributes:
+        titles (dict) title by id_num
+        ordered (list) (lowercase title, id_num) pairs, sorted
+        grams (dict) trigram count by id_num
+        postings (dict) set of id_nums by trigram
+    '''
+
+    def __init__(self, rows=()):
+        self.titles = {}
+        self.ordered = []
+        self.grams = {}
+        self.postings = {}
+        for id_num, title in rows:
+            self.add(id_num, title)
+
+    def add(self, id_num, title):
+        '''
+        Index a product's title, replacing the one it had
+        '''
+        self.remove(id_num)
+        grams = trigrams(title)
+        self.titles[id_num] = title
+        bisect.insort(self.ordered, (title.lower(), id_num))
+        self.grams[id_num] = len(grams)
+        for gram in grams:
+            self.postings.setdefault(gram, set()).add(id_num)
+
+    def remove(self, id_num):
+        '''
+        Drop a product's title, if it is indexed
+        '''
+        title = self.titles.pop(id_num, None)
+        if title is None:
+            return
+        del self.ordered[bisect.bisect_left(self.ordered,
+                                            (title.lower(), id_num))]
+        del self.grams[id_num]
+        for gram in trigrams(title):
+            ids = self.postings[gram]
+            ids.discard(id_num)
+            if not ids:
+                del self.postings[gram]
+
+    def complete(self, prefix, count):
+        '''
+        Find the titles starting with prefix, ignoring case
+
+        Parameters:
+            prefix (string):  start of a title
+            count (integer):  most titles to return
+
+        Returns:
+            list of titles in alphabetical order
+        '''
+        prefix = prefix.lower()
+        found = []
+        i = bisect.bisect_left(self.ordered, (prefix,))
+        while (len(found) < count and i < len(self.ordered) and
+               self.ordered[i][0].startswith(prefix)):
+            found.append(self.titles[self.ordered[i][1]])
+            i += 1
+        return found
+
+    def similar(self, title, count, min_similarity=MIN_SIMILARITY):
+        '''
+        Find the titles most similar to title
+
+        Parameters:
+            title (string):         title to match
+            count (integer):        most titles to return
+            min_similarity (float): least similarity to include
+
+        Returns:
+            list of titles, most similar first, ties in id_num order
+        '''
+        grams = trigrams(title)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        scored = ((2 * common / (len(grams) + self.grams[id_num]), -id_num)
+                  for id_num, common in shared.items())
+        best = heapq.nlargest(count, (score for score in scored
+                                      if score[0] >= min_similarity))
+        return [self.titles[-negated] for _, negated in best]
+
+    def __len__(self):
+        return len(self.titles)
+
+
+class _SellerTitles:
+    '''
+    TitleIndexes of the sellers asked about, each built with one query
+    the first time it is needed and then kept in step with create_product
+    and update_product. They are all dropped once another process is seen
+    to have written to the catalog.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.indexes = OrderedDict()
+        # bumped by every change, so that an index built while a write was
+        # being made is not kept
+        self.generation = 0
+        # when other processes' writes were last checked for
+        self.checked = None
+        _cache.listeners.append(self)
+
+    def get(self, seller_email):
+        '''
+        The seller's TitleIndex, building it if it is not kept
+        '''
+        now = time.monotonic()
+        if self.checked is None or now - self.checked >= RECHECK_INTERVAL:
+            # may call reset(), so it is run before taking the lock
+            _cache.validate()
+            self.checked = now
+        with self.lock:
+            index = self.indexes.get(seller_email)
+            if index is not None:
+                self.indexes.move_to_end(seller_email)
+                return index
+            generation = self.generation
+        rows = (db.session.query(Product.id_num, Product.title)
+                .filter(Product.seller_email == seller_email).all())
+        index = TitleIndex(rows)
+        with self.lock:
+            if generation != self.generation:
+                return index
+            self.indexes[seller_email] = index
+            while len(self.indexes) > MAX_SELLERS:
+                self.indexes.popitem(last=False)
+        return index
+
+    def changed(self, added, updated, removed, date):
+        '''
+        Patch the seller's index after one product row was written, see
+        qbay.models._ViewCache.catalog_changed. Sold products keep their
+        titles.
+        '''
+        summary = added if added is not None else updated
+        if summary is None:
+            return
+        with self.lock:
+            self.generation += 1
+            index = self.indexes.get(summary.seller_email)
+            if index is not None:
+                index.add(summary.id_num, summary.title)
+
+    def reset(self):
+        '''
+        Drop every index, see qbay.models._ViewCache.validate
+        '''
+        with self.lock:
+            self.generation += 1
+            self.indexes.clear()
+
+
+_seller_titles = _SellerTitles()
+
+
+def complete_titles(seller_email, prefix, count=COMPLETIONS):
+    '''
+    Complete a title the seller is typing from their product titles
+
+    Parameters:
+        seller_email (string): email of seller
+        prefix (string):       start of the title typed so far
+        count (integer):       most completions to give
+
+    Returns:
+        list of titles starting with prefix, ignoring case, in
+        alphabetical order
+    '''
+    index = _seller_titles.get(seller_email)
+    with _seller_titles.lock:
+        return index.complete(prefix, count)
+
+
+def suggest_titles(seller_email, title, count=SUGGESTIONS):
+    '''
+    Suggest the seller's product titles closest to one that was mistyped
+
+    Parameters:
+        seller_email (string): email of seller
+        title (string):        title as typed
+        count (integer):       most suggestions to give
+
+    Returns:
+        list of titles, closest first
+    '''
+    index = _seller_titles.get(seller_email)
+    with _seller_titles.lock:
+        return index.similar(title, count)
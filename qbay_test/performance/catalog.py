@@ -0,0 +1,54 @@
+from qbay.models import *
+import sys
+
+'''
+Fills the database qbay is pointed at with a large catalog, for the tests
+that measure how listings scale with its size:
+
+    python -m qbay_test.performance.catalog COUNT
+
+Products are spread over CATALOG_SELLERS sellers and written with bulk
+inserts, since creating them one at a time would dominate the tests.
+'''
+
+# Sellers the catalog is spread over
+CATALOG_SELLERS = 100
+
+# Products written per insert
+SEED_CHUNK_SIZE = 10000
+
+# Description given to every product, long enough to matter when loaded
+CATALOG_DESCRIPTION = "catalog product description " * 8
+
+
+def catalog_seller(i):
+    '''
+    Email of the seller of product i
+    '''
+    return "catalog_seller" + str(i % CATALOG_SELLERS) + "@qbay.com"
+
+
+def seed(count):
+    '''
+    Add count products, titled "catalog product N", and their sellers
+
+    Parameters:
+        count (integer): number of products
+    '''
+    db.session.execute(User.__table__.insert(), [
+        {'username': "CatalogSeller", 'email': catalog_seller(i),
+         'password': "Password99@"}
+        for i in range(0, min(count, CATALOG_SELLERS))])
+    for first in range(0, count, SEED_CHUNK_SIZE):
+        db.session.execute(Product.__table__.insert(), [
+            {'title': "catalog product " + str(i),
+             'description': CATALOG_DESCRIPTION,
+             'price': 10.0 + i % 9990,
+             'last_modified_date': datetime.date(2022, 9, 29),
+             'seller_email': catalog_seller(i)}
+            for i in range(first, min(count, first + SEED_CHUNK_SIZE))])
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    seed(int(sys.argv[1]))
@@ -0,0 +1,82 @@
+from pathlib import Path
+import os
+import pytest
+import subprocess
+import sys
+from sqlalchemy import event
+
+'''
+This file defines fixtures shared by the performance tests
+'''
+
+# Folder qbay is run from
+root_folder = Path(__file__).parent.parent.parent
+
+# Tests marked benchmark seed large databases or compare timings, which
+# is slow and varies with the machine, so they only run when benchmarks=1
+# is set in the environment
+BENCHMARKS = os.getenv('benchmarks') == '1'
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'benchmark: timed comparison, run with benchmarks=1')
+
+
+def pytest_collection_modifyitems(config, items):
+    if BENCHMARKS:
+        return
+    skip = pytest.mark.skip(reason='set benchmarks=1 to run')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def statements():
+    '''
+    Record every SQL statement sent to the database while the test runs.
+
+    Returns:
+        list of (statement, parameters) tuples, filled in as the test runs
+    '''
+    # imported here so the database is not opened before the session starts
+    from qbay.models import db
+    recorded = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        recorded.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    yield recorded
+    event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.fixture
+def timings(tmp_path):
+    '''
+    Run a benchmark script in a process of its own against a new scratch
+    database, with the listing cache off. The script prints the times it
+    takes as pairs of a name and seconds.
+
+    Returns:
+        function of the script and its arguments, returning the times as
+        a dict of seconds by name
+    '''
+    runs = []
+
+    def run(script, *args):
+        runs.append(script)
+        db_file = tmp_path.joinpath('benchmark' + str(len(runs)) + '.sqlite')
+        output = subprocess.run(
+            [sys.executable, '-c', script] + [str(arg) for arg in args],
+            env=dict(os.environ, cache_size='0',
+                     db_string='sqlite:///' + str(db_file)),
+            cwd=str(root_folder),
+            capture_output=True,
+            text=True,
+        ).stdout.split()
+        return dict(zip(output[0::2], map(float, output[1::2])))
+
+    return run
@@ -0,0 +1,55 @@
+from qbay.models import *
+from sqlalchemy.exc import OperationalError
+import sys
+import time
+
+'''
+Mixed read/write workload that test_db_profile.py runs in several processes
+at once against one database file:
+
+    python -m qbay_test.performance.mixed_workload WORKER ITERATIONS
+
+Each iteration creates one product and lists the catalog four times. Prints
+the number of operations that succeeded, the number that failed and the
+seconds the workload took.
+'''
+
+
+def run(worker, iterations):
+    '''
+    Run the workload for one worker
+
+    Parameters:
+        worker (string):      name that keeps this worker's rows apart
+        iterations (integer): number of iterations
+
+    Returns:
+        (succeeded, failed, seconds)
+    '''
+    seller = "profile_seller" + worker + "@qbay.com"
+    succeeded = 0
+    failed = 0
+
+    def attempt(operation, *args):
+        nonlocal succeeded, failed
+        try:
+            operation(*args)
+            succeeded += 1
+        except OperationalError:
+            # "database is locked"
+            db.session.rollback()
+            failed += 1
+
+    start = time.perf_counter()
+    attempt(register, "ProfileSeller", seller, "Password99@")
+    for i in range(0, iterations):
+        attempt(create_product, "profile product " + str(i),
+                "24 character description", 11.0, seller,
+                datetime.date(2022, 9, 29))
+        for j in range(0, 4):
+            attempt(get_avail_products)
+    return succeeded, failed, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    print(*run(sys.argv[1], int(sys.argv[2])))
@@ -0,0 +1,247 @@
+from qbay import app
+from qbay.models import *
+from pathlib import Path
+from sqlalchemy import event
+import os
+import pytest
+import subprocess
+import sys
+import time
+
+# Set the current folder
+current_folder = Path(__file__).parent
+
+# Orders each writer process places in the benchmark
+WRITER_ORDERS = 100
+
+# Stripes used when writer processes credit them
+BENCHMARK_STRIPES = 8
+
+# Seller credited on stripes and buyers of their products
+register("StripeSeller",
+         "stripe_seller@qbay.com",
+         "Password99@")
+
+register("StripeBuyer",
+         "stripe_buyer@qbay.com",
+         "Password99@")
+
+register("StripeBuyerTwo",
+         "stripe_buyer_two@qbay.com",
+         "Password99@")
+
+for i in range(0, 6):
+    create_product("stripe product " + str(i),
+                   "24 character description",
+                   20.0, "stripe_seller@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+create_product("stripe race product",
+               "24 character description",
+               20.0, "stripe_buyer_two@qbay.com",
+               datetime.date(2022, 9, 29))
+
+create_product("stripe buyer product",
+               "24 character description",
+               210.0, "stripe_buyer@qbay.com",
+               datetime.date(2022, 9, 29))
+
+# Fill a scratch database with one seller's products and a buyer per writer
+SETUP = '''
+from qbay.models import *
+import sys
+
+writers, orders = int(sys.argv[1]), int(sys.argv[2])
+db.session.execute(User.__table__.insert(), [
+    {'username': 'Writer', 'email': 'writer' + str(i) + '@qbay.com',
+     'password': 'Password99@', 'balance': 1000000.0}
+    for i in range(writers)] + [
+    {'username': 'HotSeller', 'email': 'hot_seller@qbay.com',
+     'password': 'Password99@', 'balance': 0.0}])
+db.session.execute(Product.__table__.insert(), [
+    {'title': 'hot product ' + str(i), 'description': 'x' * 24,
+     'price': 10.0, 'last_modified_date': datetime.date(2022, 9, 29),
+     'seller_email': 'hot_seller@qbay.com'}
+    for i in range(writers * orders)])
+db.session.commit()
+'''
+
+# Place one writer's orders, starting at an agreed time so that the
+# writers run together
+WRITER = '''
+from qbay.models import *
+import sys
+import time
+
+writer, orders, start = int(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3])
+time.sleep(max(0, start - time.time()))
+began = time.time()
+for i in range(writer * orders, (writer + 1) * orders):
+    assert order('hot product ' + str(i), 'hot_seller@qbay.com',
+                 'writer' + str(writer) + '@qbay.com')
+print(began, time.time())
+'''
+
+# Fold the stripes and print the seller's balance
+CHECK = '''
+from qbay.models import *
+
+fold_balances()
+print(db.session.get(User, 'hot_seller@qbay.com').balance)
+'''
+
+
+@pytest.fixture
+def stripes():
+    '''
+    Credit sellers on 4 balance stripes for the duration of a test
+    '''
+    app.config['QBAY_BALANCE_STRIPES'] = 4
+    yield
+    app.config['QBAY_BALANCE_STRIPES'] = 0
+
+
+def balance(email):
+    '''
+    Balance of a user, without credits waiting on stripes
+    '''
+    return db.session.get(User, email).balance
+
+
+def test_credits_on_stripes(stripes):
+    '''
+    Sales credit the seller's stripes instead of their balance until they
+    are folded in
+    '''
+    for i in range(0, 4):
+        assert order("stripe product " + str(i), "stripe_seller@qbay.com",
+                     "stripe_buyer@qbay.com") is True
+    assert order_many([("stripe product 4", "stripe_seller@qbay.com")],
+                      "stripe_buyer@qbay.com") is True
+
+    assert balance("stripe_seller@qbay.com") == 100.0
+    assert balance("stripe_buyer@qbay.com") == 0.0
+    assert get_balance("stripe_seller@qbay.com") == 200.0
+    assert get_balance("stripe_nobody@qbay.com") is None
+    assert BalanceDelta.query.filter_by(
+        email="stripe_seller@qbay.com").count() == 4
+
+    assert fold_balances("stripe_seller@qbay.com") == 1
+    assert balance("stripe_seller@qbay.com") == 200.0
+    assert get_balance("stripe_seller@qbay.com") == 200.0
+    assert fold_balances("stripe_seller@qbay.com") == 0
+
+
+def test_debit_folds_credits(stripes):
+    '''
+    A seller can spend credits still waiting on stripes
+    '''
+    assert order("stripe product 5", "stripe_seller@qbay.com",
+                 "stripe_buyer_two@qbay.com") is True
+    assert balance("stripe_seller@qbay.com") == 200.0
+    assert order("stripe buyer product", "stripe_buyer@qbay.com",
+                 "stripe_seller@qbay.com") is True
+
+    assert balance("stripe_seller@qbay.com") == 200.0 + 20.0 - 210.0
+    assert get_balance("stripe_seller@qbay.com") == 10.0
+    assert get_balance("stripe_buyer@qbay.com") == 210.0
+
+
+def test_stripes_made_concurrently(stripes):
+    '''
+    A seller's first credit still succeeds when a concurrent order makes
+    their stripes between this order finding none and making them
+    '''
+    made = []
+
+    # the stripes appear once this order has looked for them
+    def concurrent_order(connection, statement, *args):
+        if (not made and
+                str(statement).startswith('SELECT balance_delta.stripe')):
+            made.append(True)
+            connection.execute(BalanceDelta.__table__.insert(), [
+                {'email': "stripe_buyer_two@qbay.com", 'stripe': stripe,
+                 'amount': 0.0} for stripe in range(4)])
+
+    event.listen(db.engine, 'after_execute', concurrent_order)
+    try:
+        assert order("stripe race product", "stripe_buyer_two@qbay.com",
+                     "stripe_buyer@qbay.com") is True
+    finally:
+        event.remove(db.engine, 'after_execute', concurrent_order)
+
+    assert made
+    assert get_balance("stripe_buyer_two@qbay.com") == 80.0 + 20.0
+    assert BalanceDelta.query.filter_by(
+        email="stripe_buyer_two@qbay.com").count() == 4
+
+
+def run(script, *args, **env):
+    '''
+    Run a script against the benchmark's scratch database
+
+    Returns:
+        the script's process
+    '''
+    return subprocess.Popen(
+        [sys.executable, '-c', script] + [str(arg) for arg in args],
+        env=dict(os.environ, cache_size='0', db_profile='performance',
+                 **env),
+        cwd=str(current_folder.parent.parent),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+
+def run_writers(db_file, stripe_count, writers, orders):
+    '''
+    Have writer processes sell one seller's products together in a scratch
+    database, then fold the seller's credits
+
+    Returns:
+        (orders per second, the seller's balance afterwards)
+    '''
+    env = {'db_string': 'sqlite:///' + str(db_file),
+           'balance_stripes': str(stripe_count)}
+    run(SETUP, writers, orders, **env).communicate()
+
+    start = time.time() + 2
+    processes = [run(WRITER, writer, orders, start, **env)
+                 for writer in range(writers)]
+    spans = [[float(t) for t in process.communicate()[0].split()]
+             for process in processes]
+    elapsed = (max(end for began, end in spans) -
+               min(began for began, end in spans))
+    credited = run(CHECK, **env).communicate()[0]
+    return writers * orders / elapsed, float(credited)
+
+
+def test_concurrent_credits_kept(tmp_path):
+    '''
+    Writer processes crediting one seller's stripes together lose none of
+    the credits
+    '''
+    _, credited = run_writers(tmp_path.joinpath('stripes.sqlite'),
+                              BENCHMARK_STRIPES, 2, 20)
+    assert credited == 10.0 * 2 * 20
+
+
+@pytest.mark.benchmark
+def test_stripes_benchmark(tmp_path):
+    '''
+    Print the orders per second that writer processes selling one
+    seller's products get through together, with and without balance
+    stripes. No order is lost either way. SQLite lets one transaction
+    write at a time whatever rows it touches, so the stripes are not
+    expected to scale here as they would with row locks.
+    '''
+    print()
+    for stripe_count in (0, BENCHMARK_STRIPES):
+        for writers in (1, 2, 4):
+            rate, credited = run_writers(
+                tmp_path.joinpath('stripes' + str(stripe_count) + '_' +
+                                  str(writers) + '.sqlite'),
+                stripe_count, writers, WRITER_ORDERS)
+            print("%d stripes, %d writers: %.0f orders/s"
+                  % (stripe_count, writers, rate))
+            assert credited == 10.0 * writers * WRITER_ORDERS
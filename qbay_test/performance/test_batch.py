@@ -0,0 +1,138 @@
+from qbay.models import *
+from sqlalchemy import event
+import pytest
+import time
+
+
+@pytest.fixture
+def commits():
+    '''
+    Count the commits sent to the database while the test runs
+    '''
+    count = [0]
+
+    def on_commit(conn):
+        count[0] += 1
+
+    event.listen(db.engine, 'commit', on_commit)
+    yield count
+    event.remove(db.engine, 'commit', on_commit)
+
+
+def test_batch_group_commit(commits):
+    '''
+    Writes inside a batch are saved by a single commit at the end of the
+    block, and the functions return what they normally would
+    '''
+    with batch():
+        assert register("BatchSeller", "batch_seller@qbay.com",
+                        "Password99@") is True
+        assert register("BatchBuyer", "batch_buyer@qbay.com",
+                        "Password99@") is True
+        assert register("BatchBuyer", "batch_buyer@qbay.com",
+                        "Password99@") is False
+        assert create_product("batch product 0",
+                              "24 character description",
+                              11.0, "batch_seller@qbay.com",
+                              datetime.date(2022, 9, 29)) is True
+        assert update_product("batch product 0", 11.0,
+                              "batch_seller@qbay.com",
+                              {'price': 12.0}) is True
+        assert update_user("batch_buyer@qbay.com", "Password99@",
+                           {'postal_code': 'N2P 4M1'}) is True
+        assert order("batch product 0", "batch_seller@qbay.com",
+                     "batch_buyer@qbay.com") is True
+        assert commits[0] == 0
+
+    assert commits[0] == 1
+    buyer = login("batch_buyer@qbay.com", "Password99@")
+    assert buyer.balance == 88.0
+    assert buyer.postal_code == 'N2P 4M1'
+    assert get_sold_products("batch_seller@qbay.com")[0].price == 12.0
+
+
+def test_batch_failed_order_keeps_batch(commits):
+    '''
+    An order that fails inside a batch only undoes itself
+    '''
+    with batch():
+        assert create_product("batch product 1",
+                              "24 character description",
+                              11.0, "batch_seller@qbay.com",
+                              datetime.date(2022, 9, 29)) is True
+        # already sold in the previous test
+        assert place_order("batch product 0", "batch_seller@qbay.com",
+                           "batch_buyer@qbay.com") == ORDER_SOLD
+        assert order("batch product 1", "batch_seller@qbay.com",
+                     "batch_buyer@qbay.com") is True
+
+    assert commits[0] == 1
+    buyer = login("batch_buyer@qbay.com", "Password99@")
+    assert buyer.balance == 77.0
+
+
+def test_batch_rollback_on_error(commits):
+    '''
+    An exception inside a batch rolls back every write made in it
+    '''
+    with pytest.raises(RuntimeError):
+        with batch():
+            assert register("BatchLost", "batch_lost@qbay.com",
+                            "Password99@") is True
+            assert create_product("batch product 2",
+                                  "24 character description",
+                                  11.0, "batch_seller@qbay.com",
+                                  datetime.date(2022, 9, 29)) is True
+            raise RuntimeError('abandon batch')
+
+    assert commits[0] == 0
+    assert login("batch_lost@qbay.com", "Password99@") is None
+    assert check_uniqueness("batch product 2", "batch_seller@qbay.com")
+
+    # the session is usable again afterwards
+    assert register("BatchLost", "batch_lost@qbay.com",
+                    "Password99@") is True
+
+
+def test_batch_nested(commits):
+    '''
+    Nested batches join the outermost one
+    '''
+    with batch():
+        with batch():
+            assert create_product("batch product 3",
+                                  "24 character description",
+                                  11.0, "batch_seller@qbay.com",
+                                  datetime.date(2022, 9, 29)) is True
+        assert commits[0] == 0
+    assert commits[0] == 1
+    assert not check_uniqueness("batch product 3", "batch_seller@qbay.com")
+
+
+def test_batch_speedup():
+    '''
+    Print the time taken to create products one commit at a time and in a
+    single batch
+    '''
+    count = 100
+
+    start = time.perf_counter()
+    for i in range(0, count):
+        create_product("batch single " + str(i),
+                       "24 character description",
+                       11.0, "batch_seller@qbay.com",
+                       datetime.date(2022, 9, 29))
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with batch():
+        for i in range(0, count):
+            create_product("batch group " + str(i),
+                           "24 character description",
+                           11.0, "batch_seller@qbay.com",
+                           datetime.date(2022, 9, 29))
+    grouped = time.perf_counter() - start
+
+    print("\n%d creates: %.3fs committing each, %.3fs batched"
+          % (count, single, grouped))
+    assert len(get_avail_products()) >= 2 * count
@@ -0,0 +1,163 @@
+from qbay.models import *
+from qbay.bulk import register_many, create_products_bulk
+import io
+
+# A user that already exists before the imports
+register("BulkExisting",
+         "bulk_existing@qbay.com",
+         "Password99@")
+
+
+def test_register_many_results():
+    '''
+    register_many accepts and rejects the same users register() would,
+    reporting one result per input row
+    '''
+    report = register_many([
+        ("BulkUser0", "bulk_user0@qbay.com", "Password99@"),
+        # taken before the import
+        ("BulkUser1", "bulk_existing@qbay.com", "Password99@"),
+        # bad password
+        ("BulkUser2", "bulk_user2@qbay.com", "password"),
+        # bad username
+        ("B!", "bulk_user3@qbay.com", "Password99@"),
+        # taken earlier in the same import
+        ("BulkUser4", "bulk_user0@qbay.com", "Password99@"),
+        {'name': "BulkUser5", 'email': "bulk_user5@qbay.com",
+         'password': "Password99@"},
+    ], chunk_size=2)
+
+    assert report.results == [True, False, False, False, False, True]
+    assert report.inserted == 2
+
+    user = login("bulk_user5@qbay.com", "Password99@")
+    assert user.username == "BulkUser5"
+    assert user.balance == 100.0
+    assert user.shipping_address == ''
+
+
+def test_register_many_invalid_then_valid():
+    '''
+    A row that fails the checks is not written because a later row with
+    the same email passes them
+    '''
+    report = register_many([
+        ("BulkOne", "bulk_twice@qbay.com", "bad"),
+        ("BulkTwo", "bulk_twice@qbay.com", "Password99@"),
+    ])
+
+    assert report.results == [False, True]
+    assert login("bulk_twice@qbay.com", "Password99@").username == "BulkTwo"
+
+
+def test_register_many_csv():
+    '''
+    Users can be imported from a CSV stream
+    '''
+    stream = io.StringIO("name,email,password\n"
+                         "CsvUser0,bulk_csv0@qbay.com,Password99@\n"
+                         "CsvUser1,bulk_csv1@qbay.com,Password99@\n"
+                         "CsvUser2,bulk_user0@qbay.com,Password99@\n")
+    report = register_many(stream)
+    assert report.results == [True, True, False]
+    assert login("bulk_csv1@qbay.com", "Password99@") is not None
+
+
+def test_register_many_batched(statements):
+    '''
+    Each chunk costs one duplicate lookup and one bulk insert, however
+    many users it holds. Prints the measured import rate.
+    '''
+    count = 2000
+    users = [("BulkUser", "bulk_many" + str(i) + "@qbay.com", "Password99@")
+             for i in range(0, count)]
+
+    statements.clear()
+    report = register_many(users, chunk_size=500)
+
+    print("\nImported %d users in %.3fs (%.0f rows/sec)"
+          % (report.inserted, report.elapsed, report.rows_per_sec))
+    assert report.inserted == count
+    selects = [s for s, p in statements if s.lstrip().startswith('SELECT')]
+    inserts = [s for s, p in statements if s.lstrip().startswith('INSERT')]
+    assert len(selects) == count // 500
+    assert len(inserts) == count // 500
+
+
+def test_create_products_bulk_results():
+    '''
+    create_products_bulk accepts and rejects the same products
+    create_product() would, reporting one result per input row
+    '''
+    assert create_product("bulk product 0",
+                          "24 character description",
+                          11.0, "bulk_existing@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+
+    def row(title, price=11.0, seller="bulk_existing@qbay.com"):
+        return {'title': title, 'description': "24 character description",
+                'price': price, 'seller_email': seller,
+                'date': datetime.date(2022, 9, 29)}
+
+    report = create_products_bulk([
+        row("bulk product 1"),
+        # title already used by the seller
+        row("bulk product 0"),
+        # price out of range
+        row("bulk product 2", price=5.0),
+        # seller does not exist
+        row("bulk product 3", seller="nobody@qbay.com"),
+        # title repeated within the load
+        row("bulk product 1"),
+        # same title for another seller is fine
+        row("bulk product 0", seller="bulk_user0@qbay.com"),
+        # not alphanumeric
+        row("bulk product 4!"),
+    ], chunk_size=3, workers=2)
+
+    assert report.results == [True, False, False, False, False, True, False]
+    assert report.inserted == 2
+    product = Product.query.filter_by(
+        title="bulk product 1", seller_email="bulk_existing@qbay.com").first()
+    assert product.status == PRODUCT_AVAILABLE
+    assert product.price == 11.0
+
+
+def test_create_products_bulk_csv():
+    '''
+    Products can be loaded from a CSV stream
+    '''
+    stream = io.StringIO(
+        "title,description,price,seller_email,date\n"
+        "bulk csv 0,24 character description,12.5,bulk_csv0@qbay.com,"
+        "2022-09-29\n"
+        "bulk csv 1,24 character description,not a price,"
+        "bulk_csv0@qbay.com,2022-09-29\n")
+    report = create_products_bulk(stream, workers=0)
+    assert report.results == [True, False]
+    product = Product.query.filter_by(title="bulk csv 0").first()
+    assert product.price == 12.5
+
+
+def test_create_products_bulk_batched(statements):
+    '''
+    Each chunk costs a seller lookup, a title lookup and one bulk insert,
+    however many products it holds. Prints the measured load rate.
+    '''
+    count = 2000
+    products = [{'title': "bulk many " + str(i),
+                 'description': "24 character description",
+                 'price': 11.0, 'seller_email': "bulk_many" + str(i % 50) +
+                 "@qbay.com", 'date': datetime.date(2022, 9, 29)}
+                for i in range(0, count)]
+
+    statements.clear()
+    report = create_products_bulk(products, chunk_size=500, workers=2)
+
+    print("\nCreated %d products in %.3fs (%.0f rows/sec)"
+          % (report.inserted, report.elapsed, report.rows_per_sec))
+    assert report.inserted == count
+    selects = [s for s, p in statements if s.lstrip().startswith('SELECT')]
+    inserts = [s for s, p in statements if s.lstrip().startswith('INSERT')]
+    assert len(selects) == 2 * count // 500
+    assert len(inserts) == count // 500
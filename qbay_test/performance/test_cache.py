@@ -0,0 +1,278 @@
+from qbay import app
+from qbay.models import *
+from pathlib import Path
+import os
+import pytest
+import subprocess
+import sys
+
+# Set the current folder
+current_folder = Path(__file__).parent
+
+# Seller and buyer whose listings are cached
+register("CacheSeller",
+         "cache_seller@qbay.com",
+         "Password99@")
+
+register("CacheBuyer",
+         "cache_buyer@qbay.com",
+         "Password99@")
+
+for i in range(0, 3):
+    create_product("cache product " + str(i),
+                   "24 character description",
+                   11.0, "cache_seller@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+# Make writes of every kind to a scratch database and print the product
+# table's version, counted by the triggers or, with 'hook', by the hook
+# used on databases without them
+COUNTED_WRITES = '''
+from qbay.models import *
+from qbay.models import _count_product_writes
+from sqlalchemy import event
+import sys
+
+if sys.argv[1] == 'hook':
+    for operation in ('insert', 'update'):
+        db.session.execute(db.text('DROP TRIGGER product_version_' +
+                                   operation))
+    db.session.commit()
+    event.listen(db.engine, 'after_execute', _count_product_writes)
+
+register("Seller", "count_seller@qbay.com", "Password99@")
+register("Buyer", "count_buyer@qbay.com", "Password99@")
+for i in range(0, 4):
+    create_product("count product " + str(i), "24 character description",
+                   11.0, "count_seller@qbay.com", datetime.date(2022, 9, 29))
+update_product("count product 0", 11.0, "count_seller@qbay.com",
+               {'price': 12.0})
+order("count product 1", "count_seller@qbay.com", "count_buyer@qbay.com")
+order_many([("count product 2", "count_seller@qbay.com"),
+            ("count product 3", "count_seller@qbay.com")],
+           "count_buyer@qbay.com")
+Product.query.filter(Product.seller_email == "count_seller@qbay.com").update(
+    {Product.description: "a longer 24 character description"},
+    synchronize_session=False)
+db.session.commit()
+print(get_catalog_version())
+'''
+
+
+@pytest.fixture
+def cache_config():
+    '''
+    Start from an empty cache and restore its settings afterwards
+    '''
+    saved = (app.config['QBAY_CACHE_SIZE'], app.config['QBAY_CACHE_TTL'])
+    clear_cache()
+    yield app.config
+    app.config['QBAY_CACHE_SIZE'], app.config['QBAY_CACHE_TTL'] = saved
+    clear_cache()
+
+
+def listing_queries(statements):
+    '''
+    The recorded statements other than the cache's version checks
+    '''
+    return [(statement, parameters) for statement, parameters in statements
+            if 'data_version' not in statement]
+
+
+def fresh_summaries():
+    '''
+    The available summaries read from the database, bypassing the cache
+    '''
+    clear_cache()
+    return get_avail_summaries()
+
+
+def test_repeated_listing_hits(cache_config, statements):
+    '''
+    Listing the catalog and its pages again is served from memory
+    '''
+    before = get_cache_stats()
+    get_avail_summaries()
+    get_avail_products_page(2)
+    statements.clear()
+
+    assert get_avail_summaries() == get_avail_summaries()
+    assert get_avail_products_page(2) == get_avail_products_page(2)
+    # each hit only checks the product table's version
+    assert listing_queries(statements) == []
+    assert len(statements) == 4
+
+    stats = get_cache_stats()
+    assert stats.misses - before.misses == 2
+    assert stats.hits - before.hits == 4
+    assert stats.views == 2
+
+
+def test_writes_patch_catalog(cache_config, statements):
+    '''
+    Creating, updating and ordering products patches the cached catalog
+    instead of dropping it
+    '''
+    get_avail_summaries()
+    assert create_product("cache product 3",
+                          "24 character description",
+                          11.0, "cache_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+    assert update_product("cache product 0", 11.0, "cache_seller@qbay.com",
+                          {'title': "cache product 4", 'price': 20.0}) is True
+    assert order("cache product 1", "cache_seller@qbay.com",
+                 "cache_buyer@qbay.com") is True
+
+    statements.clear()
+    patched = get_avail_summaries()
+    assert listing_queries(statements) == []
+    assert patched == fresh_summaries()
+
+    titles = {summary.title: summary.price for summary in patched
+              if summary.seller_email == "cache_seller@qbay.com"}
+    assert titles == {"cache product 2": 11.0, "cache product 3": 11.0,
+                      "cache product 4": 20.0}
+
+
+def test_order_drops_sales_report(cache_config):
+    '''
+    A seller's cached sales report is reloaded once they sell something
+    '''
+    report = get_sales_report("cache_seller@qbay.com")
+    assert get_sales_report("cache_seller@qbay.com") == report
+    assert order("cache product 2", "cache_seller@qbay.com",
+                 "cache_buyer@qbay.com") is True
+    assert get_sales_report("cache_seller@qbay.com").count == report.count + 1
+
+
+def test_cached_views_are_copies(cache_config):
+    '''
+    Changing a returned list does not change the cached view
+    '''
+    catalog = get_avail_summaries()
+    catalog.clear()
+    assert get_avail_summaries() != []
+
+
+def test_lru_eviction(cache_config):
+    '''
+    Once the cache is full the least recently used view is dropped
+    '''
+    cache_config['QBAY_CACHE_SIZE'] = 2
+    get_sales_report("cache_seller@qbay.com")
+    get_sales_report("cache_buyer@qbay.com")
+    # use the seller's report again so the buyer's is the oldest
+    get_sales_report("cache_seller@qbay.com")
+    get_sales_report("nobody@qbay.com")
+    assert get_cache_stats().views == 2
+
+    before = get_cache_stats()
+    get_sales_report("cache_seller@qbay.com")
+    get_sales_report("cache_buyer@qbay.com")
+    stats = get_cache_stats()
+    assert (stats.hits - before.hits, stats.misses - before.misses) == (1, 1)
+
+
+def test_ttl_and_disabled(cache_config, statements):
+    '''
+    Views older than the TTL are reloaded, and a size of 0 turns caching
+    off
+    '''
+    cache_config['QBAY_CACHE_TTL'] = 0
+    get_avail_summaries()
+    statements.clear()
+    get_avail_summaries()
+    assert len(listing_queries(statements)) == 1
+
+    cache_config['QBAY_CACHE_TTL'] = 300
+    cache_config['QBAY_CACHE_SIZE'] = 0
+    get_avail_summaries()
+    get_avail_summaries()
+    assert len(listing_queries(statements)) == 3
+
+
+def test_batch_rollback_clears(cache_config):
+    '''
+    Views patched by writes that a batch then rolls back are dropped
+    '''
+    get_avail_summaries()
+    with pytest.raises(RuntimeError):
+        with batch():
+            assert create_product("cache product 5",
+                                  "24 character description",
+                                  11.0, "cache_seller@qbay.com",
+                                  datetime.date(2022, 9, 29)) is True
+            raise RuntimeError('abandon batch')
+
+    assert "cache product 5" not in {summary.title for summary in
+                                     get_avail_summaries()}
+    assert get_avail_summaries() == fresh_summaries()
+
+
+def write_elsewhere(code):
+    '''
+    Run a snippet of Python in another process sharing the database file
+    '''
+    subprocess.run(
+        [sys.executable, '-c', 'from qbay.models import *\n' + code],
+        cwd=str(current_folder.parent.parent),
+        check=True,
+    )
+
+
+def test_other_process_writes(cache_config, statements):
+    '''
+    A product created by another process drops the cached views before
+    they are next served, while this process's own writes only patch them
+    '''
+    get_avail_summaries()
+    write_elsewhere('create_product("cache product 6", '
+                    '"24 character description", 11.0, '
+                    '"cache_seller@qbay.com", datetime.date(2022, 9, 29))')
+
+    before = get_cache_stats()
+    assert "cache product 6" in {summary.title for summary in
+                                 get_avail_summaries()}
+    assert get_cache_stats().misses == before.misses + 1
+
+    assert create_product("cache product 7",
+                          "24 character description",
+                          11.0, "cache_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+    statements.clear()
+    assert "cache product 7" in {summary.title for summary in
+                                 get_avail_summaries()}
+    assert listing_queries(statements) == []
+
+
+def test_version_counts_every_write(cache_config):
+    '''
+    Writes that bypass the write functions still move the version on
+    '''
+    get_avail_summaries()
+    write_elsewhere('db.session.execute(Product.__table__.update()'
+                    '.where(Product.title == "cache product 6")'
+                    '.values(price=30.0))\n'
+                    'db.session.commit()')
+
+    prices = {summary.title: summary.price
+              for summary in get_avail_summaries()}
+    assert prices["cache product 6"] == 30.0
+
+
+def test_version_without_triggers(tmp_path):
+    '''
+    Databases without the triggers have their product writes counted by
+    this module instead, the same as the triggers count them
+    '''
+    versions = []
+    for counter in ('triggers', 'hook'):
+        versions.append(subprocess.run(
+            [sys.executable, '-c', COUNTED_WRITES, counter],
+            env=dict(os.environ, db_string='sqlite:///' +
+                     str(tmp_path.joinpath(counter + '.sqlite'))),
+            cwd=str(current_folder.parent.parent),
+            capture_output=True,
+            text=True,
+        ).stdout)
+    assert versions[0] == versions[1] == '12\n'
@@ -0,0 +1,168 @@
+from qbay.models import *
+import pytest
+import qbay.cli
+
+# Products in the carts the benchmark checks out
+CART_SIZE = 20
+
+# Two sellers and a buyer of the products put in carts
+register("CartSellerA",
+         "cart_seller_a@qbay.com",
+         "Password99@")
+
+register("CartSellerB",
+         "cart_seller_b@qbay.com",
+         "Password99@")
+
+register("CartBuyer",
+         "cart_buyer@qbay.com",
+         "Password99@")
+
+for i in range(0, 8):
+    create_product("cart product " + str(i),
+                   "24 character description",
+                   10.0 + i, "cart_seller_" + "ab"[i % 2] + "@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+# Seed a scratch database, then time ordering one cart of products with
+# sequential order() calls and another with one order_many() call
+BENCHMARK = '''
+from qbay_test.performance.catalog import seed
+from qbay.models import *
+import sys
+import time
+
+size = int(sys.argv[1])
+seed(2 * size)
+register("Buyer", "benchmark_buyer@qbay.com", "Password99@")
+User.query.filter_by(email="benchmark_buyer@qbay.com").update(
+    {User.balance: 1000000.0})
+db.session.commit()
+products = [(product.title, product.seller_email)
+            for product in Product.query.order_by(Product.id_num)]
+
+start = time.perf_counter()
+for title, seller_email in products[:size]:
+    assert order(title, seller_email, "benchmark_buyer@qbay.com")
+print('sequential', time.perf_counter() - start)
+
+start = time.perf_counter()
+assert order_many(products[size:], "benchmark_buyer@qbay.com")
+print('cart', time.perf_counter() - start)
+'''
+
+
+def cart(*numbers):
+    '''
+    Items of a cart of the cart products with the given numbers
+    '''
+    return [("cart product " + str(i),
+             "cart_seller_" + "ab"[i % 2] + "@qbay.com") for i in numbers]
+
+
+def balance(email):
+    '''
+    Current balance of a user
+    '''
+    return db.session.get(User, email).balance
+
+
+def status(number):
+    '''
+    Status of the cart product with the given number
+    '''
+    title, seller_email = cart(number)[0]
+    return Product.query.filter_by(title=title,
+                                   seller_email=seller_email).first().status
+
+
+def test_cart_all_or_nothing():
+    '''
+    A cart that fails on any product orders none of them
+    '''
+    assert place_cart_order([], "cart_buyer@qbay.com") == \
+        CartOutcome(ORDER_EMPTY_CART, None)
+    assert place_cart_order(cart(0) + [("missing", "cart_seller_a@qbay.com")],
+                            "cart_buyer@qbay.com") == \
+        CartOutcome(ORDER_NO_PRODUCT, ("missing", "cart_seller_a@qbay.com"))
+    assert place_cart_order(cart(0, 0), "cart_buyer@qbay.com") == \
+        CartOutcome(ORDER_SOLD, cart(0)[0])
+    assert place_cart_order(cart(1), "cart_seller_b@qbay.com") == \
+        CartOutcome(ORDER_OWN_PRODUCT, cart(1)[0])
+    # 10 + 11 + ... + 17 is more than the starting balance of 100
+    assert place_cart_order(cart(*range(8)), "cart_buyer@qbay.com") == \
+        CartOutcome(ORDER_INSUFFICIENT_FUNDS, None)
+    assert order_many(cart(0), "cart_nobody@qbay.com") is False
+
+    assert balance("cart_buyer@qbay.com") == 100.0
+    assert Transaction.query.filter_by(
+        buyer_email="cart_buyer@qbay.com").count() == 0
+
+
+def test_cart_settles_once(statements):
+    '''
+    A cart is settled with the same statements whatever its size: each
+    seller is credited once with their total and everything is committed
+    together
+    '''
+    clear_cache()
+    statements.clear()
+    assert order_many(cart(0, 1, 2), "cart_buyer@qbay.com") is True
+    settled = [s for s, p in statements if 'data_version' not in s]
+    # the sellers are credited with one executemany
+    credits = [p for s, p in statements
+               if s.startswith('UPDATE user SET balance=(user.balance +')]
+    assert len(credits) == 1 and len(credits[0]) == 2
+    assert sum(s.startswith('INSERT INTO "transaction"') for s in settled) \
+        == 1
+
+    assert balance("cart_buyer@qbay.com") == 100.0 - 33.0
+    assert balance("cart_seller_a@qbay.com") == 100.0 + 22.0
+    assert balance("cart_seller_b@qbay.com") == 100.0 + 11.0
+    assert [status(i) for i in range(8)] == \
+        [PRODUCT_SOLD] * 3 + [PRODUCT_AVAILABLE] * 5
+
+    statements.clear()
+    assert order_many(cart(3, 4), "cart_buyer@qbay.com") is True
+    assert len([s for s, p in statements if 'data_version' not in s]) == \
+        len(settled)
+
+    assert order_many(cart(3, 5), "cart_buyer@qbay.com") is False
+    assert status(5) == PRODUCT_AVAILABLE
+
+
+def test_checkout_page(monkeypatch, capsys):
+    '''
+    Products put in the cart from the order page are all ordered from the
+    checkout page
+    '''
+    user = login("cart_buyer@qbay.com", "Password99@")
+    answers = iter(["cart", "cart", "order"])
+    monkeypatch.setattr('builtins.input', lambda *args: next(answers))
+    for i in (6, 7):
+        title, seller_email = cart(i)[0]
+        product = Product.query.filter_by(title=title,
+                                          seller_email=seller_email).first()
+        qbay.cli.order_page(user, ProductSummary(
+            product.id_num, title, product.price, seller_email))
+    qbay.cli.checkout_page(user)
+    output = capsys.readouterr().out
+    assert "Product added to your cart." in output
+    assert "1. cart product 6 ($16.0)\n2. cart product 7 ($17.0)" in output
+    assert "Total: $33.0" in output
+    assert "Products successfully ordered!" in output
+    assert "cart_buyer@qbay.com" not in qbay.cli.carts
+    assert Transaction.query.filter_by(
+        buyer_email="cart_buyer@qbay.com").count() == 7
+
+
+@pytest.mark.benchmark
+def test_cart_benchmark(timings):
+    '''
+    Print the time of ordering a cart of products one order() at a time
+    and with order_many(). The cart is faster.
+    '''
+    times = timings(BENCHMARK, CART_SIZE)
+    print("\n%d products: sequential %.1fms, cart %.1fms"
+          % (CART_SIZE, times['sequential'] * 1e3, times['cart'] * 1e3))
+    assert times['cart'] < times['sequential']
@@ -0,0 +1,123 @@
+from qbay import app
+from qbay.models import *
+from qbay.catalog_file import (CatalogFile, open_catalog_file, run_writer,
+                               write_catalog_file)
+import qbay.cli
+import pytest
+
+# Seller of the products in the catalog file
+register("FileSeller",
+         "file_seller@qbay.com",
+         "Password99@")
+
+for i in range(0, 5):
+    create_product("file product " + str(i),
+                   "24 character description",
+                   11.0 + i, "file_seller@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+
+@pytest.fixture
+def catalog_path(tmp_path):
+    '''
+    Path of a catalog file written for the test
+    '''
+    path = str(tmp_path.joinpath('catalog.bin'))
+    write_catalog_file(path)
+    return path
+
+
+def test_file_pages_match_database(catalog_path):
+    '''
+    Pages read from the file are the pages the database gives
+    '''
+    catalog = CatalogFile(catalog_path)
+    summaries = get_avail_summaries()
+    assert len(catalog) == len(summaries)
+    assert catalog.version == get_catalog_version()
+    assert catalog.is_current()
+
+    cursors = [None, summaries[0].id_num, summaries[len(summaries) // 2]
+               .id_num, summaries[-1].id_num, 0]
+    for after in cursors:
+        assert catalog.page(3, after=after) == \
+            get_avail_products_page(3, after=after)
+    for before in cursors[1:]:
+        assert catalog.page(3, before=before) == \
+            get_avail_products_page(3, before=before)
+    assert catalog.page(len(summaries)) == summaries
+    catalog.close()
+
+
+def test_file_goes_stale(catalog_path):
+    '''
+    A write to the catalog makes the file stale until it is rewritten, and
+    reopening picks up the new file
+    '''
+    catalog = open_catalog_file(catalog_path)
+    assert open_catalog_file(catalog_path) is catalog
+
+    assert create_product("file product 5",
+                          "24 character description",
+                          20.0, "file_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+    assert not catalog.is_current()
+
+    write_catalog_file(catalog_path)
+    reopened = open_catalog_file(catalog_path)
+    assert reopened is not catalog
+    assert reopened.is_current()
+    assert reopened.page(len(reopened)) == get_avail_summaries()
+    # the old mapping still reads the old file
+    assert len(catalog) == len(reopened) - 1
+
+
+def test_writer_only_writes_changes(tmp_path):
+    '''
+    The background job rewrites the file only when the catalog changed
+    '''
+    path = str(tmp_path.joinpath('writer.bin'))
+    assert run_writer(path, interval=0, rounds=3) == 1
+    assert open_catalog_file(path).is_current()
+    assert open_catalog_file(str(tmp_path.joinpath('missing.bin'))) is None
+
+
+def test_cli_first_page_from_file(catalog_path, statements, monkeypatch,
+                                  capsys):
+    '''
+    With an up to date catalog file the products page only checks the
+    catalog version, and reads no products from the database
+    '''
+    monkeypatch.setitem(app.config, 'QBAY_CATALOG_FILE', catalog_path)
+    monkeypatch.setattr('builtins.input', lambda *args: '')
+    write_catalog_file(catalog_path)
+    open_catalog_file(catalog_path)
+
+    user = login("file_seller@qbay.com", "Password99@")
+    statements.clear()
+    qbay.cli.available_products_page(user)
+    assert [statement for statement, parameters in statements
+            if 'data_version' not in statement] == []
+    assert '. file product 0 ($11.0)' in capsys.readouterr().out
+
+
+def test_cli_previous_page_from_file(catalog_path, statements, monkeypatch,
+                                     capsys):
+    '''
+    Going back a page reads it from the catalog file too
+    '''
+    monkeypatch.setitem(app.config, 'QBAY_CATALOG_FILE', catalog_path)
+    monkeypatch.setattr(qbay.cli, 'PAGE_SIZE', 2)
+    answers = iter(['n', 'p', ''])
+    monkeypatch.setattr('builtins.input', lambda *args: next(answers))
+    write_catalog_file(catalog_path)
+    open_catalog_file(catalog_path)
+
+    user = login("file_seller@qbay.com", "Password99@")
+    statements.clear()
+    qbay.cli.available_products_page(user)
+    assert [statement for statement, parameters in statements
+            if 'data_version' not in statement] == []
+    output = capsys.readouterr().out
+    assert output.count("Products available for purchase (page 1)") == 2
+    assert "(page 2)" in output
@@ -0,0 +1,136 @@
+from pathlib import Path
+import os
+import subprocess
+import sys
+
+# Set the current folder
+current_folder = Path(__file__).parent
+
+# Worker processes sharing one database file, and iterations each
+WORKERS = 4
+ITERATIONS = 25
+
+
+def qbay_env(db_file, profile):
+    '''
+    Environment that points qbay at db_file with the given profile
+    '''
+    return dict(os.environ, db_string='sqlite:///' + str(db_file),
+                db_profile=profile)
+
+
+def run_qbay(code, db_file, profile):
+    '''
+    Run a snippet of Python against db_file in its own process and return
+    what it printed
+    '''
+    return subprocess.run(
+        [sys.executable, '-c', code],
+        env=qbay_env(db_file, profile),
+        cwd=str(current_folder.parent.parent),
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def test_profile_pragmas(tmp_path):
+    '''
+    The performance profile's settings are applied to every connection
+    '''
+    output = run_qbay(
+        'from qbay.models import db\n'
+        'for pragma in ("journal_mode", "synchronous", "mmap_size",\n'
+        '               "cache_size", "temp_store", "busy_timeout"):\n'
+        '    print(db.session.execute(db.text("PRAGMA " + pragma))\n'
+        '          .scalar())',
+        tmp_path.joinpath('pragmas.sqlite'), 'performance')
+    # synchronous NORMAL is 1, temp_store MEMORY is 2
+    assert output.split() == ['wal', '1', '268435456', '-65536', '2',
+                              '10000']
+
+
+def test_profile_keeps_connections(tmp_path):
+    '''
+    The performance profile reuses its connections across transactions,
+    so their settings and caches are kept, while the default profile opens
+    one per transaction
+    '''
+    count = ('from qbay.models import *\n'
+             'from sqlalchemy import event\n'
+             'db.session.commit()\n'
+             'connects = []\n'
+             'event.listen(db.engine, "connect",\n'
+             '             lambda *args: connects.append(1))\n'
+             'for i in range(0, 10):\n'
+             '    get_catalog_version()\n'
+             '    db.session.commit()\n'
+             'print(len(connects))')
+    assert run_qbay(count, tmp_path.joinpath('default.sqlite'),
+                    'default') == '10'
+    assert run_qbay(count, tmp_path.joinpath('performance.sqlite'),
+                    'performance') == '0'
+
+
+def test_unknown_profile(tmp_path):
+    '''
+    Asking for a profile that does not exist fails at startup
+    '''
+    result = subprocess.run(
+        [sys.executable, '-c', 'import qbay'],
+        env=qbay_env(tmp_path.joinpath('unknown.sqlite'), 'fastest'),
+        cwd=str(current_folder.parent.parent),
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode != 0
+    assert 'Unknown db_profile: fastest' in result.stderr
+
+
+def run_mixed_workload(db_file, profile):
+    '''
+    Run the mixed workload in WORKERS processes at once against db_file
+
+    Returns:
+        (succeeded, failed, seconds) where seconds is the time the slowest
+        worker spent on its workload
+    '''
+    # create the schema before the workers race to do it
+    run_qbay('import qbay.models', db_file, profile)
+
+    workers = [subprocess.Popen(
+        [sys.executable, '-m', 'qbay_test.performance.mixed_workload',
+         str(i), str(ITERATIONS)],
+        env=qbay_env(db_file, profile),
+        cwd=str(current_folder.parent.parent),
+        stdout=subprocess.PIPE,
+        text=True,
+    ) for i in range(0, WORKERS)]
+    outputs = [worker.communicate()[0] for worker in workers]
+
+    succeeded = failed = 0
+    elapsed = 0.0
+    for output in outputs:
+        counts = output.split()
+        succeeded += int(counts[0])
+        failed += int(counts[1])
+        elapsed = max(elapsed, float(counts[2]))
+    return succeeded, failed, elapsed
+
+
+def test_profile_benchmark(tmp_path):
+    '''
+    Compare the profiles on a mixed read/write workload from several
+    processes sharing one file, the performance profile with its pooled
+    connections. The performance profile never fails with "database is
+    locked".
+    '''
+    results = {}
+    for profile in ('default', 'performance'):
+        succeeded, failed, elapsed = run_mixed_workload(
+            tmp_path.joinpath(profile + '.sqlite'), profile)
+        results[profile] = (succeeded, failed)
+        print("\n%s: %d operations in %.3fs (%.0f ops/sec), %d locked"
+              % (profile, succeeded, elapsed, succeeded / elapsed, failed))
+
+    expected = WORKERS * (1 + 5 * ITERATIONS)
+    assert results['performance'] == (expected, 0)
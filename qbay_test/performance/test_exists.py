@@ -0,0 +1,111 @@
+from qbay.models import *
+import time
+import tracemalloc
+
+# Lookups per measurement
+LOOKUPS = 500
+
+# A seller with a product for the existence checks to find
+register("ExistsSeller",
+         "exists_seller@qbay.com",
+         "Password99@")
+
+create_product("exists product",
+               "24 character description",
+               11.0, "exists_seller@qbay.com",
+               datetime.date(2022, 9, 29))
+
+
+def test_validators_use_exists(statements):
+    '''
+    The validators ask the database whether a row exists instead of loading
+    it, so no objects end up in the session
+    '''
+    db.session.expunge_all()
+    statements.clear()
+
+    assert check_seller("exists_seller@qbay.com") is True
+    assert check_seller("nobody@qbay.com") is False
+    assert check_uniqueness("exists product",
+                            "exists_seller@qbay.com") is False
+    assert check_uniqueness("exists product 2",
+                            "exists_seller@qbay.com") is True
+    assert register("ExistsSeller", "exists_seller@qbay.com",
+                    "Password99@") is False
+
+    assert len(statements) == 5
+    for statement, parameters in statements:
+        assert 'EXISTS' in statement
+    assert len(db.session.identity_map) == 0
+
+
+def test_login_by_primary_key(statements):
+    '''
+    login looks the user up by primary key and checks the password
+    '''
+    db.session.expunge_all()
+    statements.clear()
+    user = login("exists_seller@qbay.com", "Password99@")
+    assert user.username == "ExistsSeller"
+    assert len(statements) == 1
+
+    # already loaded, so no query at all
+    assert login("exists_seller@qbay.com", "Password99@") is user
+    assert len(statements) == 1
+
+    assert login("exists_seller@qbay.com", "Wrongpass99@") is None
+    assert login("nobody@qbay.com", "Password99@") is None
+
+
+def measure(lookup):
+    '''
+    Run lookup LOOKUPS times untraced for timing, then again under
+    tracemalloc
+
+    Returns:
+        (seconds, peak bytes allocated)
+    '''
+    db.session.expunge_all()
+    start = time.perf_counter()
+    for i in range(0, LOOKUPS):
+        lookup()
+    elapsed = time.perf_counter() - start
+
+    db.session.expunge_all()
+    tracemalloc.start()
+    for i in range(0, LOOKUPS):
+        lookup()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def test_exists_benchmark():
+    '''
+    Print the latency and allocations of materializing rows to test for
+    existence against the EXISTS checks. The EXISTS checks allocate less.
+    '''
+    def materialize_seller():
+        return len(User.query.filter_by(
+            email="exists_seller@qbay.com").all()) > 0
+
+    def materialize_product():
+        return len(Product.query.filter_by(
+            title="exists product",
+            seller_email="exists_seller@qbay.com").all()) > 0
+
+    cases = [
+        ("seller", materialize_seller,
+         lambda: check_seller("exists_seller@qbay.com")),
+        ("uniqueness", materialize_product,
+         lambda: check_uniqueness("exists product",
+                                  "exists_seller@qbay.com")),
+    ]
+    print()
+    for name, old, new in cases:
+        old_time, old_peak = measure(old)
+        new_time, new_peak = measure(new)
+        print("%s: .all() %.1fus %dB peak, EXISTS %.1fus %dB peak"
+              % (name, old_time / LOOKUPS * 1e6, old_peak,
+                 new_time / LOOKUPS * 1e6, new_peak))
+        assert new_peak < old_peak
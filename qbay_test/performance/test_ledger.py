@@ -0,0 +1,247 @@
+from qbay.models import *
+from qbay.ledger import reconcile_ledger, write_checkpoint
+from pathlib import Path
+from sqlalchemy.exc import IntegrityError
+import os
+import pytest
+import subprocess
+import sys
+
+# Set the current folder
+current_folder = Path(__file__).parent
+
+# Sales in the history the benchmark reconciles, and sales made after its
+# checkpoint
+HISTORY_SALES = 5000
+NEW_SALES = 10
+
+# Seller and buyer whose orders are written to the ledger
+register("LedgerSeller",
+         "ledger_seller@qbay.com",
+         "Password99@")
+
+register("LedgerBuyer",
+         "ledger_buyer@qbay.com",
+         "Password99@")
+
+for i in range(0, 6):
+    create_product("ledger product " + str(i),
+                   "24 character description",
+                   10.15 + i, "ledger_seller@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+# Prices with fractions of a cent, which check_price accepts
+for i, price in enumerate([10.005, 10.015, 10.333]):
+    create_product("ledger cent product " + str(i),
+                   "24 character description",
+                   price, "ledger_seller@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+# Seed a scratch database with a history of sales, then time reconciling
+# all of it and reconciling only a few sales made after the checkpoint
+BENCHMARK = '''
+from qbay_test.performance.catalog import seed
+from qbay.ledger import reconcile_ledger
+from qbay.models import *
+import sys
+import time
+
+history, new = int(sys.argv[1]), int(sys.argv[2])
+seed(history + new)
+register("Buyer", "benchmark_buyer@qbay.com", "Password99@")
+User.query.filter_by(email="benchmark_buyer@qbay.com").update(
+    {User.balance: 100000000.0})
+db.session.commit()
+products = [(product.title, product.seller_email)
+            for product in Product.query.order_by(Product.id_num)]
+for first in range(0, history, 100):
+    assert order_many(products[first:min(history, first + 100)],
+                      "benchmark_buyer@qbay.com")
+
+start = time.perf_counter()
+assert reconcile_ledger().problems == []
+print('full', time.perf_counter() - start)
+
+for title, seller_email in products[history:]:
+    assert order(title, seller_email, "benchmark_buyer@qbay.com")
+start = time.perf_counter()
+result = reconcile_ledger()
+print('incremental', time.perf_counter() - start)
+assert result.problems == [] and result.sales == new
+'''
+
+# Make a sale in a scratch database, then drop the ledger as if the file
+# had been made before there was one
+BEFORE_LEDGER = '''
+from qbay.models import *
+
+register("Seller", "old_seller@qbay.com", "Password99@")
+register("Buyer", "old_buyer@qbay.com", "Password99@")
+for i in range(0, 3):
+    create_product("old product " + str(i), "24 character description",
+                   10.0, "old_seller@qbay.com", datetime.date(2022, 9, 29))
+assert order("old product 0", "old_seller@qbay.com", "old_buyer@qbay.com")
+db.session.execute(db.text('DROP TABLE ledger_entry'))
+db.session.execute(db.text('DROP TABLE ledger_checkpoint'))
+db.session.commit()
+'''
+
+# Reconcile a sale made after the ledger was added
+AFTER_LEDGER = '''
+from qbay.ledger import reconcile_ledger
+from qbay.models import *
+
+assert reconcile_ledger() == (0, 0, 0, [])
+assert order("old product 1", "old_seller@qbay.com", "old_buyer@qbay.com")
+assert reconcile_ledger() == (2, 1, 2, [])
+'''
+
+# Record a sale without its ledger entries
+UNRECORDED_SALE = '''
+from qbay.models import *
+
+db.session.execute(Transaction.__table__.insert().values(
+    buyer_email="old_buyer@qbay.com", product_id_num=3,
+    date=datetime.date(2022, 9, 29), price=10.0))
+db.session.commit()
+'''
+
+
+def balance(email):
+    '''
+    Current balance of a user
+    '''
+    return db.session.get(User, email).balance
+
+
+def test_orders_reconcile():
+    '''
+    Every way of ordering writes balanced entries in whole cents, and a
+    clean reconciliation moves the checkpoint past them
+    '''
+    write_checkpoint()
+    assert order("ledger product 0", "ledger_seller@qbay.com",
+                 "ledger_buyer@qbay.com") is True
+    assert order_many([("ledger product 1", "ledger_seller@qbay.com"),
+                       ("ledger product 2", "ledger_seller@qbay.com")],
+                      "ledger_buyer@qbay.com") is True
+    submit_order("ledger product 3", "ledger_seller@qbay.com",
+                 "ledger_buyer@qbay.com")
+    settle_orders()
+
+    entries = (LedgerEntry.query.filter_by(email="ledger_buyer@qbay.com")
+               .order_by(LedgerEntry.id_num).all())
+    assert [entry.amount for entry in entries] == \
+        [-1015, -1115, -1215, -1315]
+    assert [entry.balance for entry in entries] == \
+        [8985, 7870, 6655, 5340]
+
+    assert reconcile_ledger() == (8, 4, 2, [])
+    assert reconcile_ledger() == (0, 0, 0, [])
+
+
+def test_entries_append_only():
+    '''
+    The database refuses to change or remove ledger entries
+    '''
+    entry = LedgerEntry.query.first()
+    entry.amount = 0
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+    with pytest.raises(IntegrityError):
+        LedgerEntry.query.filter_by(id_num=entry.id_num).delete()
+    db.session.rollback()
+
+
+def test_reconcile_finds_changed_balance():
+    '''
+    A balance changed outside the ledger is reported, and no checkpoint is
+    written until it is put right
+    '''
+    assert order("ledger product 4", "ledger_seller@qbay.com",
+                 "ledger_buyer@qbay.com") is True
+    buyer = db.session.get(User, "ledger_buyer@qbay.com")
+    buyer.balance += 5.0
+    db.session.commit()
+
+    assert reconcile_ledger().problems == [
+        'ledger_buyer@qbay.com has 4425 cents but the ledger says 3925']
+    assert reconcile_ledger().entries == 2
+
+    buyer.balance -= 5.0
+    db.session.commit()
+    assert reconcile_ledger() == (2, 1, 2, [])
+
+
+def test_fractions_of_cents():
+    '''
+    Prices with fractions of a cent are paid in whole cents, so the
+    balances, transactions and entries still agree
+    '''
+    assert order("ledger cent product 0", "ledger_seller@qbay.com",
+                 "ledger_buyer@qbay.com") is True
+    assert order_many([("ledger cent product 1", "ledger_seller@qbay.com"),
+                       ("ledger cent product 2", "ledger_seller@qbay.com")],
+                      "ledger_buyer@qbay.com") is True
+
+    sales = (Transaction.query
+             .filter_by(buyer_email="ledger_buyer@qbay.com")
+             .order_by(Transaction.id_num.desc()).limit(3).all())
+    assert sorted(sale.price for sale in sales) == [10.01, 10.02, 10.33]
+    assert balance("ledger_buyer@qbay.com") == 39.25 - 30.36
+    assert reconcile_ledger() == (6, 3, 2, [])
+
+
+def test_new_ledger_leaves_no_transaction(tmp_path):
+    '''
+    Adding the ledger to a database with no sales leaves no transaction
+    open, which would hold a lock on the file
+    '''
+    output = subprocess.run(
+        [sys.executable, '-c', 'from qbay.models import *\n'
+         'print(db.session().in_transaction())'],
+        env=dict(os.environ, db_string='sqlite:///' +
+                 str(tmp_path.joinpath('new.sqlite'))),
+        cwd=str(current_folder.parent.parent),
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert output == 'False\n'
+
+
+def test_reconcile_from_baseline(tmp_path):
+    '''
+    Sales made before a database file had a ledger are left out of
+    reconciling, and --baseline starts reconciling over from the current
+    state of a ledger that does not add up
+    '''
+    env = dict(os.environ, cache_size='0', db_string='sqlite:///' +
+               str(tmp_path.joinpath('baseline.sqlite')))
+
+    def run(*args):
+        return subprocess.run([sys.executable] + list(args), env=env,
+                              cwd=str(current_folder.parent.parent),
+                              capture_output=True, text=True).returncode
+
+    assert run('-c', BEFORE_LEDGER) == 0
+    assert run('-c', AFTER_LEDGER) == 0
+
+    assert run('-c', UNRECORDED_SALE) == 0
+    assert run('-m', 'qbay.ledger') == 1
+    assert run('-m', 'qbay.ledger', '--baseline') == 0
+    assert run('-m', 'qbay.ledger') == 0
+
+
+@pytest.mark.benchmark
+def test_reconcile_benchmark(timings):
+    '''
+    Print the time of reconciling a long history of sales, and of
+    reconciling only the few made after its checkpoint. The second is
+    faster.
+    '''
+    times = timings(BENCHMARK, HISTORY_SALES, NEW_SALES)
+    print("\nreconcile %d sales: %.1fms, %d sales since checkpoint: %.1fms"
+          % (HISTORY_SALES, times['full'] * 1e3, NEW_SALES,
+             times['incremental'] * 1e3))
+    assert times['incremental'] < times['full']
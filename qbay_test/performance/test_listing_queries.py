@@ -0,0 +1,105 @@
+from qbay.models import *
+
+# Seller and buyer used by the listing tests
+register("ListingSeller",
+         "listing_seller@qbay.com",
+         "Password99@")
+
+register("ListingBuyer",
+         "listing_buyer@qbay.com",
+         "Password99@")
+
+
+def create_listing_products(first, count):
+    '''
+    Create count products for the listing seller, numbered from first
+    '''
+    for i in range(first, first + count):
+        assert create_product("listing product " + str(i),
+                              "24 character description",
+                              11.0, "listing_seller@qbay.com",
+                              datetime.date(2022, 9, 29)) is True
+
+
+def test_avail_products_constant_queries(statements):
+    '''
+    Listing available products costs the same number of statements no
+    matter how many products are in the catalog
+    '''
+    create_listing_products(0, 5)
+    statements.clear()
+    small_catalog = get_avail_products()
+    small_count = len(statements)
+
+    create_listing_products(5, 50)
+    statements.clear()
+    large_catalog = get_avail_products()
+    large_count = len(statements)
+
+    assert len(large_catalog) == len(small_catalog) + 50
+    assert small_count == large_count == 1
+
+
+def test_avail_products_excludes_sold():
+    '''
+    A sold product is left out of the listing once its status says so,
+    and the listing stays ordered by product id
+    '''
+    assert order("listing product 0", "listing_seller@qbay.com",
+                 "listing_buyer@qbay.com") is True
+
+    avail_prods = get_avail_products()
+    titles = [p.title for p in avail_prods
+              if p.seller_email == "listing_seller@qbay.com"]
+    assert "listing product 0" not in titles
+    assert "listing product 1" in titles
+
+    ids = [p.id_num for p in avail_prods]
+    assert ids == sorted(ids)
+
+
+def test_sold_products_single_query(statements):
+    '''
+    Listing a seller's sold products is a single join, however many
+    products the seller has listed
+    '''
+    statements.clear()
+    sold_prods = get_sold_products("listing_seller@qbay.com")
+    assert len(statements) == 1
+    assert [p.title for p in sold_prods] == ["listing product 0"]
+
+    assert order("listing product 1", "listing_seller@qbay.com",
+                 "listing_buyer@qbay.com") is True
+    statements.clear()
+    sold_prods = get_sold_products("listing_seller@qbay.com")
+    assert len(statements) == 1
+    assert [p.title for p in sold_prods] == ["listing product 0",
+                                             "listing product 1"]
+
+
+def test_sales_report(statements):
+    '''
+    The sales report carries each sale's price, date and buyer along with
+    the seller's totals, all from one query besides the cache's version
+    check
+    '''
+    clear_cache()
+    statements.clear()
+    report = get_sales_report("listing_seller@qbay.com")
+    assert len([statement for statement, parameters in statements
+                if 'data_version' not in statement]) == 1
+
+    assert report.count == 2
+    assert report.revenue == 22.0
+    assert [sale.title for sale in report.sales] == ["listing product 0",
+                                                     "listing product 1"]
+    for sale in report.sales:
+        assert sale.price == 11.0
+        assert sale.buyer_email == "listing_buyer@qbay.com"
+        assert sale.date is not None
+
+    # Sellers with no sales get an empty report
+    report = get_sales_report("listing_buyer@qbay.com")
+    assert report.sales == []
+    assert report.count == 0
+    assert report.revenue == 0
@@ -0,0 +1,107 @@
+from qbay import app
+from qbay.models import *
+import pytest
+
+# Seller whose products are created optimistically
+register("OptimisticSeller",
+         "optimistic_seller@qbay.com",
+         "Password99@")
+
+
+@pytest.fixture
+def optimistic():
+    '''
+    Turn optimistic inserts on for the duration of a test
+    '''
+    app.config['QBAY_OPTIMISTIC_INSERTS'] = True
+    yield
+    app.config['QBAY_OPTIMISTIC_INSERTS'] = False
+
+
+def writes_and_reads(statements):
+    '''
+    Split the recorded statements into (writes, reads)
+    '''
+    reads = [s for s, p in statements if s.lstrip().startswith('SELECT')]
+    return len(statements) - len(reads), len(reads)
+
+
+def test_optimistic_create_product(optimistic, statements):
+    '''
+    A successful create is one INSERT, and the constraints refuse what
+    check_seller and check_uniqueness would have
+    '''
+    statements.clear()
+    assert create_product("optimistic product",
+                          "24 character description",
+                          11.0, "optimistic_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+    assert writes_and_reads(statements) == (1, 0)
+
+    # title already used by the seller
+    assert create_product("optimistic product",
+                          "24 character description",
+                          11.0, "optimistic_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is False
+    # seller does not exist
+    assert create_product("optimistic product",
+                          "24 character description",
+                          11.0, "nobody@qbay.com",
+                          datetime.date(2022, 9, 29)) is False
+    # format checks still run before the insert
+    assert create_product("optimistic product!",
+                          "24 character description",
+                          11.0, "optimistic_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is False
+
+    assert Product.query.filter_by(title="optimistic product").count() == 1
+
+
+def test_optimistic_register(optimistic, statements):
+    '''
+    A successful registration is one INSERT, and the primary key refuses a
+    used email
+    '''
+    statements.clear()
+    assert register("Optimistic", "optimistic_user@qbay.com",
+                    "Password99@") is True
+    assert writes_and_reads(statements) == (1, 0)
+
+    assert register("Optimistic2", "optimistic_user@qbay.com",
+                    "Password99@") is False
+    assert login("optimistic_user@qbay.com",
+                 "Password99@").username == "Optimistic"
+
+
+def test_optimistic_in_batch(optimistic):
+    '''
+    A refused insert inside a batch only undoes itself
+    '''
+    with batch():
+        assert create_product("optimistic batch 0",
+                              "24 character description",
+                              11.0, "optimistic_seller@qbay.com",
+                              datetime.date(2022, 9, 29)) is True
+        assert create_product("optimistic batch 0",
+                              "24 character description",
+                              11.0, "optimistic_seller@qbay.com",
+                              datetime.date(2022, 9, 29)) is False
+        assert create_product("optimistic batch 1",
+                              "24 character description",
+                              11.0, "optimistic_seller@qbay.com",
+                              datetime.date(2022, 9, 29)) is True
+
+    for title in ("optimistic batch 0", "optimistic batch 1"):
+        assert not check_uniqueness(title, "optimistic_seller@qbay.com")
+
+
+def test_checked_inserts(statements):
+    '''
+    With optimistic inserts off, the existence checks run first as before
+    '''
+    statements.clear()
+    assert create_product("checked product",
+                          "24 character description",
+                          11.0, "optimistic_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+    assert writes_and_reads(statements) == (1, 2)
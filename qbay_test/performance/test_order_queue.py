@@ -0,0 +1,157 @@
+from qbay import app
+from qbay.models import *
+from qbay.settlement import run_settlement
+import qbay.cli
+import pytest
+import threading
+
+# Orders taken and settled by the benchmark
+QUEUE_ORDERS = 200
+
+# Seller and buyers of the queued orders
+register("QueueSeller",
+         "queue_seller@qbay.com",
+         "Password99@")
+
+register("QueueBuyer",
+         "queue_buyer@qbay.com",
+         "Password99@")
+
+register("QueueBuyerTwo",
+         "queue_buyer_two@qbay.com",
+         "Password99@")
+
+for i in range(0, 5):
+    create_product("queue product " + str(i),
+                   "24 character description",
+                   30.0, "queue_seller@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+# Seed a scratch database, then time placing orders one order() at a time,
+# taking orders with submit_order() and settling them with settle_orders()
+BENCHMARK = '''
+from qbay_test.performance.catalog import seed
+from qbay.models import *
+import sys
+import time
+
+size = int(sys.argv[1])
+seed(2 * size)
+register("Buyer", "benchmark_buyer@qbay.com", "Password99@")
+User.query.filter_by(email="benchmark_buyer@qbay.com").update(
+    {User.balance: 100000000.0})
+db.session.commit()
+products = [(product.title, product.seller_email)
+            for product in Product.query.order_by(Product.id_num)]
+
+start = time.perf_counter()
+for title, seller_email in products[:size]:
+    assert order(title, seller_email, "benchmark_buyer@qbay.com")
+print('order', (time.perf_counter() - start) / size)
+
+start = time.perf_counter()
+intake = [submit_order(title, seller_email, "benchmark_buyer@qbay.com")
+          for title, seller_email in products[size:]]
+print('intake', (time.perf_counter() - start) / size)
+
+start = time.perf_counter()
+while settle_orders():
+    pass
+print('settle', (time.perf_counter() - start) / size)
+assert {get_order_outcome(number) for number in intake} == {ORDER_PLACED}
+'''
+
+
+def test_orders_settled_in_batches(statements):
+    '''
+    Taking an order is one INSERT. Settling writes every order's outcome,
+    failures included, in one transaction.
+    '''
+    statements.clear()
+    first = submit_order("queue product 0", "queue_seller@qbay.com",
+                         "queue_buyer@qbay.com")
+    assert [s.split()[0] for s, p in statements] == ['INSERT']
+    second = submit_order("queue product 0", "queue_seller@qbay.com",
+                          "queue_buyer_two@qbay.com")
+    third = submit_order("queue product 9", "queue_seller@qbay.com",
+                         "queue_buyer@qbay.com")
+    fourth = submit_order("queue product 1", "queue_seller@qbay.com",
+                          "queue_buyer@qbay.com")
+    assert get_order_outcome(first) == ORDER_PENDING
+    assert get_order_outcome(first + 1000) is None
+
+    statements.clear()
+    assert settle_orders(3) == 3
+    assert sum(s == 'BEGIN IMMEDIATE' for s, p in statements) == 1
+    assert [get_order_outcome(number)
+            for number in (first, second, third, fourth)] == \
+        [ORDER_PLACED, ORDER_SOLD, ORDER_NO_PRODUCT, ORDER_PENDING]
+    assert db.session.get(User, "queue_buyer@qbay.com").balance == 70.0
+    assert db.session.get(User, "queue_buyer_two@qbay.com").balance == 100.0
+
+    assert run_settlement(interval=0, rounds=1) == 1
+    assert get_order_outcome(fourth) == ORDER_PLACED
+    assert settle_orders() == 0
+
+
+def test_idle_settlement_reads_only(statements):
+    '''
+    With no orders waiting and no credits to fold, the settlement job only
+    reads and never takes the write lock
+    '''
+    while settle_orders():
+        pass
+    app.config['QBAY_BALANCE_STRIPES'] = 4
+    try:
+        fold_balances()
+        statements.clear()
+        assert run_settlement(interval=0, rounds=3) == 0
+    finally:
+        app.config['QBAY_BALANCE_STRIPES'] = 0
+    assert statements
+    assert {s.split()[0] for s, p in statements} == {'SELECT'}
+
+
+def test_order_page_queued(monkeypatch, capsys):
+    '''
+    With the order queue, the order page takes the order and reports its
+    outcome once settled, or that it is still waiting
+    '''
+    user = login("queue_buyer_two@qbay.com", "Password99@")
+    product = Product.query.filter_by(title="queue product 2").first()
+    summary = ProductSummary(product.id_num, product.title, product.price,
+                             product.seller_email)
+    monkeypatch.setitem(app.config, 'QBAY_ORDER_QUEUE', True)
+    monkeypatch.setitem(app.config, 'QBAY_ORDER_WAIT', 0)
+    monkeypatch.setattr('builtins.input', lambda *args: "order")
+
+    qbay.cli.order_page(user, summary)
+    assert "will be placed shortly" in capsys.readouterr().out
+
+    # settle from another thread while the page waits
+    monkeypatch.setitem(app.config, 'QBAY_ORDER_WAIT', 10)
+    settlement = threading.Thread(target=run_settlement,
+                                  kwargs={'interval': 0.1, 'rounds': 5})
+    settlement.start()
+    qbay.cli.order_page(user, summary)
+    settlement.join()
+    assert "Order was unsuccessful: product has already been sold." in \
+        capsys.readouterr().out
+    assert Product.query.filter_by(
+        title="queue product 2").first().status == PRODUCT_SOLD
+
+
+@pytest.mark.benchmark
+def test_order_queue_benchmark(timings):
+    '''
+    Print the time per order of placing orders one order() at a time, of
+    taking them into the queue and of settling them from it. Taking and
+    settling an order are each faster than placing it.
+    '''
+    times = timings(BENCHMARK, QUEUE_ORDERS)
+    print("\n%d orders: order() %.2fms each, intake %.2fms each, "
+          "settlement %.0f orders/s"
+          % (QUEUE_ORDERS, times['order'] * 1e3, times['intake'] * 1e3,
+             1 / times['settle']))
+    assert times['intake'] < times['order']
+    assert times['settle'] < times['order']
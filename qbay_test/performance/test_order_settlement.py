@@ -0,0 +1,137 @@
+from qbay.models import *
+import threading
+import time
+
+# Number of buyers ordering at the same time
+THREADS = 4
+
+# Seller whose products are raced for, and one buyer per thread
+register("RaceSeller",
+         "race_seller@qbay.com",
+         "Password99@")
+
+for i in range(0, THREADS):
+    register("RaceBuyer" + str(i),
+             "race_buyer" + str(i) + "@qbay.com",
+             "Password99@")
+
+
+def run_buyers(target):
+    '''
+    Run target(i) for every buyer i in its own thread, all starting
+    together, and wait for them to finish
+    '''
+    barrier = threading.Barrier(THREADS)
+
+    def buyer(i):
+        barrier.wait()
+        try:
+            target(i)
+        finally:
+            # each thread has its own session
+            db.session.remove()
+
+    threads = [threading.Thread(target=buyer, args=(i,))
+               for i in range(0, THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def total_balance():
+    '''
+    Sum of the balances of the seller and buyers in these tests
+    '''
+    db.session.expire_all()
+    return sum(user.balance for user in User.query.filter(
+        User.email.like('race_%@qbay.com')))
+
+
+def test_order_failure_reasons():
+    '''
+    place_order reports why an order failed
+    '''
+    assert create_product("reason product",
+                          "24 character description",
+                          1000.0, "race_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+
+    assert place_order("no such product", "race_seller@qbay.com",
+                       "race_buyer0@qbay.com") == ORDER_NO_PRODUCT
+    assert place_order("reason product", "race_seller@qbay.com",
+                       "race_seller@qbay.com") == ORDER_OWN_PRODUCT
+    assert place_order("reason product", "race_seller@qbay.com",
+                       "race_buyer0@qbay.com") == ORDER_INSUFFICIENT_FUNDS
+    assert place_order("reason product", "race_seller@qbay.com",
+                       "nobody@qbay.com") == ORDER_NO_BUYER
+    assert place_order("reason product", "race_seller@qbay.com",
+                       "race_buyer0@qbay.com",
+                       datetime.date(2030, 9, 29)) == ORDER_INVALID_DATE
+
+
+def test_concurrent_orders_sell_once():
+    '''
+    Buyers racing for the same product: exactly one of them gets it
+    '''
+    assert create_product("race product",
+                          "24 character description",
+                          11.0, "race_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+    balance_before = total_balance()
+    results = [None] * THREADS
+
+    def buy(i):
+        results[i] = place_order("race product", "race_seller@qbay.com",
+                                 "race_buyer" + str(i) + "@qbay.com")
+
+    run_buyers(buy)
+
+    assert results.count(ORDER_PLACED) == 1
+    assert results.count(ORDER_SOLD) == THREADS - 1
+    product = Product.query.filter_by(title="race product").first()
+    assert Transaction.query.filter_by(
+        product_id_num=product.id_num).count() == 1
+    assert total_balance() == balance_before
+
+
+def test_concurrent_orders_stress():
+    '''
+    Every buyer tries to buy every product. Each product is sold exactly
+    once, no buyer is overdrawn and money is conserved. Prints the measured
+    settlement rate.
+    '''
+    count = 20
+    for i in range(0, count):
+        assert create_product("stress product " + str(i),
+                              "24 character description",
+                              11.0, "race_seller@qbay.com",
+                              datetime.date(2022, 9, 29)) is True
+    balance_before = total_balance()
+    results = [[] for i in range(0, THREADS)]
+
+    def buy(i):
+        # buyers walk the catalog from different starting points
+        for j in range(0, count):
+            title = "stress product " + str((i * 5 + j) % count)
+            results[i].append(place_order(title, "race_seller@qbay.com",
+                                          "race_buyer" + str(i) +
+                                          "@qbay.com"))
+
+    start = time.perf_counter()
+    run_buyers(buy)
+    elapsed = time.perf_counter() - start
+
+    attempts = sum(len(r) for r in results)
+    placed = sum(r.count(ORDER_PLACED) for r in results)
+    print("\n%d order attempts in %.3fs (%.0f orders/sec), %d placed"
+          % (attempts, elapsed, attempts / elapsed, placed))
+
+    # 20 products at $11 and four buyers with at least $89 left
+    assert placed == count
+    sold = (Transaction.query.join(Product)
+            .filter(Product.title.like('stress product %')).count())
+    assert sold == count
+    for user in User.query.filter(User.email.like('race_buyer%')):
+        assert user.balance >= 0
+    assert total_balance() == balance_before
@@ -0,0 +1,177 @@
+from qbay.models import *
+from pathlib import Path
+import os
+import qbay.cli
+import subprocess
+import sys
+
+# Set the current folder
+current_folder = Path(__file__).parent
+
+# Seller whose products are paged through
+register("PagingSeller",
+         "paging_seller@qbay.com",
+         "Password99@")
+
+for i in range(0, 7):
+    create_product("paging product " + str(i),
+                   "24 character description",
+                   11.0, "paging_seller@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+# Seed a scratch database and time reading its first and last pages
+TIME_PAGES = '''
+from qbay_test.performance.catalog import seed
+from qbay.models import *
+import sys
+import time
+
+count = int(sys.argv[1])
+seed(count)
+last_cursor = skip_avail_products(count - 20)
+for name, after in (('first', None), ('last', last_cursor)):
+    start = time.perf_counter()
+    for i in range(0, 100):
+        page = get_avail_products_page(20, after=after)
+        db.session.expunge_all()
+    print(name, (time.perf_counter() - start) / 100)
+'''
+
+# Browse a scratch catalog of 65 products through the CLI
+BROWSE = ('1\ncatalog_seller0@qbay.com\nPassword99@\n5\n'
+          'n\nn\nn\nn\np\npage 1\npage 4\npage 9\npage 2\n25\n\n'
+          '4\n3\n')
+
+
+def test_pages_cover_catalog():
+    '''
+    Following next cursors visits every available product once, and
+    previous cursors lead back the same way
+    '''
+    listed = [product.id_num for product in get_avail_products()]
+    pages = [get_avail_products_page(3)]
+    while pages[-1]:
+        pages.append(get_avail_products_page(3, after=pages[-1][-1].id_num))
+    pages.pop()
+    assert [product.id_num for page in pages for product in page] == listed
+
+    for i in range(len(pages) - 1, 0, -1):
+        previous = get_avail_products_page(3, before=pages[i][0].id_num)
+        assert previous == pages[i - 1]
+
+
+def test_skip_avail_products():
+    '''
+    Skipping finds the cursor count products on, or None past the end
+    '''
+    listed = [product.id_num for product in get_avail_products()]
+    assert skip_avail_products(1) == listed[0]
+    assert skip_avail_products(4) == listed[3]
+    assert skip_avail_products(2, after=listed[3]) == listed[5]
+    assert skip_avail_products(len(listed) + 1) is None
+
+
+def test_page_plans(statements):
+    '''
+    Every page is one query, besides the cache's version check, that reads
+    the partial index in order with no sorting or skipping, whichever
+    direction it is read in
+    '''
+    middle = get_avail_products()[3].id_num
+    clear_cache()
+    statements.clear()
+    get_avail_products_page(3, after=middle)
+    get_avail_products_page(3, before=middle)
+    executed = [(statement, parameters)
+                for statement, parameters in statements
+                if 'data_version' not in statement]
+    assert len(executed) == 2
+
+    for statement, parameters in executed:
+        # no rows are skipped to reach the page
+        assert parameters[-1] == 0
+        plan = [row[-1] for row in db.session.connection().exec_driver_sql(
+            'EXPLAIN QUERY PLAN ' + statement, tuple(parameters))]
+        assert any('ix_product_available' in step for step in plan)
+        assert not any('TEMP B-TREE' in step for step in plan)
+
+
+def qbay_run(arguments, db_file, stdin=None):
+    '''
+    Run qbay against a scratch database, with the listing cache off so
+    every page is read from it, and return what it printed
+    '''
+    return subprocess.run(
+        [sys.executable] + arguments,
+        env=dict(os.environ, db_string='sqlite:///' + str(db_file),
+                 cache_size='0'),
+        cwd=str(current_folder.parent.parent),
+        input=stdin,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+
+def test_next_page_sold_out(monkeypatch, capsys):
+    '''
+    When the products of the next page are sold before it is shown, the
+    products page stays on the page it has
+    '''
+    products = (Product.query
+                .filter_by(seller_email="paging_seller@qbay.com")
+                .order_by(Product.id_num).all())
+    pages = iter([products[:3], []])
+    monkeypatch.setattr(qbay.cli, 'PAGE_SIZE', 2)
+    monkeypatch.setattr(qbay.cli, 'get_avail_products_page',
+                        lambda size, after=None, before=None: next(pages))
+    answers = iter(['n', 'p', ''])
+    monkeypatch.setattr('builtins.input', lambda *args: next(answers))
+
+    qbay.cli.available_products_page(
+        login("paging_seller@qbay.com", "Password99@"))
+    output = capsys.readouterr().out
+    assert output.count("Products available for purchase") == 3
+    assert "(page 2)" not in output
+    assert "There is no next page." in output
+    assert "There is no previous page." in output
+
+
+def test_browse_pages(tmp_path):
+    '''
+    The products page moves between pages of 20 products and orders from
+    any of them by its number
+    '''
+    db_file = tmp_path.joinpath('browse.sqlite')
+    qbay_run(['-m', 'qbay_test.performance.catalog', '65'], db_file)
+    output = qbay_run(['-m', 'qbay'], db_file, BROWSE)
+
+    headings = [line for line in output.splitlines()
+                if line.startswith('Products available') or
+                line.startswith('There is no')]
+    assert headings == [
+        'Products available for purchase (page 1).',
+        'Products available for purchase (page 2).',
+        'Products available for purchase (page 3).',
+        'Products available for purchase (page 4).',
+        'There is no next page.',
+        'Products available for purchase (page 4).',
+        'Products available for purchase (page 3).',
+        'Products available for purchase (page 1).',
+        'Products available for purchase (page 4).',
+        'There is no page 9.',
+        'Products available for purchase (page 4).',
+        'Products available for purchase (page 2).',
+    ]
+    assert '65. catalog product 64 ($74.0)' in output
+    assert 'Title: catalog product 24' in output
+
+
+def test_page_cost_benchmark(timings):
+    '''
+    Print the time to read the first and the last page of a large catalog.
+    Both are the same index range read.
+    '''
+    times = timings(TIME_PAGES, 20000)
+    print("\npage of 20 from 20000 products: first %.0fus, last %.0fus"
+          % (times['first'] * 1e6, times['last'] * 1e6))
+    assert set(times) == {'first', 'last'}
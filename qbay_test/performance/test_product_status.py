@@ -0,0 +1,118 @@
+from pathlib import Path
+from qbay.models import *
+import os
+import sqlite3
+import subprocess
+import sys
+
+# Set the current folder
+current_folder = Path(__file__).parent
+
+# Seller and buyer used by the status tests
+register("StatusSeller",
+         "status_seller@qbay.com",
+         "Password99@")
+
+register("StatusBuyer",
+         "status_buyer@qbay.com",
+         "Password99@")
+
+
+def test_order_marks_product_sold():
+    '''
+    A new product is available, and order() flips it to sold in the same
+    commit as the transaction
+    '''
+    assert create_product("status product",
+                          "24 character description",
+                          11.0, "status_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+    product = Product.query.filter_by(title="status product").first()
+    assert product.status == PRODUCT_AVAILABLE
+    assert product in get_avail_products()
+
+    assert order("status product", "status_seller@qbay.com",
+                 "status_buyer@qbay.com") is True
+    assert product.status == PRODUCT_SOLD
+    assert product not in get_avail_products()
+
+
+def test_order_refuses_sold_product():
+    '''
+    A product that has been sold cannot be ordered a second time
+    '''
+    buyer = login("status_buyer@qbay.com", "Password99@")
+    old_balance = buyer.balance
+    assert order("status product", "status_seller@qbay.com",
+                 "status_buyer@qbay.com") is False
+    assert buyer.balance == old_balance
+
+
+def test_avail_products_uses_partial_index(statements):
+    '''
+    The catalog listing reads the partial index over available products
+    '''
+    get_avail_products()
+    statement, parameters = statements[0]
+    plan = db.session.connection().exec_driver_sql(
+        'EXPLAIN QUERY PLAN ' + statement, tuple(parameters))
+    assert 'ix_product_available' in ' '.join(row[-1] for row in plan)
+
+
+def test_backfill_existing_database(tmp_path):
+    '''
+    Opening a database file made before products had a status adds the
+    column and marks already sold products
+    '''
+    db_file = tmp_path.joinpath('legacy.sqlite')
+    connection = sqlite3.connect(str(db_file))
+    connection.executescript('''
+        CREATE TABLE user (email VARCHAR(120) PRIMARY KEY,
+                           username VARCHAR(80) NOT NULL,
+                           password VARCHAR(120) NOT NULL,
+                           shipping_address VARCHAR(200),
+                           postal_code VARCHAR(6), balance FLOAT);
+        CREATE TABLE product (id_num INTEGER PRIMARY KEY,
+                              title VARCHAR(80) NOT NULL,
+                              description TEXT NOT NULL,
+                              price FLOAT NOT NULL,
+                              last_modified_date DATETIME NOT NULL,
+                              seller_email VARCHAR(80) NOT NULL);
+        CREATE TABLE "transaction" (id_num INTEGER PRIMARY KEY,
+                                    buyer_email VARCHAR(80) NOT NULL,
+                                    product_id_num INTEGER NOT NULL,
+                                    date DATETIME, price FLOAT NOT NULL);
+        INSERT INTO user VALUES ('a@qbay.com', 'a', 'Password99@', '', '',
+                                 100.0);
+        INSERT INTO user VALUES ('b@qbay.com', 'b', 'Password99@', '', '',
+                                 100.0);
+        INSERT INTO product VALUES (1, 'old sold', '24 character description',
+                                    11.0, '2022-09-29 00:00:00.000000',
+                                    'a@qbay.com');
+        INSERT INTO product VALUES (2, 'old open', '24 character description',
+                                    11.0, '2022-09-29 00:00:00.000000',
+                                    'a@qbay.com');
+        INSERT INTO "transaction" VALUES (1, 'b@qbay.com', 1,
+                                          '2022-09-30 00:00:00.000000', 11.0);
+    ''')
+    connection.close()
+
+    # Open the legacy file with qbay in its own process
+    output = subprocess.run(
+        [sys.executable, '-c',
+         'from qbay.models import *\n'
+         'print([(p.title, p.status) for p in '
+         'Product.query.order_by(Product.id_num)])'],
+        env=dict(os.environ, db_string='sqlite:///' + str(db_file)),
+        cwd=str(current_folder.parent.parent),
+        capture_output=True,
+        text=True,
+    ).stdout
+    assert output.strip() == ("[('old sold', 'sold'), "
+                              "('old open', 'available')]")
+
+    connection = sqlite3.connect(str(db_file))
+    indexes = [row[1] for row in
+               connection.execute("PRAGMA index_list('product')")]
+    connection.close()
+    assert 'ix_product_available' in indexes
@@ -0,0 +1,227 @@
+import inspect
+import os
+import qbay.models
+import subprocess
+import sys
+from pathlib import Path
+from qbay.models import *
+
+# Set the current folder
+current_folder = Path(__file__).parent
+
+# Users and products the query plans are taken against
+register("PlanSeller",
+         "plan_seller@qbay.com",
+         "Password99@")
+
+register("PlanBuyer",
+         "plan_buyer@qbay.com",
+         "Password99@")
+
+for i in range(0, 3):
+    create_product("plan product " + str(i),
+                   "24 character description",
+                   11.0, "plan_seller@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+# Fill a scratch database, then take away the unique indexes and add rows
+# that break them, as in a file made before they were declared
+BEFORE_UNIQUE = '''
+from qbay.models import *
+
+register("Seller", "old_seller@qbay.com", "Password99@")
+register("Buyer", "old_buyer@qbay.com", "Password99@")
+for title in ["old lamp", "old lamp 2", "old rug"]:
+    create_product(title, "24 character description", 11.0,
+                   "old_seller@qbay.com", datetime.date(2022, 9, 29))
+assert order("old rug", "old_seller@qbay.com", "old_buyer@qbay.com")
+for name in ('ix_product_seller_title', 'ix_transaction_product_id_num'):
+    db.session.execute(db.text('DROP INDEX ' + name))
+db.session.execute(db.text(
+    "UPDATE product SET title = 'old lamp' WHERE title = 'old rug'"))
+db.session.execute(db.text(
+    'INSERT INTO "transaction" (buyer_email, product_id_num, price) '
+    'SELECT buyer_email, product_id_num, price FROM "transaction"'))
+db.session.commit()
+'''
+
+# Open the scratch database again and print whether the upgrade left a
+# transaction open, its titles and its indexes
+AFTER_UNIQUE = '''
+from qbay.models import *
+
+print(db.session().in_transaction())
+print(sorted(product.title for product in Product.query))
+print(sorted(index['name'] for table in ('product', 'transaction')
+             for index in db.inspect(db.engine).get_indexes(table)))
+'''
+
+# Sample calls for every public function in qbay.models that reads or
+# writes the database
+WORKLOADS = {
+    'register': ("plan user", "plan_user@qbay.com", "Password99@"),
+    'login': ("plan_seller@qbay.com", "Password99@"),
+    'update_user': ("plan_seller@qbay.com", "Password99@",
+                    {'username': 'PlanSeller2'}),
+    'create_product': ("plan product 3", "24 character description", 11.0,
+                       "plan_seller@qbay.com", datetime.date(2022, 9, 29)),
+    'update_product': ("plan product 1", 11.0, "plan_seller@qbay.com",
+                       {'title': 'plan product 4'}),
+    'order': ("plan product 0", "plan_seller@qbay.com",
+              "plan_buyer@qbay.com"),
+    'place_order': ("plan product 3", "plan_seller@qbay.com",
+                    "plan_buyer@qbay.com"),
+    'order_many': ([("plan product 4", "plan_seller@qbay.com")],
+                   "plan_buyer@qbay.com"),
+    'place_cart_order': ([("plan product 2", "plan_seller@qbay.com"),
+                          ("plan product 4", "plan_seller@qbay.com")],
+                         "plan_buyer@qbay.com"),
+    'fold_balances': ("plan_seller@qbay.com",),
+    'get_balance': ("plan_seller@qbay.com",),
+    'submit_order': ("plan product 2", "plan_seller@qbay.com",
+                     "plan_buyer@qbay.com"),
+    'get_order_outcome': (1,),
+    'settle_orders': (),
+    'get_avail_products': (),
+    'get_avail_summaries': (),
+    'get_avail_products_page': (2, 1),
+    'get_product_description': (1,),
+    'get_catalog_version': (),
+    'search_products': ("plan product", 5),
+    'skip_avail_products': (2, 1),
+    'get_sold_products': ("plan_seller@qbay.com",),
+    'iter_avail_products': (1,),
+    'iter_sold_products': ("plan_seller@qbay.com", 1),
+    'get_sales_report': ("plan_seller@qbay.com",),
+    'check_seller': ("plan_seller@qbay.com",),
+    'check_uniqueness': ("plan product 2", "plan_seller@qbay.com"),
+    'backfill_product_status': (),
+}
+
+# Validators that never touch the database, batch() which only commits or
+# rolls back what other functions did, the cache's own functions and
+# conversions
+NO_QUERIES = {'check_email', 'check_pass', 'check_username', 'check_address',
+              'check_postal_code', 'check_title', 'check_description',
+              'check_price', 'check_date', 'batch', 'get_cache_stats',
+              'clear_cache', 'to_cents'}
+
+
+def public_functions():
+    '''
+    Names of the public functions defined in qbay.models
+    '''
+    return {name for name, func in inspect.getmembers(qbay.models,
+                                                      inspect.isfunction)
+            if func.__module__ == 'qbay.models' and not name.startswith('_')}
+
+
+def full_scans(statement, parameters):
+    '''
+    Run EXPLAIN QUERY PLAN on a statement and return the plan steps that
+    read a whole table without an index
+    '''
+    plan = db.session.connection().exec_driver_sql(
+        'EXPLAIN QUERY PLAN ' + statement, tuple(parameters))
+    # SELECT EXISTS(...) reads a single constant row, not a table, and a
+    # full-text search is answered by the virtual table's own index
+    return [row[-1] for row in plan
+            if row[-1].startswith('SCAN ') and 'USING' not in row[-1] and
+            row[-1] != 'SCAN CONSTANT ROW' and
+            'VIRTUAL TABLE' not in row[-1]]
+
+
+def test_every_public_function_covered():
+    '''
+    Every public function is either given a workload below or known not
+    to query the database
+    '''
+    assert public_functions() == set(WORKLOADS) | NO_QUERIES
+
+
+def test_no_full_table_scans(statements):
+    '''
+    No public function in qbay.models falls back to a full table scan
+    '''
+    scans = {}
+    for name, args in WORKLOADS.items():
+        # cached listings would not query at all
+        clear_cache()
+        statements.clear()
+        result = getattr(qbay.models, name)(*args)
+        # generators only query as they are consumed
+        if inspect.isgenerator(result):
+            list(result)
+        # Plans are checked after the call so that EXPLAIN itself is not
+        # recorded
+        executed = list(statements)
+        for statement, parameters in executed:
+            # executemany inserts have no plan worth checking
+            if isinstance(parameters, list):
+                continue
+            steps = full_scans(statement, parameters)
+            if steps:
+                scans.setdefault(name, []).extend(steps)
+    db.session.rollback()
+    assert not scans
+
+
+def test_declared_indexes():
+    '''
+    The hot lookup keys are backed by indexes in the database file
+    '''
+    connection = db.session.connection()
+
+    def index_columns(table):
+        columns = {}
+        for row in connection.exec_driver_sql(
+                "PRAGMA index_list('" + table + "')"):
+            name, unique = row[1], row[2]
+            info = connection.exec_driver_sql(
+                "PRAGMA index_info('" + name + "')")
+            columns[tuple(col[2] for col in info)] = bool(unique)
+        return columns
+
+    assert index_columns('product')[('seller_email', 'title')] is True
+    assert index_columns('transaction')[('product_id_num',)] is True
+    assert ('buyer_email', 'date') in index_columns('transaction')
+    assert ('seller_email',) in index_columns('review')
+
+
+def test_update_product_keeps_titles_unique():
+    '''
+    Renaming a product to a title the seller already uses fails instead
+    of violating the unique index
+    '''
+    assert update_product("plan product 2", 11.0, "plan_seller@qbay.com",
+                          {'title': 'plan product 3'}) is False
+    assert update_product("plan product 2", 11.0, "plan_seller@qbay.com",
+                          {'title': 'plan product 2'}) is True
+
+
+def test_unique_indexes_added_to_old_file(tmp_path):
+    '''
+    Opening a database file made before the unique indexes renames the
+    repeated titles, and reports the repeated sales and leaves their index
+    out, instead of failing
+    '''
+    def run(script):
+        return subprocess.run(
+            [sys.executable, '-c', script],
+            env=dict(os.environ, db_string='sqlite:///' +
+                     str(tmp_path.joinpath('old.sqlite'))),
+            cwd=str(current_folder.parent.parent),
+            capture_output=True,
+            text=True,
+        )
+
+    assert run(BEFORE_UNIQUE).returncode == 0
+    upgraded = run(AFTER_UNIQUE)
+    assert upgraded.returncode == 0
+    in_transaction, titles, indexes = upgraded.stdout.splitlines()
+    assert titles == "['old lamp', 'old lamp 2', 'old lamp 3']"
+    assert 'ix_product_seller_title' in indexes
+    assert 'ix_transaction_product_id_num' not in indexes
+    assert in_transaction == 'False'
+    assert 'Not creating unique index ix_transaction_product_id_num' in \
+        upgraded.stderr
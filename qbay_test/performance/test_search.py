@@ -0,0 +1,143 @@
+from qbay.models import *
+from qbay.models import _search_like, _search_words
+import os
+import pytest
+import qbay.cli
+
+# Products in the catalog the benchmark searches. Set search_catalog_size
+# to run it at another size, such as 1000000.
+SEARCH_CATALOG_SIZE = int(os.getenv('search_catalog_size') or 100000)
+
+# Seller and buyer of the products searched for
+register("SearchSeller",
+         "search_seller@qbay.com",
+         "Password99@")
+
+register("SearchBuyer",
+         "search_buyer@qbay.com",
+         "Password99@")
+
+create_product("zebra lamp",
+               "a lamp shaped like a zebra, lights up the room",
+               20.0, "search_seller@qbay.com",
+               datetime.date(2022, 9, 29))
+
+create_product("striped rug",
+               "goes well with the zebra lamp in any room",
+               30.0, "search_seller@qbay.com",
+               datetime.date(2022, 9, 29))
+
+create_product("plain rug",
+               "a plain rug with no pattern at all",
+               30.0, "search_seller@qbay.com",
+               datetime.date(2022, 9, 29))
+
+# Seed a scratch database and time the same searches with the full-text
+# index and with LIKE scans
+BENCHMARK = '''
+from qbay_test.performance.catalog import seed
+from qbay.models import *
+from qbay.models import _search_like, _search_words
+import sys
+import time
+
+seed(int(sys.argv[1]))
+searches = ['catalog product 4242', 'product 99', 'description 7']
+for name, search in (
+        ('fts', lambda text: search_products(text, 20)),
+        ('like', lambda text: _search_like(_search_words(text), 20))):
+    start = time.perf_counter()
+    for text in searches:
+        search(text)
+    print(name, (time.perf_counter() - start) / len(searches))
+'''
+
+
+def titles(summaries):
+    '''
+    Titles of search results
+    '''
+    return [summary.title for summary in summaries]
+
+
+def test_search_ranks_titles_first():
+    '''
+    Products with the words in their title rank above those with them only
+    in the description
+    '''
+    assert titles(search_products("zebra", 10)) == ["zebra lamp",
+                                                    "striped rug"]
+    assert titles(search_products("zebra lamp", 10)) == ["zebra lamp",
+                                                         "striped rug"]
+    assert titles(search_products("rug pattern", 10)) == ["plain rug"]
+    assert search_products("zebra giraffe", 10) == []
+
+
+def test_search_prefix_and_syntax():
+    '''
+    The last word matches the start of words, and characters FTS5 would
+    read as syntax are searched for as plain words
+    '''
+    assert titles(search_products("zeb", 10)) == ["zebra lamp",
+                                                  "striped rug"]
+    assert titles(search_products('"striped" (rug:', 10)) == \
+        ["striped rug"]
+    assert search_products("   !?  ", 10) == []
+
+
+def test_search_pages():
+    '''
+    Results come a page at a time
+    '''
+    first = search_products("rug", 1)
+    second = search_products("rug", 1, page=1)
+    assert len(first) == len(second) == 1
+    assert set(titles(first + second)) == {"striped rug", "plain rug"}
+    assert search_products("rug", 1, page=2) == []
+
+
+def test_search_index_kept_in_step():
+    '''
+    Renamed products are found by their new title only, and sold products
+    are not found at all
+    '''
+    assert update_product("striped rug", 30.0, "search_seller@qbay.com",
+                          {'title': "woven mat"}) is True
+    assert titles(search_products("woven", 10)) == ["woven mat"]
+    assert search_products("striped", 10) == []
+
+    assert order("zebra lamp", "search_seller@qbay.com",
+                 "search_buyer@qbay.com") is True
+    assert titles(search_products("zebra", 10)) == ["woven mat"]
+
+
+def test_search_like_fallback():
+    '''
+    The LIKE fallback finds the same products, in id_num order
+    '''
+    assert set(titles(_search_like(_search_words("room"), 10))) == \
+        set(titles(search_products("room", 10))) == {"woven mat"}
+
+
+def test_search_page_cli(monkeypatch, capsys):
+    '''
+    The search page lists the results and opens one by its number
+    '''
+    answers = iter(["pattern", "1", ""])
+    monkeypatch.setattr('builtins.input', lambda *args: next(answers))
+    qbay.cli.search_page(login("search_buyer@qbay.com", "Password99@"))
+    output = capsys.readouterr().out
+    assert "1. plain rug ($30.0)" in output
+    assert "Description: a plain rug with no pattern at all" in output
+
+
+@pytest.mark.benchmark
+def test_search_benchmark(timings):
+    '''
+    Print the time of a search with the full-text index and with LIKE
+    scans over a large catalog. The index is faster.
+    '''
+    times = timings(BENCHMARK, SEARCH_CATALOG_SIZE)
+    print("\nsearch over %d products: FTS5 %.1fms, LIKE %.1fms"
+          % (SEARCH_CATALOG_SIZE, times['fts'] * 1e3, times['like'] * 1e3))
+    assert times['fts'] < times['like']
@@ -0,0 +1,189 @@
+from qbay.models import *
+from pathlib import Path
+import pytest
+import subprocess
+import sys
+
+np = pytest.importorskip('numpy')
+from qbay.snapshot import CatalogSnapshot, SORT_DATE, SORT_PRICE  # noqa: E402
+
+# Set the current folder
+current_folder = Path(__file__).parent
+
+# Products in the catalog the benchmark is run on
+CATALOG_SIZE = 100000
+
+# Seller and buyer of the products in the snapshot
+register("SnapshotSeller",
+         "snapshot_seller@qbay.com",
+         "Password99@")
+
+register("SnapshotBuyer",
+         "snapshot_buyer@qbay.com",
+         "Password99@")
+
+for i in range(0, 6):
+    create_product("snapshot product " + str(i),
+                   "24 character description",
+                   10.0 + 5 * (i % 3), "snapshot_seller@qbay.com",
+                   datetime.date(2022, 9, 20 + i))
+
+# Seed a scratch database, then time the same queries in Python over
+# Products and on a snapshot
+BENCHMARK = '''
+from qbay_test.performance.catalog import seed
+from qbay.models import *
+from qbay.snapshot import CatalogSnapshot
+import sys
+import time
+
+seed(int(sys.argv[1]))
+
+
+def timed(name, run):
+    start = time.perf_counter()
+    result = run()
+    print(name, time.perf_counter() - start)
+    return result
+
+
+def python_queries():
+    products = get_avail_products()
+    cheapest = sorted(products, key=lambda p: (p.price, p.id_num))[:20]
+    in_range = sorted((p for p in products if 100 <= p.price <= 200),
+                      key=lambda p: (p.price, p.id_num))
+    return [p.id_num for p in cheapest], [p.id_num for p in in_range]
+
+
+def snapshot_queries(snapshot):
+    cheapest = snapshot.cheapest(20)
+    in_range = snapshot.select(min_price=100, max_price=200,
+                               order_by='price')
+    return [p.id_num for p in cheapest], [p.id_num for p in in_range]
+
+
+expected = timed('python', python_queries)
+db.session.expunge_all()
+snapshot = timed('build', CatalogSnapshot)
+assert timed('snapshot', lambda: snapshot_queries(snapshot)) == expected
+'''
+
+
+@pytest.fixture
+def snapshot():
+    '''
+    A snapshot of the catalog, no longer kept up to date after the test
+    '''
+    snapshot = CatalogSnapshot()
+    yield snapshot
+    snapshot.close()
+
+
+def reference(key=None, reverse=False):
+    '''
+    The available products as ProductSummaries, sorted in Python
+    '''
+    products = get_avail_products()
+    if key is not None:
+        products = sorted(products, key=lambda p: p.id_num)
+        products.sort(key=key, reverse=reverse)
+    return [ProductSummary(p.id_num, p.title, p.price, p.seller_email)
+            for p in products]
+
+
+def product_queries(statements):
+    '''
+    The recorded statements that read the product table
+    '''
+    return [statement for statement, parameters in statements
+            if 'FROM product' in statement]
+
+
+def test_snapshot_matches_catalog(snapshot):
+    '''
+    Filtering and sorting the snapshot gives what Python gives over the
+    Products
+    '''
+    assert snapshot.select() == reference()
+    assert len(snapshot) == len(reference())
+    assert snapshot.select(order_by=SORT_PRICE) == \
+        reference(key=lambda p: p.price)
+    assert snapshot.select(order_by=SORT_PRICE, descending=True) == \
+        reference(key=lambda p: -p.price)
+    assert snapshot.cheapest(4) == reference(key=lambda p: p.price)[:4]
+    assert snapshot.newest(3) == \
+        reference(key=lambda p: -p.last_modified_date.toordinal())[:3]
+
+    in_range = snapshot.select(min_price=12.0, max_price=15.0,
+                               since=datetime.date(2022, 9, 22))
+    assert {p.title for p in in_range if p.seller_email ==
+            "snapshot_seller@qbay.com"} == {"snapshot product 4"}
+
+
+def test_snapshot_patched(snapshot, statements):
+    '''
+    Creating, updating and ordering products patches the snapshot without
+    reading the catalog again
+    '''
+    statements.clear()
+    assert create_product("snapshot product 6",
+                          "24 character description",
+                          99.0, "snapshot_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+    assert update_product("snapshot product 0", 10.0,
+                          "snapshot_seller@qbay.com",
+                          {'price': 98.0}) is True
+    assert order("snapshot product 1", "snapshot_seller@qbay.com",
+                 "snapshot_buyer@qbay.com") is True
+    written = len(product_queries(statements))
+
+    patched = snapshot.select(order_by=SORT_PRICE, descending=True)
+    assert len(product_queries(statements)) == written
+    assert patched == reference(key=lambda p: -p.price)
+    mine = [p.title for p in patched
+            if p.seller_email == "snapshot_seller@qbay.com"]
+    assert mine[:2] == ["snapshot product 6", "snapshot product 0"]
+    assert "snapshot product 1" not in mine
+
+
+def test_snapshot_rebuilt_after_other_process(snapshot):
+    '''
+    A product created by another process is picked up by rebuilding
+    '''
+    subprocess.run(
+        [sys.executable, '-c', 'from qbay.models import *\n'
+         'create_product("snapshot product 7", "24 character description",'
+         ' 10.0, "snapshot_seller@qbay.com", datetime.date(2022, 9, 29))'],
+        cwd=str(current_folder.parent.parent),
+        check=True,
+    )
+    assert "snapshot product 7" in {p.title for p in snapshot.select()}
+    assert snapshot.select() == reference()
+
+
+def test_snapshot_compacts():
+    '''
+    Once half the rows are of sold products the arrays are compacted
+    '''
+    snapshot = CatalogSnapshot()
+    snapshot.close()
+    summaries = snapshot.select()
+    sold = len(summaries) // 2 + 1
+    for summary in summaries[:sold]:
+        snapshot.changed(None, None, summary.id_num, None)
+    assert snapshot.size == len(snapshot) == len(summaries) - sold
+    assert snapshot.select() == summaries[sold:]
+
+
+@pytest.mark.benchmark
+def test_snapshot_benchmark(timings):
+    '''
+    Print the time of finding the cheapest products and a sorted price
+    range in Python over Products and with the snapshot
+    '''
+    times = timings(BENCHMARK, CATALOG_SIZE)
+    print("\n%d products: Python %.3fs, snapshot build %.3fs, "
+          "snapshot queries %.4fs"
+          % (CATALOG_SIZE, times['python'], times['build'],
+             times['snapshot']))
+    assert times['snapshot'] < times['python']
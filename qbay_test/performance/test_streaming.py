@@ -0,0 +1,110 @@
+from qbay.models import *
+from pathlib import Path
+import os
+import subprocess
+import sys
+
+# Set the current folder
+current_folder = Path(__file__).parent
+
+# Seller and buyer whose sales are streamed
+register("StreamSeller",
+         "stream_seller@qbay.com",
+         "Password99@")
+
+register("StreamBuyer",
+         "stream_buyer@qbay.com",
+         "Password99@")
+
+for i in range(0, 5):
+    create_product("stream product " + str(i),
+                   "24 character description",
+                   11.0, "stream_seller@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+# Measure the peak memory of a listing after seeding a scratch database
+MEASURE_LISTING = '''
+from qbay_test.performance.catalog import seed
+from qbay.models import *
+import sys
+import tracemalloc
+
+seed(int(sys.argv[1]))
+db.session.expunge_all()
+tracemalloc.start()
+if sys.argv[2] == 'iter':
+    count = sum(1 for product in iter_avail_products(chunk_size=500))
+else:
+    count = len(get_avail_products())
+print(count, tracemalloc.get_traced_memory()[1])
+'''
+
+
+def test_iter_avail_products():
+    '''
+    Streaming the catalog gives the same products as the list, whatever
+    the chunk size
+    '''
+    listed = [product.id_num for product in get_avail_products()]
+    for chunk_size in (1, 2, 1000):
+        streamed = [product.id_num
+                    for product in iter_avail_products(chunk_size)]
+        assert streamed == listed
+
+
+def test_iter_sold_products(statements):
+    '''
+    Streaming a seller's sales gives the same products as the list, one
+    query per chunk
+    '''
+    for i in range(0, 3):
+        assert order("stream product " + str(i), "stream_seller@qbay.com",
+                     "stream_buyer@qbay.com") is True
+
+    listed = [product.id_num
+              for product in get_sold_products("stream_seller@qbay.com")]
+    statements.clear()
+    streamed = [product.id_num for product in
+                iter_sold_products("stream_seller@qbay.com", chunk_size=2)]
+    assert streamed == listed
+    assert len(listed) == 3
+    assert len(statements) == 2
+
+
+def measure_listing(db_file, count, how):
+    '''
+    Seed a scratch database with count products and list them in a
+    process of its own
+
+    Returns:
+        peak bytes allocated while listing
+    '''
+    output = subprocess.run(
+        [sys.executable, '-c', MEASURE_LISTING, str(count), how],
+        env=dict(os.environ, db_string='sqlite:///' + str(db_file)),
+        cwd=str(current_folder.parent.parent),
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    assert int(output[0]) == count
+    return int(output[1])
+
+
+def test_iter_memory_flat(tmp_path):
+    '''
+    The peak memory of streaming the catalog stays flat as the catalog
+    grows, while the list grows with it. Prints the peaks.
+    '''
+    sizes = (2000, 8000)
+    peaks = {}
+    print()
+    for how in ('list', 'iter'):
+        for count in sizes:
+            peaks[how, count] = measure_listing(
+                tmp_path.joinpath(how + str(count) + '.sqlite'), count, how)
+            print("%s of %d products: %dKB peak"
+                  % (how, count, peaks[how, count] // 1024))
+
+    small, large = sizes
+    assert peaks['iter', large] < 1.25 * peaks['iter', small]
+    assert peaks['list', large] > 3 * peaks['list', small]
@@ -0,0 +1,127 @@
+from qbay.models import *
+from pathlib import Path
+import os
+import pytest
+import subprocess
+import sys
+
+# Set the current folder
+current_folder = Path(__file__).parent
+
+# Products in the catalog the listings' memory is compared on, and in the
+# one the benchmark times them on
+MEMORY_CATALOG_SIZE = 10000
+CATALOG_SIZE = 100000
+
+# Seller whose products are summarized
+register("SummarySeller",
+         "summary_seller@qbay.com",
+         "Password99@")
+
+create_product("summary product",
+               "summary product description",
+               11.0, "summary_seller@qbay.com",
+               datetime.date(2022, 9, 29))
+
+# Seed a scratch database, then time and trace one listing of it
+MEASURE_LISTING = '''
+from qbay_test.performance.catalog import seed
+from qbay.models import *
+import sys
+import time
+import tracemalloc
+
+seed(int(sys.argv[1]))
+listing = get_avail_products if sys.argv[2] == 'products' \\
+    else get_avail_summaries
+db.session.expunge_all()
+start = time.perf_counter()
+rows = listing()
+elapsed = time.perf_counter() - start
+
+del rows
+db.session.expunge_all()
+tracemalloc.start()
+rows = listing()
+print(len(rows), elapsed, tracemalloc.get_traced_memory()[0])
+'''
+
+
+def test_summaries_match_products():
+    '''
+    The summaries list the same products, in the same order, as
+    get_avail_products
+    '''
+    products = get_avail_products()
+    summaries = get_avail_summaries()
+    assert summaries == [(product.id_num, product.title, product.price,
+                          product.seller_email) for product in products]
+
+
+def test_summaries_not_tracked(statements):
+    '''
+    Summaries leave no objects in the session and never select the
+    description, which is fetched on its own when needed
+    '''
+    db.session.expunge_all()
+    clear_cache()
+    statements.clear()
+    summary = [summary for summary in get_avail_summaries()
+               if summary.title == "summary product"][0]
+    assert len(db.session.identity_map) == 0
+    for statement, parameters in statements:
+        assert 'description' not in statement
+
+    assert summary.seller_email == "summary_seller@qbay.com"
+    assert get_product_description(summary.id_num) == \
+        "summary product description"
+    assert get_product_description(-1) is None
+
+
+def measure_listing(db_file, listing, size):
+    '''
+    Seed a scratch database with size products and list them in a process
+    of its own
+
+    Returns:
+        (seconds, bytes held by the list)
+    '''
+    output = subprocess.run(
+        [sys.executable, '-c', MEASURE_LISTING, str(size), listing],
+        env=dict(os.environ, db_string='sqlite:///' + str(db_file),
+                 cache_size='0'),
+        cwd=str(current_folder.parent.parent),
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+    assert int(output[0]) == size
+    return float(output[1]), int(output[2])
+
+
+def test_summaries_memory(tmp_path):
+    '''
+    Summaries of a catalog take less memory than its Products
+    '''
+    held = {listing: measure_listing(tmp_path.joinpath(listing + '.sqlite'),
+                                     listing, MEMORY_CATALOG_SIZE)[1]
+            for listing in ('products', 'summaries')}
+    assert held['summaries'] < held['products']
+
+
+@pytest.mark.benchmark
+def test_summaries_benchmark(tmp_path):
+    '''
+    Print the latency and memory of listing a large catalog as Products
+    and as summaries. The summaries take less of both.
+    '''
+    results = {}
+    print()
+    for listing in ('products', 'summaries'):
+        results[listing] = measure_listing(
+            tmp_path.joinpath(listing + '.sqlite'), listing, CATALOG_SIZE)
+        print("%d %s: %.3fs, %.1fMB"
+              % (CATALOG_SIZE, listing, results[listing][0],
+                 results[listing][1] / 2 ** 20))
+
+    assert results['summaries'][1] < results['products'][1]
+    assert results['summaries'][0] < results['products'][0]
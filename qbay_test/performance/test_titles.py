@@ -0,0 +1,247 @@
+from qbay.models import *
+from qbay.titles import (TitleIndex, complete_titles, suggest_titles,
+                         trigrams)
+import qbay.cli
+import pytest
+import random
+import time
+
+# Titles in the index the benchmarks are run on
+INDEX_SIZE = 100000
+
+# Titles of the seller whose completions are timed against the database
+COMPLETION_TITLES = 2000
+
+# Seller whose titles are suggested, and another seller
+register("TitleSeller",
+         "title_seller@qbay.com",
+         "Password99@")
+
+register("OtherTitleSeller",
+         "other_title_seller@qbay.com",
+         "Password99@")
+
+for title in ["vintage desk lamp", "wooden desk", "garden hose"]:
+    create_product(title, "a product with a long description",
+                   20.0, "title_seller@qbay.com",
+                   datetime.date(2022, 9, 29))
+
+create_product("vintage desk clock", "a product with a long description",
+               20.0, "other_title_seller@qbay.com",
+               datetime.date(2022, 9, 29))
+
+
+def test_trigrams():
+    '''
+    Titles are compared without case or extra whitespace
+    '''
+    assert trigrams("Ab  c") == trigrams(" ab c ") == \
+        {'  a', ' ab', 'ab ', 'b c', ' c '}
+
+
+def test_suggest_titles():
+    '''
+    Typos and stray spaces still find the seller's title, closest first,
+    and other sellers' titles are not suggested
+    '''
+    assert suggest_titles("title_seller@qbay.com", "vintage  desk lamp ") \
+        == ["vintage desk lamp"]
+    assert suggest_titles("title_seller@qbay.com", "vintge desk lmp")[0] == \
+        "vintage desk lamp"
+    assert suggest_titles("title_seller@qbay.com", "desk") == \
+        ["wooden desk", "vintage desk lamp"]
+    assert suggest_titles("title_seller@qbay.com", "desk", count=1) == \
+        ["wooden desk"]
+    assert suggest_titles("title_seller@qbay.com", "quartz") == []
+
+
+def test_suggestions_kept_in_step(statements):
+    '''
+    The index is built with one query and then patched by create_product
+    and update_product without reading it again
+    '''
+    suggest_titles("title_seller@qbay.com", "garden")
+    statements.clear()
+    assert create_product("garden rake", "a product with a long description",
+                          20.0, "title_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+    assert update_product("garden hose", 20.0, "title_seller@qbay.com",
+                          {'title': "garden hosepipe"}) is True
+    written = len(statements)
+
+    assert suggest_titles("title_seller@qbay.com", "garden hosepip") == \
+        ["garden hosepipe", "garden rake"]
+    assert suggest_titles("title_seller@qbay.com", "rake") == \
+        ["garden rake"]
+    assert [statement for statement, _ in statements[written:]
+            if 'data_version' not in statement] == []
+
+
+def test_complete_titles(statements):
+    '''
+    Titles are completed from the seller's own, ignoring case, and kept
+    in step with create_product and update_product without reading them
+    again
+    '''
+    assert complete_titles("title_seller@qbay.com", "Vintage") == \
+        ["vintage desk lamp"]
+    assert complete_titles("title_seller@qbay.com", "") == \
+        complete_titles("title_seller@qbay.com", "", count=10)
+    assert complete_titles("title_seller@qbay.com", "vintage desk c") == []
+
+    statements.clear()
+    assert create_product("vintage desk chair",
+                          "a product with a long description",
+                          20.0, "title_seller@qbay.com",
+                          datetime.date(2022, 9, 29)) is True
+    assert update_product("vintage desk lamp", 20.0, "title_seller@qbay.com",
+                          {'title': "vintage floor lamp"}) is True
+    written = len(statements)
+
+    assert complete_titles("title_seller@qbay.com", "vintage ") == \
+        ["vintage desk chair", "vintage floor lamp"]
+    assert complete_titles("title_seller@qbay.com", "vintage", count=1) == \
+        ["vintage desk chair"]
+    assert [statement for statement, _ in statements[written:]
+            if 'data_version' not in statement] == []
+
+
+def test_title_completer():
+    '''
+    The CLI's completer gives readline each completion of the whole line
+    in turn
+    '''
+    complete = qbay.cli.title_completer(login("title_seller@qbay.com",
+                                              "Password99@"))
+    assert [complete("garden h", state) for state in range(3)] == \
+        ["garden hosepipe", None, None]
+    assert complete("vintage desk", 0) == "vintage desk chair"
+
+
+def test_update_product_page_suggests(monkeypatch, capsys):
+    '''
+    The update page offers the closest titles when the one typed does not
+    exist, and goes on to update the one picked
+    '''
+    answers = iter(["woodn desk", "1", "3", "25", ""])
+    monkeypatch.setattr('builtins.input', lambda *args: next(answers))
+    qbay.cli.update_product_page(login("title_seller@qbay.com",
+                                       "Password99@"))
+    output = capsys.readouterr().out
+    assert "Did you mean:\n1. wooden desk\n" in output
+    assert Product.query.filter_by(title="wooden desk").first().price == 25.0
+
+
+def made_up_titles(count):
+    '''
+    Titles of three words from a large made up vocabulary, so that a
+    title shares trigrams with only a small part of the others
+    '''
+    generator = random.Random(0)
+    vocabulary = [''.join(generator.choice('abcdefghijklmnopqrstuvwxyz')
+                          for _ in range(7)) for _ in range(5000)]
+    return [' '.join(generator.sample(vocabulary, 3)) for _ in range(count)]
+
+
+def mistyped(title):
+    '''
+    The title with a letter dropped and two swapped
+    '''
+    return title[:2] + title[3] + title[2] + title[5:]
+
+
+def test_similar_titles():
+    '''
+    The index finds a title typed with mistakes among many made up ones
+    '''
+    titles = made_up_titles(5000)
+    index = TitleIndex(enumerate(titles))
+    assert index.similar(mistyped(titles[4242]), 5)[0] == titles[4242]
+
+
+@pytest.mark.benchmark
+def test_similar_benchmark():
+    '''
+    Print the time of finding the closest titles with the index and by
+    comparing against every title. Only titles sharing a trigram are
+    looked at, so the index is faster.
+    '''
+    titles = made_up_titles(INDEX_SIZE)
+    index = TitleIndex(enumerate(titles))
+    # the title of product 4242 typed with mistakes
+    typed = mistyped(titles[4242])
+
+    start = time.perf_counter()
+    found = index.similar(typed, 5)
+    indexed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    grams = trigrams(typed)
+    scores = []
+    for id_num, other in enumerate(titles):
+        other = trigrams(other)
+        scores.append((2 * len(grams & other) / (len(grams) + len(other)),
+                       -id_num))
+    scanned = time.perf_counter() - start
+
+    print("\nclosest of %d titles: index %.1fms, scan %.1fms"
+          % (INDEX_SIZE, indexed * 1e3, scanned * 1e3))
+    assert found[0] == titles[4242]
+    assert indexed < scanned
+
+
+def create_titles(name, count):
+    '''
+    Give the other seller count products named name and a number, and
+    return prefixes of their titles
+    '''
+    for i in range(count):
+        create_product(name + " " + str(i),
+                       "a product with a long description",
+                       20.0, "other_title_seller@qbay.com",
+                       datetime.date(2022, 9, 29))
+    return [name + " 1" + str(i) for i in range(100)]
+
+
+def query_completions(prefixes):
+    '''
+    Complete each prefix with a query on the database
+    '''
+    return [[product.title for product in Product.query
+             .filter(Product.seller_email == "other_title_seller@qbay.com",
+                     Product.title.like(prefix + '%'))
+             .order_by(Product.title).limit(50)]
+            for prefix in prefixes]
+
+
+def test_complete_titles_as_database():
+    '''
+    The index completes titles the same as a prefix query on the database
+    '''
+    prefixes = create_titles("checked product", 300)
+    assert [complete_titles("other_title_seller@qbay.com", prefix)
+            for prefix in prefixes] == query_completions(prefixes)
+
+
+@pytest.mark.benchmark
+def test_complete_benchmark():
+    '''
+    Print the time of completing a title from the index and with a prefix
+    query on the database. The index is faster.
+    '''
+    prefixes = create_titles("completion product", COMPLETION_TITLES)
+    complete_titles("other_title_seller@qbay.com", "")
+
+    start = time.perf_counter()
+    indexed = [complete_titles("other_title_seller@qbay.com", prefix)
+               for prefix in prefixes]
+    from_index = (time.perf_counter() - start) / len(prefixes)
+
+    start = time.perf_counter()
+    queried = query_completions(prefixes)
+    from_database = (time.perf_counter() - start) / len(prefixes)
+
+    print("\ncompletion of %d titles: index %.1fus, database %.1fus"
+          % (COMPLETION_TITLES, from_index * 1e6, from_database * 1e6))
+    assert indexed == queried
+    assert from_index < from_database